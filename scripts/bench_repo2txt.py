@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for repo2txt.
+
+Generates synthetic repositories at configurable scales and shapes, then times
+the three engine stages in isolation: rule matching
+(`VisibilityMatcher.get_visibility`), traversal (`RepoScanner.scan`) and
+rendering (`XMLRepoRenderer.render`). Results can be saved as a JSON baseline
+and later runs compared against it, flagging stages that slowed down by more
+than a threshold.
+
+Examples:
+    bench_repo2txt.py --scale 1k 100k --shape wide deep --save baseline.json
+    bench_repo2txt.py --scale 1k 100k --shape wide deep --compare baseline.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    from scripts import repo2txt
+except ImportError:  # Executed directly from the scripts directory.
+    import repo2txt
+
+BASELINE_VERSION = 1
+
+# Settings that change the measured work; baselines only compare when they agree.
+COMPARED_SETTINGS = ("ignore_patterns", "binary_ratio", "file_bytes", "jobs")
+
+SCALES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+# (directory depth, files per directory) for each tree shape.
+SHAPES = {"wide": (2, 250), "deep": (16, 4), "mixed": (5, 40)}
+
+TEXT_EXTENSIONS = [".py", ".md", ".js", ".json", ".txt", ".yaml", ".log"]
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """Parameters of one synthetic repository."""
+    scale: str
+    shape: str
+    ignore_patterns: int
+    binary_ratio: float
+    file_bytes: int
+
+    @property
+    def name(self) -> str:
+        return f"{self.scale}-{self.shape}"
+
+    def key(self) -> str:
+        """Identifies generated trees on disk so they can be reused across runs."""
+        return f"{self.name}-i{self.ignore_patterns}-b{self.binary_ratio:g}-s{self.file_bytes}"
+
+
+@dataclass
+class Measurement:
+    """Timings of one stage over repeated runs."""
+    min_s: float
+    median_s: float
+    items: int
+
+    @property
+    def per_item_us(self) -> float:
+        return self.min_s / max(self.items, 1) * 1_000_000
+
+
+def generate_repository(root: Path, scenario: Scenario, seed: int = 0) -> List[str]:
+    """Writes a deterministic synthetic tree and returns its file paths relative to root.
+
+    Directory i is placed at the base-`fanout` digits of i, so every shape spreads
+    files evenly over `depth` levels. A share of files are binaries: half carry a
+    media extension that rules ghost by name, half are sniffed by content.
+    """
+    rng = random.Random(seed)
+    total = SCALES[scenario.scale]
+    depth, per_dir = SHAPES[scenario.shape]
+    n_dirs = max(1, math.ceil(total / per_dir))
+    fanout = max(2, math.ceil(n_dirs ** (1 / depth)))
+
+    text_body = ("value = 'synthetic'  # padding\n" * (scenario.file_bytes // 32 + 1))[:scenario.file_bytes].encode("utf-8")
+    binary_body = b"\x00\x01\x02\x03" * (scenario.file_bytes // 4 + 1)
+
+    rel_paths: List[str] = []
+    for i in range(n_dirs):
+        digits = []
+        n = i
+        for _ in range(depth):
+            digits.append(f"d{n % fanout}")
+            n //= fanout
+        rel_dir = "/".join(reversed(digits))
+        (root / rel_dir).mkdir(parents=True, exist_ok=True)
+        for j in range(min(per_dir, total - len(rel_paths))):
+            roll = rng.random()
+            if roll < scenario.binary_ratio / 2:
+                name, body = f"image_{j}.png", binary_body
+            elif roll < scenario.binary_ratio:
+                name, body = f"blob_{j}.dat", binary_body
+            else:
+                name, body = f"file_{j}{TEXT_EXTENSIONS[j % len(TEXT_EXTENSIONS)]}", text_body
+            rel_path = f"{rel_dir}/{name}"
+            (root / rel_path).write_bytes(body)
+            rel_paths.append(rel_path)
+
+    (root / ".gitignore").write_text("\n".join(ignore_patterns(scenario.ignore_patterns, fanout, rng)) + "\n", encoding="utf-8")
+    return rel_paths
+
+
+def ignore_patterns(count: int, fanout: int, rng: random.Random) -> List[str]:
+    """Builds a large ignore file mixing literal, affix, anchored and wildcard rules.
+
+    Nearly all patterns miss, as in real ignore files; `*.log` matches one text
+    extension so the matcher also has work to report.
+    """
+    patterns = ["*.log"]
+    kinds = [
+        lambda i: f"generated_{i}/",
+        lambda i: f"*.tmp{i}",
+        lambda i: f"cache_{i}*",
+        lambda i: f"/d{rng.randrange(fanout)}/d{rng.randrange(fanout)}/build_{i}",
+        lambda i: f"d*/artifact_{i}_?.out",
+        lambda i: f"**/scratch_{i}/**",
+    ]
+    for i in range(count - 1):
+        patterns.append(kinds[i % len(kinds)](i))
+    return patterns
+
+
+def prepare(workdir: Path, scenario: Scenario) -> Tuple[Path, List[str]]:
+    """Returns a generated repository for the scenario, reusing one from a previous run."""
+    root = workdir / scenario.key()
+    manifest = workdir / f"{scenario.key()}.files"
+    if manifest.exists():
+        return root, manifest.read_text(encoding="utf-8").splitlines()
+
+    if root.exists():
+        shutil.rmtree(root)
+    root.mkdir(parents=True)
+    started = time.perf_counter()
+    rel_paths = generate_repository(root, scenario)
+    manifest.write_text("\n".join(rel_paths) + "\n", encoding="utf-8")
+    print(f"[bench] Generated {scenario.key()} ({len(rel_paths)} files) in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return root, rel_paths
+
+
+def measure(fn: Callable[[], int], repeat: int) -> Measurement:
+    """Runs fn `repeat` times; fn returns the number of items it processed."""
+    timings = []
+    items = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        items = fn()
+        timings.append(time.perf_counter() - started)
+    return Measurement(min(timings), statistics.median(timings), items)
+
+
+def bench_scenario(root: Path, rel_paths: List[str], repeat: int, jobs: int) -> Dict[str, Measurement]:
+    """Times matching, scanning and rendering of one generated repository."""
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        args = repo2txt.build_parser().parse_args(["."])
+        scope_positions: Dict[str, int] = {}
+        rules = repo2txt.build_rules(args, scope_positions)
+
+        def match() -> int:
+            matcher = repo2txt.VisibilityMatcher(rules)
+            for rel_path in rel_paths:
+                matcher.get_visibility(rel_path)
+            return len(rel_paths)
+
+        scanned: List[Tuple[repo2txt.DirectoryNode, List[Path], List[Tuple[Path, str]]]] = []
+
+        def scan() -> int:
+            matcher = repo2txt.VisibilityMatcher(rules, scope_positions)
+            scanner = repo2txt.RepoScanner(root, matcher, repo2txt.Telemetry(), None, 2 * 1024 * 1024, None)
+            scanned[:] = [scanner.scan([root])]
+            return len(rel_paths)
+
+        def render() -> int:
+            tree, included, redacted = scanned[0]
+            renderer = repo2txt.XMLRepoRenderer(root, repo2txt.Telemetry(), None, jobs)
+            with open(os.devnull, "wb") as sink:
+                renderer.render(tree, included, redacted, [root], sink)
+            return len(included) + len(redacted)
+
+        return {"match": measure(match, repeat), "scan": measure(scan, repeat), "render": measure(render, repeat)}
+    finally:
+        os.chdir(cwd)
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], threshold: float) -> List[str]:
+    """Prints a comparison table and returns the names of regressed benchmarks."""
+    regressions = []
+    print(f"{'benchmark':<24} {'baseline':>12} {'current':>12} {'delta':>9}")
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:<24} {'-':>12} {current['min_s']:>11.4f}s {'new':>9}")
+            continue
+        delta = current["min_s"] / previous["min_s"] - 1 if previous["min_s"] else 0.0
+        flag = ""
+        if delta > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<24} {previous['min_s']:>11.4f}s {current['min_s']:>11.4f}s {delta:>+8.1%}{flag}")
+    return regressions
+
+
+def load_baseline(path: Path, settings: Dict[str, object]) -> Dict[str, Dict[str, float]]:
+    """Reads a saved baseline recorded with the same generation and run settings.
+
+    Raises:
+        ValueError: If the file was written by an incompatible harness version or
+            with settings that make its timings incomparable.
+    """
+    data = json.loads(path.read_text(encoding="utf-8"))
+    if data.get("version") != BASELINE_VERSION:
+        raise ValueError(f"Unsupported baseline version in {path}: {data.get('version')}")
+    saved = data.get("settings", {})
+    differing = [f"{k}={saved.get(k)!r} (now {v!r})" for k, v in settings.items() if k in COMPARED_SETTINGS and saved.get(k) != v]
+    if differing:
+        raise ValueError(f"Baseline {path} was recorded with different settings: {', '.join(differing)}")
+    return data["results"]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks repo2txt matching, scanning and rendering on synthetic repositories.")
+    parser.add_argument("--scale", nargs="+", choices=sorted(SCALES, key=SCALES.get), default=["1k"], help="Repository sizes in files.")
+    parser.add_argument("--shape", nargs="+", choices=sorted(SHAPES), default=["wide", "deep"], help="Tree shapes to generate.")
+    parser.add_argument("--ignore-patterns", type=int, default=500, help="Number of patterns in the generated .gitignore.")
+    parser.add_argument("--binary-ratio", type=float, default=0.1, help="Share of generated files that are binaries.")
+    parser.add_argument("--file-bytes", type=int, default=512, help="Size of each generated file.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark; the fastest is reported.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Worker threads passed to the renderer.")
+    parser.add_argument("--workdir", type=str, help="Where generated repositories are kept for reuse (defaults to a temporary directory).")
+    parser.add_argument("--save", type=str, help="Write results as a JSON baseline.")
+    parser.add_argument("--compare", type=str, help="Compare against a JSON baseline and exit non-zero on regressions.")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown that counts as a regression (default: 0.10).")
+    args = parser.parse_args(argv)
+    settings = {k: getattr(args, k) for k in ("ignore_patterns", "binary_ratio", "file_bytes", "repeat", "jobs")}
+
+    try:
+        baseline = load_baseline(Path(args.compare), settings) if args.compare else None
+    except (OSError, ValueError) as e:
+        print(f"Configuration Error: {e}", file=sys.stderr)
+        return 1
+
+    tmp = None if args.workdir else tempfile.TemporaryDirectory(prefix="repo2txt-bench-")
+    workdir = Path(args.workdir or tmp.name)
+    results: Dict[str, Dict[str, float]] = {}
+    try:
+        for scale in args.scale:
+            for shape in args.shape:
+                scenario = Scenario(scale, shape, args.ignore_patterns, args.binary_ratio, args.file_bytes)
+                root, rel_paths = prepare(workdir, scenario)
+                for stage, m in bench_scenario(root, rel_paths, args.repeat, args.jobs).items():
+                    results[f"{scenario.name}/{stage}"] = {**asdict(m), "per_item_us": m.per_item_us}
+                    print(f"{scenario.name + '/' + stage:<24} {m.min_s:>10.4f}s  {m.per_item_us:>9.2f} us/item", file=sys.stderr)
+    finally:
+        if tmp:
+            tmp.cleanup()
+
+    if args.save:
+        report = {
+            "version": BASELINE_VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": settings,
+            "results": results,
+        }
+        Path(args.save).write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print(f"[bench] Baseline written to {args.save}", file=sys.stderr)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"[bench] {len(regressions)} regression(s) above {args.threshold:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
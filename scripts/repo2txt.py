@@ -9,21 +9,73 @@ context window limits while preserving structural directory information.
 
 Features:
 - Visibility-based filtering (Pruned, Ghosted, Redacted, Included).
+- Nested .gitignore/.llmignore files scoped to their own subtrees.
 - Configurable per-file and global output size limits.
-- Resilient multi-pass text decoding and binary detection.
+- Head and tail excerpts of oversized files, read with seeks.
+- Resilient multi-pass text decoding and sampled binary detection.
+- Optional worker pool for concurrent file reading with ordered output.
+- Persistent render cache that skips unchanged files across runs.
+- Optional content deduplication that references repeated files.
+- Local server mode that answers repeated extractions from warm caches.
+- Multi-process scanning of top-level subtrees.
+- Delta snapshots of files changed since a git ref or an earlier manifest.
+- Watch mode that keeps the output current by re-rendering changed files.
+- Git index enumeration that never visits untracked trees.
+- Snapshots of any git revision, read through one persistent cat-file process.
+- Tar and zip archive targets scanned in place, without extracting to disk.
+- Streaming mode that renders files as they are discovered.
+- Token-budget packing that prioritizes files instead of truncating.
+- Stat-only output size estimates per directory for --dry-run.
+- Sharded output into size-bounded, self-contained parts written concurrently.
+- Compressed output sinks (gzip, xz, zstd) chosen by output extension.
 - Transactional XML rendering to guarantee well-formed outputs.
+- Per-phase profiling, rule counters and latency histograms as JSON.
+- Rule diagnostics: per-rule hit counts and timings, and per-path decision chains.
 - Comprehensive telemetry and interactive session safeguards.
 """
 
 import argparse
+import ctypes
+import ctypes.util
+import errno
+import gzip
+import hashlib
+import heapq
+import http.server
+import io
+import json
+import lzma
+import math
+import mmap
 import os
 import re
+import select
+import socketserver
+import sqlite3
+import stat
+import struct
+import subprocess
 import sys
-from dataclasses import dataclass, field
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing, contextmanager, nullcontext
+from functools import partial
+from itertools import chain
+from dataclasses import asdict, dataclass, field, fields, replace
 from datetime import datetime, timezone
 from enum import Enum, auto
 from pathlib import Path
-from typing import Optional, Tuple, List, Dict, Set, TextIO
+from typing import BinaryIO, Callable, Deque, Iterable, Iterator, Optional, Tuple, List, Dict, Set, Type, Union
+
+try:
+    import zstandard
+except ImportError:  # Optional: only needed for .zst outputs.
+    zstandard = None
 
 
 # ==============================================================================
@@ -63,6 +115,24 @@ DEFAULT_GHOST_COMPILED = ["*.exe", "*.dll", "*.so", "*.dylib", "*.class", "*.jar
 # Security exclusion ruleset
 DEFAULT_REDACT_SECRETS = [".env*", "*.pem", "id_rsa", "id_ed25519", "*.key", "secrets.json", "credentials.xml"]
 
+# Ignore files honoured in every scanned directory, with the visibility their patterns assign.
+SCOPED_IGNORE_FILES: Dict[str, Visibility] = {".gitignore": Visibility.GHOSTED, ".llmignore": Visibility.PRUNED}
+
+# Buffer size for file output sinks; chunks arrive already UTF-8 encoded.
+OUTPUT_BUFFER_BYTES = 1024 * 1024
+
+# Compressed output formats selected by extension, with their valid level ranges.
+COMPRESSION_LEVELS: Dict[str, Tuple[int, int]] = {".gz": (0, 9), ".xz": (0, 9), ".zst": (1, 22)}
+
+# Archive targets scanned member by member, by file name suffix.
+ARCHIVE_SUFFIXES: Dict[str, str] = {
+    ".zip": "zip", ".tar": "tar", ".tar.gz": "tar", ".tgz": "tar", ".tar.bz2": "tar", ".tbz2": "tar", ".tar.xz": "tar", ".txz": "tar",
+}
+
+# Widest directory-tree line prefix per ancestor ("│   ") and connector ("├── "), in UTF-8 bytes.
+TREE_PREFIX_BYTES = len("│   ".encode("utf-8"))
+TREE_CONNECTOR_BYTES = len("├── ".encode("utf-8"))
+
 
 # ==============================================================================
 # DATA STRUCTURES
@@ -93,6 +163,62 @@ def parse_size_to_bytes(size_str: Optional[str], default_bytes: int) -> int:
     return int(val * multipliers[unit])
 
 
+def output_compression(output: Optional[Path], level: Optional[int], threads: int) -> Optional[str]:
+    """Returns the compression suffix implied by an output path, validating options.
+
+    Raises:
+        ValueError: If the level or thread count does not suit the format, or the
+            format needs an optional package that is not installed.
+    """
+    suffix = output.suffix.lower() if output else ""
+    if suffix not in COMPRESSION_LEVELS:
+        if level is not None or threads:
+            raise ValueError("--compress-level and --compress-threads need a .gz, .xz or .zst output.")
+        return None
+    low, high = COMPRESSION_LEVELS[suffix]
+    if level is not None and not low <= level <= high:
+        raise ValueError(f"Compression level for {suffix} must be between {low} and {high}.")
+    if threads and suffix != ".zst":
+        raise ValueError("--compress-threads is only supported for .zst outputs.")
+    if suffix == ".zst" and zstandard is None:
+        raise ValueError("Writing .zst output requires the 'zstandard' package.")
+    return suffix
+
+
+def shard_path(output: Path, index: int, compression: Optional[str]) -> Path:
+    """Names one part of a sharded output, e.g. snapshot.xml.gz -> snapshot.003.xml.gz."""
+    name, tail = output.name, ""
+    if compression:
+        name, tail = name[:-len(compression)], name[-len(compression):]
+    stem, dot, ext = name.rpartition(".")
+    if not stem:
+        stem, dot, ext = name, "", ""
+    return output.with_name(f"{stem}.{index:03d}{dot}{ext}{tail}")
+
+
+def existing_shards(output: Path, compression: Optional[str], start: int = 1) -> Iterator[Path]:
+    """Yields the consecutive parts of a sharded output present on disk, from index start."""
+    index = start
+    while True:
+        part = shard_path(output, index, compression)
+        if not part.exists():
+            return
+        yield part
+        index += 1
+
+
+def open_output_sink(output: Path, compression: Optional[str], level: Optional[int], threads: int) -> BinaryIO:
+    """Opens the output file, streaming through a compressor when one is selected."""
+    if compression == ".gz":
+        return gzip.GzipFile(output, "wb", compresslevel=9 if level is None else level, mtime=0)
+    if compression == ".xz":
+        return lzma.LZMAFile(output, "wb", preset=level)
+    if compression == ".zst":
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level, threads=threads)
+        return compressor.stream_writer(open(output, "wb", buffering=OUTPUT_BUFFER_BYTES))
+    return open(output, "wb", buffering=OUTPUT_BUFFER_BYTES)
+
+
 @dataclass(frozen=True)
 class Rule:
     """Compiled pattern rule and its associated visibility assignment."""
@@ -105,6 +231,20 @@ class Rule:
     reason: Optional[str] = None
 
 
+@dataclass
+class RuleScope:
+    """Rules from a nested ignore file, applying only beneath the directory holding it.
+
+    ``position`` is the number of base rules that rank below this scope; deeper
+    scopes rank above shallower ones at the same position.
+    """
+    rel_dir: str
+    depth: int
+    position: int
+    rules: List[Rule]
+    index: "RuleIndex"
+
+
 @dataclass
 class DirectoryNode:
     """Tree node representing a directory hierarchy."""
@@ -112,6 +252,145 @@ class DirectoryNode:
     directories: Dict[str, "DirectoryNode"] = field(default_factory=dict)
     files: Set[str] = field(default_factory=set)
 
+    def insert(self, rel_path: str, is_file: bool) -> "DirectoryNode":
+        """Adds a path below this node, creating intermediate directories.
+
+        Returns:
+            The node of the deepest directory on the path.
+        """
+        parts = [p for p in rel_path.split("/") if p]
+        node = self
+        for i, part in enumerate(parts):
+            if i == len(parts) - 1 and is_file:
+                node.files.add(part)
+            else:
+                if part not in node.directories:
+                    node.directories[part] = DirectoryNode(part)
+                node = node.directories[part]
+        return node
+
+    def merge(self, other: "DirectoryNode") -> None:
+        """Folds another tree rooted at the same directory into this one."""
+        self.files |= other.files
+        for name, child in other.directories.items():
+            if name in self.directories:
+                self.directories[name].merge(child)
+            else:
+                self.directories[name] = child
+
+
+# (st_dev, st_ino, st_size, st_mtime_ns) used to detect unchanged files.
+FileIdentity = Tuple[int, int, int, int]
+
+# A scanned file and its redaction reason, or None when the file is included.
+ScanEntry = Tuple[Path, Optional[str]]
+
+
+@dataclass(frozen=True)
+class RenderedFile:
+    """Rendered, UTF-8 encoded <file> chunk for an included path and its read results."""
+    xml: Optional[bytes]
+    line_count: int
+    is_binary: bool
+    excerpted: bool = False
+
+
+@dataclass(frozen=True)
+class ExcerptPolicy:
+    """Head and tail kept of files over the per-file limit, cut at line boundaries.
+
+    Each side reads at most side_bytes; with side_lines set, a side stops
+    earlier once it holds that many lines.
+    """
+    threshold: int
+    side_bytes: int
+    side_lines: Optional[int] = None
+
+    def applies(self, size: int) -> bool:
+        return size > self.threshold
+
+
+@dataclass(frozen=True)
+class Excerpt:
+    """Decoded head and tail of a file, and the bytes left out between them."""
+    head: str
+    tail: str
+    line_count: int
+    bytes_omitted: int
+
+
+@dataclass
+class TokenWeights:
+    """Priority weights used when packing files into a token budget."""
+    depth: float = 0.25
+    recency: float = 0.0
+    extensions: Dict[str, float] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, specs: Optional[List[str]]) -> "TokenWeights":
+        """Parses 'key=value' specs, where key is depth, recency or a file extension.
+
+        Raises:
+            ValueError: If a spec is malformed.
+        """
+        weights = cls()
+        for spec in specs or []:
+            key, sep, raw_val = spec.partition("=")
+            try:
+                val = float(raw_val) if sep else None
+            except ValueError:
+                val = None
+            if val is None or not key:
+                raise ValueError(f"Invalid token weight: {spec}. Use e.g. 'depth=0.5', 'recency=1', '.md=2'.")
+
+            if key == "depth":
+                weights.depth = val
+            elif key == "recency":
+                weights.recency = val
+            else:
+                weights.extensions[key if key.startswith(".") else f".{key}"] = val
+        return weights
+
+
+@dataclass
+class ExtractionLimits:
+    """Size, budget and compression settings resolved from CLI arguments."""
+    max_bytes: Optional[int]
+    max_file_bytes: int
+    cache_bytes: int
+    token_weights: TokenWeights
+    compression: Optional[str]
+    shard_bytes: Optional[int] = None
+    excerpt: Optional[ExcerptPolicy] = None
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "ExtractionLimits":
+        """Parses the size-like options of an argument namespace.
+
+        Raises:
+            ValueError: If any size, weight or compression option is invalid.
+        """
+        max_file_bytes = parse_size_to_bytes(args.max_file_size, 2 * 1024 * 1024)
+        excerpt = None
+        if args.excerpt:
+            side_bytes = parse_size_to_bytes(args.excerpt, 0)
+            if not 0 < side_bytes <= max_file_bytes // 2:
+                raise ValueError(f"--excerpt must be between 1 byte and half of --max-file-size ({max_file_bytes // 2} bytes).")
+            excerpt = ExcerptPolicy(max_file_bytes, side_bytes)
+        elif args.excerpt_lines:
+            if args.excerpt_lines < 1:
+                raise ValueError("--excerpt-lines must be at least 1.")
+            excerpt = ExcerptPolicy(max_file_bytes, max_file_bytes // 2, args.excerpt_lines)
+        return cls(
+            max_bytes=parse_size_to_bytes(args.max_size, 0) if args.max_size else None,
+            max_file_bytes=max_file_bytes,
+            cache_bytes=parse_size_to_bytes(args.cache_size, 256 * 1024 * 1024),
+            token_weights=TokenWeights.parse(args.token_weights),
+            compression=output_compression(Path(args.output) if args.output else None, args.compress_level, args.compress_threads),
+            shard_bytes=parse_size_to_bytes(args.shard_size, 0) if args.shard_size else None,
+            excerpt=excerpt,
+        )
+
 
 @dataclass
 class Telemetry:
@@ -124,6 +403,21 @@ class Telemetry:
     secrets_redacted: int = 0
     limit_reached: bool = False
     bytes_written: int = 0
+    compressed_bytes: int = 0
+    cache_hits: int = 0
+    duplicate_files: int = 0
+    unchanged_files: int = 0
+    deleted_files: int = 0
+    output_parts: int = 0
+    estimated_bytes: int = 0
+    estimated_tokens: int = 0
+    excerpted_files: int = 0
+
+    def merge(self, other: "Telemetry") -> None:
+        """Adds the counters of another tracker, e.g. from a scan worker."""
+        for f in fields(self):
+            mine, theirs = getattr(self, f.name), getattr(other, f.name)
+            setattr(self, f.name, (mine or theirs) if isinstance(mine, bool) else mine + theirs)
 
     def print_summary(self) -> None:
         """Outputs a formatted telemetry summary to stderr."""
@@ -136,9 +430,26 @@ class Telemetry:
         print(f" Paths Ghosted       : {self.ghosted_paths}", file=sys.stderr)
         print(f" Files Redacted      : {self.redacted_files}", file=sys.stderr)
         print(f" Paths Pruned        : {self.pruned_paths}", file=sys.stderr)
+        if self.cache_hits:
+            print(f" Cache Hits          : {self.cache_hits}", file=sys.stderr)
+        if self.duplicate_files:
+            print(f" Duplicate Files     : {self.duplicate_files}", file=sys.stderr)
+        if self.excerpted_files:
+            print(f" Files Excerpted     : {self.excerpted_files}", file=sys.stderr)
+        if self.unchanged_files or self.deleted_files:
+            print(f" Unchanged Files     : {self.unchanged_files}", file=sys.stderr)
+            print(f" Deleted Files       : {self.deleted_files}", file=sys.stderr)
 
         output_mb = self.bytes_written / (1024 * 1024)
         print(f" Output Size         : {output_mb:.2f} MB", file=sys.stderr)
+        if self.output_parts:
+            print(f" Output Parts        : {self.output_parts}", file=sys.stderr)
+        if self.compressed_bytes:
+            print(f" Compressed Size     : {self.compressed_bytes / (1024 * 1024):.2f} MB", file=sys.stderr)
+        if self.estimated_bytes:
+            print(f" Estimated Size      : {self.estimated_bytes / (1024 * 1024):.2f} MB", file=sys.stderr)
+        if self.estimated_tokens:
+            print(f" Estimated Tokens    : {self.estimated_tokens}", file=sys.stderr)
 
         if self.limit_reached:
             print(file=sys.stderr)
@@ -154,15 +465,320 @@ class Telemetry:
         print(file=sys.stderr)
 
 
+class RunStats:
+    """Profiling data collected for --stats-json.
+
+    Phases accumulate wall seconds and the CPU time of the thread that ran them.
+    Phases nest: match runs inside scan, and read, format and write inside
+    render. read and format run on worker threads with -j, so their totals are
+    summed across threads rather than elapsed.
+    """
+
+    def __init__(self, top_n: int = 10):
+        self.top_n = top_n
+        self.phases: Dict[str, List[float]] = {}
+        # (source, pattern, visibility) -> [decisions won, seconds spent deciding]
+        self.rules: Dict[Tuple[str, str, str], List[float]] = {}
+        self.size_histogram: Dict[int, int] = {}
+        self.latency_histogram: Dict[int, int] = {}
+        self.slowest: List[Tuple[float, str, int]] = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, object]:
+        # Shipped to scan worker processes; the lock is recreated on arrival.
+        return {k: v for k, v in self.__dict__.items() if k != "_lock"}
+
+    def __setstate__(self, state: Dict[str, object]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    def add_phase(self, name: str, wall: float, cpu: float) -> None:
+        with self._lock:
+            totals = self.phases.setdefault(name, [0.0, 0.0, 0])
+            totals[0] += wall
+            totals[1] += cpu
+            totals[2] += 1
+
+    def record_match(self, rule: Optional[Rule], seconds: float) -> None:
+        """Credits one visibility decision to the rule that won it, or to no rule."""
+        key = (rule.reason or "", rule.raw, rule.visibility.name) if rule else ("", "", Visibility.INCLUDED.name)
+        totals = self.rules.get(key)
+        if totals is None:
+            totals = self.rules[key] = [0, 0.0]
+        totals[0] += 1
+        totals[1] += seconds
+
+    def record_file(self, rel_path: str, size: int, seconds: float) -> None:
+        """Adds one file read to the histograms and the slowest-N list."""
+        size_bucket = 1 << size.bit_length()
+        latency_bucket = 1 << int(seconds * 1_000_000).bit_length()
+        with self._lock:
+            self.size_histogram[size_bucket] = self.size_histogram.get(size_bucket, 0) + 1
+            self.latency_histogram[latency_bucket] = self.latency_histogram.get(latency_bucket, 0) + 1
+            if len(self.slowest) < self.top_n:
+                heapq.heappush(self.slowest, (seconds, rel_path, size))
+            elif self.slowest and seconds > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (seconds, rel_path, size))
+
+    def merge_rules(self, other: "RunStats") -> None:
+        """Adds rule counters and match time gathered by a scan worker process."""
+        for key, (wins, seconds) in other.rules.items():
+            totals = self.rules.setdefault(key, [0, 0.0])
+            totals[0] += wins
+            totals[1] += seconds
+        if "match" in other.phases:
+            wall, cpu, calls = other.phases["match"]
+            with self._lock:
+                totals = self.phases.setdefault("match", [0.0, 0.0, 0])
+                totals[0] += wall
+                totals[1] += cpu
+                totals[2] += calls
+
+    def to_dict(self, telemetry: Telemetry, wall: float, cpu: float) -> Dict[str, object]:
+        return {
+            "total": {"wall_s": wall, "cpu_s": cpu},
+            "phases": {name: {"wall_s": w, "cpu_s": c, "calls": n} for name, (w, c, n) in sorted(self.phases.items())},
+            "rules": [
+                {"source": src, "pattern": pat, "visibility": vis, "wins": n, "seconds": sec}
+                for (src, pat, vis), (n, sec) in sorted(self.rules.items(), key=lambda kv: -kv[1][1])
+            ],
+            "file_size_bytes": [{"le": b, "count": n} for b, n in sorted(self.size_histogram.items())],
+            "read_latency_us": [{"le": b, "count": n} for b, n in sorted(self.latency_histogram.items())],
+            "slowest_files": [{"path": p, "seconds": sec, "bytes": size} for sec, p, size in sorted(self.slowest, reverse=True)],
+            "telemetry": asdict(telemetry),
+        }
+
+
 # ==============================================================================
 # ENGINE COMPONENTS
 # ==============================================================================
 
+class RuleIndex:
+    """Combined lookup engine answering "which rule matched last?" for a rule list.
+
+    Literal rules are hashed by the path fragment they must equal: anchored
+    literals by path prefix, unanchored literals by component window, and
+    ``*suffix`` / ``prefix*`` rules by component affix. Only rules that contain
+    true wildcards fall back to their regex, and those are tried from the highest
+    index downward so evaluation stops at the first hit that can still win.
+    """
+
+    WILDCARDS = frozenset("*?[]\\")
+
+    def __init__(self, rules: List[Rule]):
+        self.anchored: Dict[str, int] = {}
+        self.segments: Dict[str, int] = {}
+        self.segment_widths: Set[int] = set()
+        self.suffixes: Dict[str, int] = {}
+        self.prefixes: Dict[str, int] = {}
+        self.fallback: List[Tuple[int, re.Pattern[str]]] = []
+
+        for idx, rule in enumerate(rules):
+            pat = rule.pattern
+            if pat and not self.WILDCARDS.intersection(pat):
+                if rule.anchored:
+                    self.anchored[pat] = idx
+                else:
+                    self.segments[pat] = idx
+                    self.segment_widths.add(pat.count("/") + 1)
+            elif not rule.anchored and pat.startswith("*") and self._is_affix(pat[1:]):
+                self.suffixes[pat[1:]] = idx
+            elif not rule.anchored and pat.endswith("*") and self._is_affix(pat[:-1]):
+                self.prefixes[pat[:-1]] = idx
+            else:
+                self.fallback.append((idx, rule.regex))
+
+        self.fallback.reverse()
+        self.suffix_lengths = sorted({len(k) for k in self.suffixes})
+        self.prefix_lengths = sorted({len(k) for k in self.prefixes})
+
+        # Override analysis for subtree pruning: unanchored INCLUDED/REDACTED rules
+        # can match beneath any directory, while anchored ones are kept as
+        # per-component matchers (None marks a component spanning "**").
+        self.floating_override = -1
+        self.anchored_overrides: List[Tuple[int, List[Union[str, re.Pattern[str], None]]]] = []
+        for idx, rule in enumerate(rules):
+            if rule.visibility not in (Visibility.INCLUDED, Visibility.REDACTED) or not rule.pattern:
+                continue
+            if not rule.anchored:
+                self.floating_override = idx
+            else:
+                self.anchored_overrides.append((idx, [self._component_matcher(c) for c in rule.pattern.split("/")]))
+        self.anchored_overrides.reverse()
+
+    @classmethod
+    def _component_matcher(cls, component: str) -> Union[str, re.Pattern[str], None]:
+        if "**" in component:
+            return None
+        if not cls.WILDCARDS.intersection(component):
+            return component
+        try:
+            return re.compile(VisibilityMatcher.glob_to_regex(component) + r"\Z")
+        except re.error:
+            return None
+
+    @classmethod
+    def _is_affix(cls, literal: str) -> bool:
+        return bool(literal) and "/" not in literal and not cls.WILDCARDS.intersection(literal)
+
+    def override_below(self, path: str, after: int, floating: bool = True) -> bool:
+        """Reports whether an override rule past index `after` can match beneath path.
+
+        Anchored rules are walked component by component against the directory, so
+        the answer is exact for them; unanchored rules can always match a deeper
+        basename and are only considered when `floating` is set.
+        """
+        if floating and self.floating_override > after:
+            return True
+
+        parts = path.split("/")
+        for idx, components in self.anchored_overrides:
+            if idx <= after:
+                break
+            for i, part in enumerate(parts):
+                if i == len(components):
+                    break
+                matcher = components[i]
+                if matcher is None:
+                    return True
+                if matcher != part if isinstance(matcher, str) else not matcher.match(part):
+                    break
+            else:
+                if len(components) > len(parts):
+                    return True
+        return False
+
+    def last_match(self, path: str) -> int:
+        """Returns the index of the last rule matching a normalized path, or -1."""
+        parts = path.split("/")
+        bounds: List[Tuple[int, int]] = []
+        pos = 0
+        for part in parts:
+            bounds.append((pos, pos + len(part)))
+            pos += len(part) + 1
+
+        best = -1
+        anchored, segments, suffixes, prefixes = self.anchored, self.segments, self.suffixes, self.prefixes
+
+        for i, (start, end) in enumerate(bounds):
+            if anchored:
+                best = max(best, anchored.get(path[:end], -1))
+            for width in self.segment_widths:
+                if i + width <= len(parts):
+                    best = max(best, segments.get(path[start:bounds[i + width - 1][1]], -1))
+            part = parts[i]
+            for length in self.suffix_lengths:
+                if length > len(part):
+                    break
+                best = max(best, suffixes.get(part[-length:], -1))
+            for length in self.prefix_lengths:
+                if length > len(part):
+                    break
+                best = max(best, prefixes.get(part[:length], -1))
+
+        for idx, regex in self.fallback:
+            if idx <= best:
+                break
+            if regex.match(path):
+                return idx
+
+        return best
+
+
 class VisibilityMatcher:
     """Evaluates file paths against compiled rulesets to determine visibility."""
 
-    def __init__(self, rules: List[Rule]):
+    def __init__(self, rules: List[Rule], scope_positions: Optional[Dict[str, int]] = None):
         self.rules = rules
+        self.index = RuleIndex(rules)
+        # Ignore file name -> base rule count it ranks after; absent names are not loaded.
+        self.scope_positions = scope_positions or {}
+        self.scopes: Dict[str, List[RuleScope]] = {}
+        # Parsed nested ignore files by path, reused while their identity holds.
+        self._parsed_scopes: Dict[str, Tuple[Optional[FileIdentity], Optional[RuleScope]]] = {}
+        self.stats: Optional[RunStats] = None
+        self.tracer: Optional["RuleTracer"] = None
+
+    @classmethod
+    def load_pattern_file(cls, path: Path, vis: Visibility, reason: str, text: Optional[str] = None) -> List[Rule]:
+        """Compiles every pattern line of an ignore file, skipping blanks and comments.
+
+        When text is given it is parsed instead of reading path, e.g. for a file
+        stored in a git revision.
+        """
+        rules: List[Rule] = []
+        try:
+            for line in (path.read_text("utf-8") if text is None else text).splitlines():
+                if line.strip() and not line.startswith("#"):
+                    rules.append(cls.compile_pattern(line.strip(), vis, reason))
+        except Exception:
+            pass
+        return rules
+
+    def load_scope(self, rel_dir: str, file_name: str, file_path: str, text: Optional[str] = None) -> None:
+        """Registers a nested ignore file found while entering rel_dir, optionally from its text."""
+        position = self.scope_positions.get(file_name)
+        if position is None or rel_dir in ("", "."):
+            return
+        ident = RenderCache.identity(Path(file_path)) if text is None else text
+        parsed = self._parsed_scopes.get(file_path)
+        if parsed is None or parsed[0] != ident:
+            rules = self.load_pattern_file(Path(file_path), SCOPED_IGNORE_FILES[file_name], f"{rel_dir}/{file_name}", text)
+            scope = RuleScope(rel_dir, rel_dir.count("/") + 1, position, rules, RuleIndex(rules)) if rules else None
+            parsed = self._parsed_scopes[file_path] = (ident, scope)
+        if parsed[1] is not None and not any(scope is parsed[1] for scope in self.scopes.get(rel_dir, ())):
+            self.scopes.setdefault(rel_dir, []).append(parsed[1])
+
+    def reset_scopes(self) -> None:
+        """Forgets loaded nested ignore files before the matcher is reused for a new walk."""
+        self.scopes = {}
+
+    def _applicable_scopes(self, path: str) -> Iterator[RuleScope]:
+        """Yields scopes of every directory strictly containing path."""
+        pos = path.find("/")
+        while pos != -1:
+            yield from self.scopes.get(path[:pos], ())
+            pos = path.find("/", pos + 1)
+
+    def _decide(self, path: str) -> Tuple[Tuple[int, int, int], Optional[Rule]]:
+        """Returns the precedence key and rule of the last match for a normalized path."""
+        idx = self.index.last_match(path)
+        best_key = (idx, 0, 0)
+        best_rule = self.rules[idx] if idx >= 0 else None
+        if self.scopes:
+            for scope in self._applicable_scopes(path):
+                j = scope.index.last_match(path[len(scope.rel_dir) + 1:])
+                key = (scope.position - 1, scope.depth, j)
+                if j >= 0 and key > best_key:
+                    best_key, best_rule = key, scope.rules[j]
+        return best_key, best_rule
+
+    def candidate_rules(self, path: str) -> Iterator[Tuple[Tuple[int, int, int], Rule, str]]:
+        """Yields every rule that applies to a normalized path.
+
+        Each rule comes with its precedence key, as compared by _decide, and the
+        path it is matched against (relative to its ignore file for nested scopes).
+        """
+        for idx, rule in enumerate(self.rules):
+            yield (idx, 0, 0), rule, path
+        for scope in self._applicable_scopes(path):
+            sub_path = path[len(scope.rel_dir) + 1:]
+            for j, rule in enumerate(scope.rules):
+                yield (scope.position - 1, scope.depth, j), rule, sub_path
+
+    def matching_rules(self, rel_path: str) -> List[Tuple[Tuple[int, int, int], Rule]]:
+        """Returns all rules matching a path in precedence order; the last one decides."""
+        path = self._norm_posix(rel_path)
+        matches = [(key, rule) for key, rule, sub_path in self.candidate_rules(path) if rule.regex.match(sub_path)]
+        return sorted(matches, key=lambda m: m[0])
 
     @staticmethod
     def _norm_posix(p: str) -> str:
@@ -173,6 +789,30 @@ class VisibilityMatcher:
             p = p.replace("//", "/")
         return p.strip("/")
 
+    @staticmethod
+    def glob_to_regex(pat: str) -> str:
+        """Translates glob wildcards into an unanchored regex fragment."""
+        special = r".^$+{}()|"
+        esc = []
+        i = 0
+        while i < len(pat):
+            c = pat[i]
+            if c == "*":
+                if i + 1 < len(pat) and pat[i + 1] == "*":
+                    esc.append(".*")
+                    i += 2
+                    continue
+                else:
+                    esc.append("[^/]*")
+            elif c == "?":
+                esc.append("[^/]")
+            elif c in special:
+                esc.append("\\" + c)
+            else:
+                esc.append(c)
+            i += 1
+        return "".join(esc)
+
     @classmethod
     def compile_pattern(cls, raw: str, vis: Visibility, reason: Optional[str] = None) -> Rule:
         """Translates a gitignore-style glob pattern into a regex Rule."""
@@ -192,30 +832,15 @@ class VisibilityMatcher:
         dir_only = pat.endswith("/")
         if dir_only:
             pat = pat.rstrip("/")
+        # As in gitignore, a slash anywhere but at the end also anchors the pattern.
+        anchored = anchored or "/" in pat
 
-        special = r".^$+{}()|"
-        esc = []
-        i = 0
-        while i < len(pat):
-            c = pat[i]
-            if c == "*":
-                if i + 1 < len(pat) and pat[i + 1] == "*":
-                    esc.append(".*")
-                    i += 2
-                    continue
-                else:
-                    esc.append("[^/]*")
-            elif c == "?":
-                esc.append("[^/]")
-            elif c in special:
-                esc.append("\\" + c)
-            else:
-                esc.append(c)
-            i += 1
-        core = "".join(esc)
+        core = cls.glob_to_regex(pat)
         tail = r"(?:/.*)?"
 
-        regex = rf"^(?:{core}){tail}$" if anchored else rf"^(?:.*?/)*(?:{core}){tail}$"
+        # Leading directories are consumed one whole segment at a time; a lazy
+        # `.*?/` here backtracks exponentially in path depth on a miss.
+        regex = rf"^(?:{core}){tail}$" if anchored else rf"^(?:[^/]*/)*(?:{core}){tail}$"
 
         return Rule(
             raw=raw,
@@ -233,64 +858,256 @@ class VisibilityMatcher:
         if not path:
             return Visibility.INCLUDED, None
 
-        current_vis = Visibility.INCLUDED
-        current_reason = None
-
-        for rule in self.rules:
-            if rule.regex.match(path):
-                current_vis = rule.visibility
-                current_reason = rule.reason
+        if self.stats is None:
+            _, rule = self._decide(path)
+        else:
+            started, cpu = time.perf_counter(), time.thread_time()
+            _, rule = self._decide(path)
+            elapsed = time.perf_counter() - started
+            self.stats.add_phase("match", elapsed, time.thread_time() - cpu)
+            self.stats.record_match(rule, elapsed)
+        if self.tracer is not None:
+            self.tracer.observe(self, path, rule)
+        if rule is None:
+            return Visibility.INCLUDED, None
 
-        return current_vis, current_reason
+        return rule.visibility, rule.reason
 
     def can_skip_dir(self, rel_dir: str, current_vis: Visibility) -> bool:
-        """Determines if a directory can be safely skipped during traversal."""
+        """Determines if a directory can be safely skipped during traversal.
+
+        A directory is skipped unless some later INCLUDED/REDACTED rule can match
+        beneath it. Ghosted directories are opaque to unanchored overrides, so
+        only anchored rules that reach inside them force a descent.
+        """
         if current_vis not in (Visibility.PRUNED, Visibility.GHOSTED):
             return False
 
         path = self._norm_posix(rel_dir)
-        last_match_idx = -1
+        key, _ = self._decide(path)
+        floating = current_vis == Visibility.PRUNED
 
-        for i, rule in enumerate(self.rules):
-            if rule.regex.match(path):
-                last_match_idx = i
+        if self.index.override_below(path, key[0], floating):
+            return False
 
-        for i in range(last_match_idx + 1, len(self.rules)):
-            rule = self.rules[i]
-            if rule.visibility in (Visibility.INCLUDED, Visibility.REDACTED):
-                if not rule.anchored or any(c in rule.pattern for c in "*?[]"):
-                    return False
-                if (rule.pattern.startswith(path + "/") or path.startswith(rule.pattern + "/") or rule.pattern == path):
-                    return False
+        for scope in self._applicable_scopes(path):
+            rank = (scope.position - 1, scope.depth)
+            if rank < key[:2]:
+                continue
+            after = key[2] if rank == key[:2] else -1
+            if scope.index.override_below(path[len(scope.rel_dir) + 1:], after, floating):
+                return False
 
         return True
 
 
+class VirtualFile(type(Path())):
+    """Path of a file that is not read from the working tree.
+
+    Archive members carry contents read into memory while scanning; blobs of a
+    git revision carry a loader that fetches them each time ``data`` is used,
+    so large snapshots are never held in memory at once. The path is where the
+    file is shown in the tree, and readers take ``data`` instead of opening it.
+    """
+    size: int = 0
+    mtime_ns: int = 0
+    _data: bytes = b""
+    _load: Optional[Callable[[], bytes]] = None
+
+    @classmethod
+    def member(cls, path: Path, data: bytes, size: int, mtime_ns: int, load: Optional[Callable[[], bytes]] = None) -> "VirtualFile":
+        virtual = cls(path)
+        virtual._data, virtual._load, virtual.size, virtual.mtime_ns = data, load, size, mtime_ns
+        return virtual
+
+    @property
+    def data(self) -> bytes:
+        return self._load() if self._load is not None else self._data
+
+    def stat(self, *, follow_symlinks: bool = True) -> os.stat_result:
+        return member_stat(self.size, self.mtime_ns)
+
+
+@dataclass(frozen=True)
+class ArchiveMember:
+    """File inside an archive or git tree, exposing the parts of os.DirEntry the scanner uses."""
+    name: str
+    size: int
+    mtime_ns: int
+    is_link: bool = False
+
+    def stat(self, follow_symlinks: bool = True) -> os.stat_result:
+        return member_stat(self.size, self.mtime_ns)
+
+
+def member_stat(size: int, mtime_ns: int) -> os.stat_result:
+    """Stat result of a regular archive member, which has no device, inode or owner."""
+    mtime = mtime_ns / 1e9
+    return os.stat_result((stat.S_IFREG | 0o644, 0, 0, 1, 0, 0, size, mtime, mtime, mtime))
+
+
+def archive_kind(name: str) -> Optional[str]:
+    """Returns "tar" or "zip" for archive file names, else None."""
+    lowered = name.lower()
+    for suffix, kind in ARCHIVE_SUFFIXES.items():
+        if lowered.endswith(suffix):
+            return kind
+    return None
+
+
+def iter_archive_members(archive: Path) -> Iterator[Tuple[ArchiveMember, Callable[[], bytes]]]:
+    """Yields the files of an archive in stored order, each with a reader for its contents.
+
+    Tar archives are opened as a forward-only stream, so a member's reader is
+    only valid until the next member is requested. Directories are skipped and
+    members escaping the archive root are dropped.
+
+    Raises:
+        OSError, EOFError, tarfile.TarError, zipfile.BadZipFile: If the archive is unreadable.
+    """
+    def normalize(name: str) -> Optional[str]:
+        parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".")]
+        return "/".join(parts) if parts and ".." not in parts else None
+
+    if archive_kind(archive.name) == "zip":
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                name = normalize(info.filename)
+                if info.is_dir() or name is None:
+                    continue
+                mtime_ns = int(datetime(*info.date_time).timestamp() * 1e9)
+                is_link = stat.S_ISLNK(info.external_attr >> 16)
+                yield ArchiveMember(name, info.file_size, mtime_ns, is_link), partial(zf.read, info)
+        return
+
+    with tarfile.open(archive, "r|*") as tar:
+        for info in tar:
+            name = normalize(info.name)
+            if info.isdir() or name is None or not (info.isfile() or info.issym() or info.islnk()):
+                continue
+            member = ArchiveMember(name, info.size, int(info.mtime * 1e9), info.issym() or info.islnk())
+            yield member, partial(lambda i: tar.extractfile(i).read(), info)
+
+
 class FileReader:
     """Provides resilient, encoding-aware file reading operations."""
 
-    @staticmethod
-    def read_text(file_path: Path) -> Tuple[Optional[str], int, bool]:
+    # Leading bytes inspected for NUL before committing to a full read.
+    SNIFF_BYTES = 8192
+
+    @classmethod
+    def read_text(cls, file_path: Path) -> Tuple[Optional[str], int, bool]:
         """Reads file text, managing fallbacks and binary detection.
 
+        Binary files are rejected from a small leading sample. Larger text files
+        are memory-mapped and decoded in place rather than copied into a buffer.
+        Files that cannot be read, e.g. because they vanished after the scan,
+        are reported like binaries so they are listed in the tree only.
+
         Returns:
             Tuple containing: (decoded_text, line_count, is_binary_flag)
         """
+        if isinstance(file_path, VirtualFile):
+            data = file_path.data
+            return (None, 0, True) if b'\x00' in data else cls.decode(data)
         try:
-            data = file_path.read_bytes()
-        except PermissionError:
-            print(f"[warning] Permission denied: {file_path}", file=sys.stderr)
-            return None, 0, False
-
-        # Detect null bytes prior to decode attempts
-        if b'\x00' in data:
+            with open(file_path, "rb") as f:
+                sample = f.read(cls.SNIFF_BYTES)
+                # Detect null bytes prior to decode attempts
+                if b'\x00' in sample:
+                    return None, 0, True
+                if len(sample) < cls.SNIFF_BYTES:
+                    return cls.decode(sample)
+
+                try:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except (OSError, ValueError):
+                    # Unmappable files (e.g. procfs or FUSE) fall back to a plain read.
+                    data = sample + f.read()
+                    return (None, 0, True) if b'\x00' in data else cls.decode(data)
+
+                with mapped:
+                    if mapped.find(b'\x00', cls.SNIFF_BYTES) != -1:
+                        return None, 0, True
+                    return cls.decode(mapped)
+        except OSError as e:
+            print(f"[warning] Cannot read {file_path}: {e.strerror or e}", file=sys.stderr)
             return None, 0, True
 
+    @classmethod
+    def read_excerpt(cls, file_path: Path, policy: ExcerptPolicy) -> Optional[Excerpt]:
+        """Reads the head and tail of a large file with two seeks, never the middle.
+
+        Both sides are trimmed to whole lines and never overlap. A side without
+        a line break is cut at a UTF-8 character boundary instead.
+
+        Returns:
+            The decoded excerpt, or None if either side contains a NUL byte or
+            the file cannot be read.
+        """
+        try:
+            f: BinaryIO = io.BytesIO(file_path.data) if isinstance(file_path, VirtualFile) else open(file_path, "rb")
+            with f:
+                size = f.seek(0, os.SEEK_END)
+                f.seek(0)
+                head = f.read(policy.side_bytes)
+                lines = head.split(b"\n")[:-1]
+                if lines:
+                    head = b"".join(line + b"\n" for line in lines[:policy.side_lines])
+                else:
+                    head = cls._utf8_prefix(head)
+
+                start = max(len(head), size - policy.side_bytes)
+                cut_mid_line = start > len(head)
+                f.seek(start - 1 if cut_mid_line else start)
+                tail = f.read()
+                if cut_mid_line:
+                    cut_mid_line, tail = tail[:1] != b"\n", tail[1:]
+        except OSError as e:
+            print(f"[warning] Cannot read {file_path}: {e.strerror or e}", file=sys.stderr)
+            return None
+
+        lines = tail.split(b"\n")
+        if cut_mid_line and len(lines) > 1:
+            lines = lines[1:]  # Drop the partial first line.
+        elif cut_mid_line:
+            lines = [cls._utf8_suffix(tail)]
+        if policy.side_lines is not None:
+            lines = lines[-(policy.side_lines + (1 if tail.endswith(b"\n") else 0)):]
+        tail = b"\n".join(lines)
+
+        if b"\x00" in head or b"\x00" in tail:
+            return None
+        head_text, head_lines, _ = cls.decode(head)
+        tail_text, tail_lines, _ = cls.decode(tail)
+        return Excerpt(head_text or "", tail_text or "", head_lines + tail_lines, size - len(head) - len(tail))
+
+    @staticmethod
+    def _utf8_prefix(data: bytes) -> bytes:
+        """Drops a multibyte UTF-8 character cut off at the end of data."""
+        for back in range(1, min(4, len(data)) + 1):
+            lead = data[-back]
+            if lead & 0xC0 != 0x80:
+                width = 1 if lead < 0xC0 else 2 if lead < 0xE0 else 3 if lead < 0xF0 else 4
+                return data[:-back] if width > back else data
+        return data
+
+    @staticmethod
+    def _utf8_suffix(data: bytes) -> bytes:
+        """Drops the continuation bytes of a UTF-8 character cut off at the start of data."""
+        skip = 0
+        while skip < min(3, len(data)) and data[skip] & 0xC0 == 0x80:
+            skip += 1
+        return data[skip:]
+
+    @staticmethod
+    def decode(data: Union[bytes, mmap.mmap]) -> Tuple[Optional[str], int, bool]:
+        """Decodes a NUL-free buffer, returning (text, line_count, is_binary)."""
         encodings = ['utf-8', 'utf-8-sig', 'latin-1']
         text = None
         for enc in encodings:
             try:
-                text = data.decode(enc)
+                text = str(data, enc)
                 break
             except UnicodeDecodeError:
                 continue
@@ -302,140 +1119,761 @@ class FileReader:
         return text, line_count, False
 
 
-class RepoScanner:
-    """Traverses target paths and generates the directory structure map."""
-
-    def __init__(
-        self, root_dir: Path, matcher: VisibilityMatcher, telemetry: Telemetry,
-        file_types: Optional[List[str]], max_file_bytes: int, output_file: Optional[Path]
-    ):
-        self.root_dir = root_dir
-        self.matcher = matcher
-        self.telemetry = telemetry
-        self.max_file_bytes = max_file_bytes
-        self.output_file = output_file.resolve() if output_file else None
-        self.file_types = [t if t.startswith('.') else f".{t}" for t in file_types] if file_types else None
-
-    def scan(self, target_paths: List[Path]) -> Tuple[DirectoryNode, List[Path], List[Tuple[Path, str]]]:
-        """Executes the filesystem scan."""
-        root_node = DirectoryNode("/")
-        included_files: List[Path] = []
-        redacted_files: List[Tuple[Path, str]] = []
+class TokenEstimator:
+    """Fast byte-level approximation of LLM token counts.
 
-        for target in target_paths:
-            if not target.exists():
-                continue
+    Counts whitespace-delimited words plus punctuation bytes, floored at one
+    token per four bytes for long identifiers and dense data. Both passes run
+    in C via bytes.split and bytes.translate.
+    """
 
-            if target.is_file():
-                self._process_file(target, root_node, included_files, redacted_files)
-            elif target.is_dir():
-                self._traverse_directory(target, root_node, included_files, redacted_files)
+    _WORD_BYTES = bytes(b for b in range(256) if b >= 0x80 or chr(b).isalnum() or chr(b).isspace() or b == ord("_"))
 
-        included_files.sort()
-        redacted_files.sort(key=lambda x: x[0])
-        return root_node, included_files, redacted_files
+    @classmethod
+    def estimate(cls, data: bytes) -> int:
+        if not data:
+            return 0
+        words = len(data.split())
+        symbols = len(data.translate(None, cls._WORD_BYTES))
+        return max(words + symbols, (len(data) + 3) // 4)
 
-    def _traverse_directory(self, current_dir: Path, root_node: DirectoryNode, included: List[Path], redacted: List[Tuple[Path, str]]) -> None:
-        if current_dir.is_symlink():
-            self.telemetry.pruned_paths += 1
-            return
 
-        try:
-            entries = list(current_dir.iterdir())
-        except PermissionError:
-            print(f"[warning] Permission denied: {current_dir}", file=sys.stderr)
-            return
+class ContentDeduplicator:
+    """Detects files whose rendered content repeats an earlier file.
 
-        rel_current = current_dir.relative_to(self.root_dir).as_posix() if current_dir != self.root_dir else "."
+    Contents are bucketed by CRC32, which is cheap enough to run on every file.
+    A CRC match is only trusted once SHA-256 digests agree; the digest of the
+    earlier file is computed on first collision from the `load` callback, so
+    no content is retained between files.
+    """
 
-        if rel_current != ".":
-            vis, _ = self.matcher.get_visibility(rel_current)
-            if vis == Visibility.PRUNED:
-                self.telemetry.pruned_paths += 1
-                if self.matcher.can_skip_dir(rel_current, vis):
-                    return
-            elif vis == Visibility.GHOSTED:
-                self.telemetry.ghosted_paths += 1
-                self._insert_into_tree(root_node, rel_current, is_file=False)
-                return
-            else:
-                self._insert_into_tree(root_node, rel_current, is_file=False)
+    CONTENT_MARKER = b"      <content><![CDATA[\n"
 
-        dirs = [e for e in entries if e.is_dir()]
-        files = [e for e in entries if e.is_file()]
+    def __init__(self, load: Callable[[Path], Optional[bytes]]):
+        self.load = load
+        self.buckets: Dict[int, List[Tuple[str, Path]]] = {}
+        self.digests: Dict[str, bytes] = {}
 
-        for d in dirs:
-            self._traverse_directory(d, root_node, included, redacted)
-        for f in files:
-            self._process_file(f, root_node, included, redacted)
+    @classmethod
+    def content_of(cls, xml: bytes) -> memoryview:
+        """Returns the part of a rendered <file> chunk that does not depend on its path."""
+        return memoryview(xml)[xml.find(cls.CONTENT_MARKER):]
+
+    def first_copy(self, rel_path: str, file_path: Path, xml: bytes) -> Optional[str]:
+        """Registers a rendered file and returns the path of an identical earlier one."""
+        content = self.content_of(xml)
+        bucket = self.buckets.setdefault(zlib.crc32(content), [])
+        if bucket:
+            digest = self.digests[rel_path] = hashlib.sha256(content).digest()
+            for earlier_rel, earlier_path in bucket:
+                if earlier_rel not in self.digests:
+                    earlier = self.load(earlier_path)
+                    self.digests[earlier_rel] = hashlib.sha256(self.content_of(earlier)).digest() if earlier else b""
+                if self.digests[earlier_rel] == digest:
+                    return earlier_rel
+        bucket.append((rel_path, file_path))
+        return None
+
+    def forget(self, rel_path: str, xml: bytes) -> None:
+        """Withdraws a registered file whose content ended up not being emitted."""
+        bucket = self.buckets.get(zlib.crc32(self.content_of(xml)), [])
+        bucket[:] = [(earlier_rel, earlier_path) for earlier_rel, earlier_path in bucket if earlier_rel != rel_path]
+
+
+class RenderCache:
+    """Persistent store of rendered file chunks keyed by file identity.
+
+    Entries are keyed by relative path and validated against (dev, inode, size,
+    mtime_ns), so an unchanged file is served without being opened. The store is
+    bounded by the total size of cached chunks; least recently used entries are
+    evicted when the cache is closed.
+    """
 
-    def _process_file(self, file_path: Path, root_node: DirectoryNode, included: List[Path], redacted: List[Tuple[Path, str]]) -> None:
-        # Prevent self-referential scanning of the output destination.
-        if self.output_file and file_path.resolve() == self.output_file:
-            self.telemetry.pruned_paths += 1
-            return
+    SCHEMA_VERSION = 2
+    # Files modified this recently may still change within the same mtime tick.
+    RACY_WINDOW_NS = 2_000_000_000
 
-        if file_path.is_symlink():
-            self.telemetry.pruned_paths += 1
-            return
+    def __init__(self, db_path: Path, max_bytes: int):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._now = time.time_ns()
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(db_path))
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " path TEXT PRIMARY KEY, dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER,"
+            " xml BLOB, line_count INTEGER, is_binary INTEGER, nbytes INTEGER, last_used INTEGER)"
+        )
+        self._touched: List[Tuple[int, str]] = []
 
-        self.telemetry.scanned_paths += 1
+    @classmethod
+    def default_location(cls, root_dir: Path) -> Path:
+        """Prefers the repository's .git directory, falling back to $XDG_CACHE_HOME."""
+        git_dir = root_dir / ".git"
+        if git_dir.is_dir():
+            return git_dir / "repo2txt-cache" / f"v{cls.SCHEMA_VERSION}.sqlite3"
+        base = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "repo2txt"
+        digest = hashlib.sha1(str(root_dir).encode("utf-8")).hexdigest()[:16]
+        return base / f"{digest}-v{cls.SCHEMA_VERSION}.sqlite3"
 
+    @staticmethod
+    def identity(file_path: Path) -> Optional[FileIdentity]:
+        if isinstance(file_path, VirtualFile):
+            return None
         try:
-            rel_f = file_path.relative_to(self.root_dir).as_posix()
-        except ValueError:
-            rel_f = Path(os.path.relpath(file_path, self.root_dir)).as_posix()
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
 
+    def get(self, rel_path: str, ident: FileIdentity) -> Optional[RenderedFile]:
+        row = self._db.execute(
+            "SELECT dev, ino, size, mtime_ns, xml, line_count, is_binary FROM entries WHERE path = ?", (rel_path,)
+        ).fetchone()
+        if row is None or tuple(row[:4]) != ident:
+            return None
+        self._touched.append((self._now, rel_path))
+        return RenderedFile(row[4], row[5], bool(row[6]))
+
+    def put(self, rel_path: str, ident: FileIdentity, rendered: RenderedFile) -> None:
+        if self._now - ident[3] < self.RACY_WINDOW_NS:
+            return
+        nbytes = len(rendered.xml) if rendered.xml else 0
+        self._db.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (rel_path, *ident, rendered.xml, rendered.line_count, int(rendered.is_binary), nbytes, self._now),
+        )
+
+    def close(self) -> None:
+        """Persists access times, evicts least recently used entries and commits."""
+        self._db.executemany("UPDATE entries SET last_used = ? WHERE path = ?", self._touched)
+        self._db.execute(
+            "DELETE FROM entries WHERE path IN ("
+            " SELECT path FROM (SELECT path, SUM(nbytes) OVER (ORDER BY last_used DESC, path) AS running FROM entries)"
+            " WHERE running > ?)",
+            (self.max_bytes,),
+        )
+        self._db.commit()
+        self._db.close()
+
+
+class GitCommandError(Exception):
+    """Raised when git is unavailable or a git subprocess fails."""
+    pass
+
+
+def run_git(root_dir: Path, *git_args: str) -> bytes:
+    """Runs a git subcommand against root_dir and returns its raw stdout."""
+    try:
+        result = subprocess.run(["git", "-C", str(root_dir), *git_args], capture_output=True, check=True)
+    except FileNotFoundError as e:
+        raise GitCommandError("git executable not found.") from e
+    except subprocess.CalledProcessError as e:
+        message = e.stderr.decode("utf-8", "replace").strip()
+        raise GitCommandError(message or f"git {git_args[0]} exited with status {e.returncode}.") from e
+    return result.stdout
+
+
+def resolve_git_ref(root_dir: Path, ref: str, kind: str = "commit") -> str:
+    """Resolves a user-supplied ref to the full ID of the object it names.
+
+    Only the returned ID is passed on to other git commands, so a ref can never
+    be read as one of their options.
+
+    Raises:
+        GitCommandError: If the ref starts with "-" or names no object of the given kind.
+    """
+    if ref.startswith("-"):
+        raise GitCommandError(f"Invalid git ref {ref!r}: refs may not start with '-'.")
+    try:
+        return run_git(root_dir, "rev-parse", "--verify", "--end-of-options", f"{ref}^{{{kind}}}").decode("ascii").strip()
+    except GitCommandError as e:
+        raise GitCommandError(f"Unknown git ref {ref!r}: {e}") from e
+
+
+def read_revision_file(root_dir: Path, rev: str, rel_path: str) -> Optional[str]:
+    """Returns a text file as stored in a git revision, or None if the revision lacks it."""
+    try:
+        return run_git(root_dir, "show", f"{rev}:./{rel_path}").decode("utf-8", "replace")
+    except GitCommandError:
+        return None
+
+
+class GitBlobReader:
+    """Streams blob contents from one long-lived ``git cat-file --batch`` process.
+
+    Requests and replies share a single pipe pair, so a lock serializes them and
+    render workers can use the reader concurrently.
+    """
+
+    def __init__(self, root_dir: Path):
+        try:
+            self._proc = subprocess.Popen(
+                ["git", "-C", str(root_dir), "cat-file", "--batch"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+        except FileNotFoundError as e:
+            raise GitCommandError("git executable not found.") from e
+        self._lock = threading.Lock()
+
+    def read(self, oid: str) -> bytes:
+        """Returns the contents of a blob.
+
+        Raises:
+            GitCommandError: If the object is missing or git exited.
+        """
+        with self._lock:
+            try:
+                self._proc.stdin.write(oid.encode("ascii") + b"\n")
+                self._proc.stdin.flush()
+                header = self._proc.stdout.readline().split()
+                if len(header) != 3:
+                    raise GitCommandError(f"git cat-file cannot read object {oid}.")
+                data = self._proc.stdout.read(int(header[2]))
+                self._proc.stdout.read(1)
+            except (OSError, ValueError) as e:
+                raise GitCommandError(f"git cat-file failed reading object {oid}: {e}") from e
+        return data
+
+    def close(self) -> None:
+        if self._proc.stdin:
+            self._proc.stdin.close()
+        self._proc.wait()
+        self._proc.stdout.close()
+
+
+class ListedEntry:
+    """Directory entry snapshot mirroring the parts of os.DirEntry the scanner uses.
+
+    Unlike os.DirEntry, stat() is never cached, so a reused listing still sees
+    current file sizes.
+    """
+
+    __slots__ = ("name", "path", "kind")
+
+    def __init__(self, entry: os.DirEntry[str]):
+        self.name = entry.name
+        self.path = entry.path
+        if entry.is_symlink():
+            self.kind = "l"
+        elif entry.is_dir(follow_symlinks=False):
+            self.kind = "d"
+        else:
+            self.kind = "f" if entry.is_file(follow_symlinks=False) else "?"
+
+    def is_symlink(self) -> bool:
+        return self.kind == "l"
+
+    def is_dir(self, follow_symlinks: bool = True) -> bool:
+        return self.kind == "d"
+
+    def is_file(self, follow_symlinks: bool = True) -> bool:
+        return self.kind == "f"
+
+    def stat(self, follow_symlinks: bool = True) -> os.stat_result:
+        return os.stat(self.path, follow_symlinks=False)
+
+
+class DirectoryListingCache:
+    """Sorted directory listings reused while the directory's mtime is unchanged.
+
+    Creating, removing or renaming an entry bumps the directory mtime. Listings
+    taken within the racy window of their mtime are not kept, mirroring
+    RenderCache.
+    """
+
+    def __init__(self):
+        self.listings: Dict[str, Tuple[int, int, List[ListedEntry]]] = {}
+
+    def list(self, dir_path: str) -> List[ListedEntry]:
+        """Returns the entries of dir_path sorted by name.
+
+        Raises:
+            OSError: Propagated from stat or scandir, e.g. PermissionError.
+        """
+        st = os.stat(dir_path)
+        cached = self.listings.get(dir_path)
+        if cached is not None and cached[:2] == (st.st_ino, st.st_mtime_ns):
+            return cached[2]
+        with os.scandir(dir_path) as it:
+            entries = sorted((ListedEntry(e) for e in it), key=lambda e: e.name)
+        if time.time_ns() - st.st_mtime_ns >= RenderCache.RACY_WINDOW_NS:
+            self.listings[dir_path] = (st.st_ino, st.st_mtime_ns, entries)
+        else:
+            self.listings.pop(dir_path, None)
+        return entries
+
+
+class RepoScanner:
+    """Traverses target paths and generates the directory structure map."""
+
+    def __init__(
+        self, root_dir: Path, matcher: VisibilityMatcher, telemetry: Telemetry,
+        file_types: Optional[List[str]], max_file_bytes: int, output_file: Optional[Path],
+        listings: Optional[DirectoryListingCache] = None
+    ):
+        self.root_dir = root_dir
+        self.matcher = matcher
+        self.telemetry = telemetry
+        self.max_file_bytes = max_file_bytes
+        # Keep files over max_file_bytes for the renderer to excerpt instead of redacting them.
+        self.excerpt_oversized = False
+        self.output_file = output_file.resolve() if output_file else None
+        # Files this run writes or reads as bookkeeping, never scanned themselves.
+        self.own_files: Set[str] = {str(self.output_file)} if self.output_file else set()
+        # Ghosted directories descended into only to reach a deeper override.
+        self.ghosted_dirs: Set[str] = set()
+        # Every directory listed so far, in visit order (used by watch mode).
+        self.visited_dirs: List[str] = []
+        self.listings = listings
+        self.file_types = [t if t.startswith('.') else f".{t}" for t in file_types] if file_types else None
+
+    def scan(self, target_paths: List[Path]) -> Tuple[DirectoryNode, List[Path], List[Tuple[Path, str]]]:
+        """Executes the filesystem scan."""
+        root_node = DirectoryNode("/")
+        return (root_node, *self.collect(self.iter_scan(target_paths, root_node)))
+
+    def scan_git_index(self, target_paths: List[Path]) -> Tuple[DirectoryNode, List[Path], List[Tuple[Path, str]]]:
+        """Enumerates tracked files from the git index instead of walking the tree."""
+        root_node = DirectoryNode("/")
+        return (root_node, *self.collect(self.iter_git_index(target_paths, root_node)))
+
+    @staticmethod
+    def collect(entries: Iterable[ScanEntry]) -> Tuple[List[Path], List[Tuple[Path, str]]]:
+        """Drains scan entries into sorted included and redacted lists."""
+        included_files: List[Path] = []
+        redacted_files: List[Tuple[Path, str]] = []
+        for file_path, reason in entries:
+            if reason is None:
+                included_files.append(file_path)
+            else:
+                redacted_files.append((file_path, reason))
+
+        included_files.sort()
+        redacted_files.sort(key=lambda x: x[0])
+        return included_files, redacted_files
+
+    def iter_scan(self, target_paths: List[Path], root_node: DirectoryNode, shards: Optional[List[Tuple[str, str]]] = None) -> Iterator[ScanEntry]:
+        """Lazily walks the targets, filling root_node and yielding files as found.
+
+        Each directory is visited in name order, so entries within a target are
+        produced in the same order a full scan would sort them into. When shards
+        is given, subdirectories of target directories are appended to it as
+        (path, relative path) pairs instead of being walked. Nested ignore files
+        between the root and a target apply as they would in a walk from the root.
+        """
+        for target in target_paths:
+            if not target.exists():
+                continue
+
+            if target.is_symlink():
+                self.telemetry.pruned_paths += 1
+            elif target.is_file() and archive_kind(target.name):
+                yield from self._iter_archive(target, root_node)
+            elif target.is_file():
+                self._load_ancestor_scopes(self._relative(target))
+                scan_entry = self._process_file(str(target), self._relative(target), root_node)
+                if scan_entry:
+                    yield scan_entry
+            elif target.is_dir():
+                self._load_ancestor_scopes(self._relative(target))
+                yield from self._traverse_directory(str(target), self._relative(target), root_node, shards)
+
+    def parallel_scan(self, target_paths: List[Path], root_node: DirectoryNode, workers: int) -> List[ScanEntry]:
+        """Scans the targets with their top-level subtrees sharded across processes.
+
+        The parent enters each target directory itself, so its nested ignore files
+        are loaded before the workers inherit a copy of this scanner. Worker trees,
+        entries and telemetry are merged in shard order; trees are sets and
+        collect() sorts entries, so results are identical to a serial scan.
+        """
+        shards: List[Tuple[str, str]] = []
+        found = list(self.iter_scan(target_paths, root_node, shards))
+        if workers < 2 or len(shards) < 2:
+            for dir_path, rel_dir in shards:
+                found.extend(self._traverse_directory(dir_path, rel_dir, root_node))
+            return found
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards)), initializer=_init_scan_worker, initargs=(self,)) as pool:
+            for node, entries, telemetry, stats in pool.map(_scan_shard, shards):
+                root_node.merge(node)
+                found.extend(entries)
+                self.telemetry.merge(telemetry)
+                if stats is not None:
+                    self.matcher.stats.merge_rules(stats)
+        return found
+
+    def iter_git_index(self, target_paths: List[Path], root_node: DirectoryNode) -> Iterator[ScanEntry]:
+        """Lists tracked files from the git index, yielding them lazily in path order.
+
+        Untracked and ignored directories are never listed, so the cost scales with
+        the number of tracked files. Symlinks and submodules are pruned by mode.
+        git is invoked eagerly so that failures surface before any output is produced.
+        """
+        pathspecs = [self._relative(t) for t in target_paths]
+        staged = run_git(self.root_dir, "ls-files", "-z", "--stage", "--", *pathspecs)
+        deleted = set(run_git(self.root_dir, "ls-files", "-z", "--deleted", "--", *pathspecs).split(b"\0"))
+
+        modes: Dict[str, bytes] = {}
+        for record in staged.split(b"\0"):
+            meta, _, raw_path = record.partition(b"\t")
+            if raw_path and raw_path not in deleted:
+                modes[os.fsdecode(raw_path)] = meta.split(b" ", 1)[0]
+
+        return self._iter_listed(modes, root_node)
+
+    def iter_git_changes(self, target_paths: List[Path], root_node: DirectoryNode, ref: str) -> Tuple[Iterator[ScanEntry], List[str]]:
+        """Lists files added or modified since a git ref, and the tracked files deleted since.
+
+        Modified files come from comparing the ref against the working tree and
+        new files from the untracked, non-ignored listing, so only changed paths
+        are visited. Deletions are kept only if the rules would have rendered them.
+        git is invoked eagerly so that a bad ref surfaces before any output.
+        """
+        pathspecs = [self._relative(t) for t in target_paths]
+        diff = run_git(self.root_dir, "diff", "--raw", "-z", "--no-renames", "--relative", resolve_git_ref(self.root_dir, ref), "--", *pathspecs)
+        untracked = run_git(self.root_dir, "ls-files", "-z", "--others", "--exclude-standard", "--", *pathspecs)
+
+        modes: Dict[str, bytes] = {}
+        deleted: List[str] = []
+        records = diff.split(b"\0")
+        for meta, raw_path in zip(records[0::2], records[1::2]):
+            # ":<old mode> <new mode> <old blob> <new blob> <status>"
+            _, new_mode, _, _, status = meta[1:].split(b" ")
+            if status == b"D":
+                deleted.append(os.fsdecode(raw_path))
+            else:
+                modes[os.fsdecode(raw_path)] = new_mode
+        for raw_path in untracked.split(b"\0"):
+            if raw_path:
+                rel_f = os.fsdecode(raw_path)
+                modes[rel_f] = b"120000" if os.path.islink(os.path.join(self.root_dir, rel_f)) else b"100644"
+
+        return self._iter_listed(modes, root_node), sorted(rel_f for rel_f in deleted if self._would_render(rel_f))
+
+    def narrow(self, keep: Set[Path], included: List[Path], redacted: List[Tuple[Path, str]]) -> Tuple[DirectoryNode, List[Path], List[Tuple[Path, str]]]:
+        """Restricts scan results to the given files and rebuilds a tree holding only them."""
+        root_node = DirectoryNode("/")
+        kept_included: List[Path] = []
+        for file_path in included:
+            if file_path in keep:
+                kept_included.append(file_path)
+                self._insert_into_tree(root_node, self._relative(file_path), is_file=True)
+            else:
+                self.telemetry.included_files -= 1
+                self.telemetry.unchanged_files += 1
+
+        kept_redacted: List[Tuple[Path, str]] = []
+        for file_path, reason in redacted:
+            if file_path in keep:
+                kept_redacted.append((file_path, reason))
+                self._insert_into_tree(root_node, self._relative(file_path), is_file=True)
+            else:
+                self.telemetry.redacted_files -= 1
+                self.telemetry.unchanged_files += 1
+                if "SECURITY" in reason:
+                    self.telemetry.secrets_redacted -= 1
+        return root_node, kept_included, kept_redacted
+
+    def _would_render(self, rel_f: str) -> bool:
+        """Reports whether a file would reach the files section, without recording telemetry."""
+        rel_dir = ""
+        for part in rel_f.split("/")[:-1]:
+            rel_dir = f"{rel_dir}/{part}" if rel_dir else part
+            vis, _ = self.matcher.get_visibility(rel_dir)
+            if vis in (Visibility.PRUNED, Visibility.GHOSTED) and self.matcher.can_skip_dir(rel_dir, vis):
+                return False
         vis, reason = self.matcher.get_visibility(rel_f)
-        is_explicit_override = (reason == "EXPLICIT_INCLUDE")
+        if vis in (Visibility.PRUNED, Visibility.GHOSTED):
+            return False
+        if vis == Visibility.INCLUDED and self.file_types and reason != "EXPLICIT_INCLUDE":
+            return self._suffix(rel_f.rpartition("/")[2]) in self.file_types
+        return True
 
+    def iter_git_tree(self, target_paths: List[Path], root_node: DirectoryNode, rev: str, blobs: GitBlobReader) -> Iterator[ScanEntry]:
+        """Lists files of a commit or tree without checking it out, yielding them lazily in path order.
+
+        Sizes come from the tree listing, so limits are applied without reading
+        any blob; files are yielded as VirtualFile paths whose contents are
+        fetched through blobs when rendered. All files carry the commit time.
+        rev must be an object ID from resolve_git_ref. git is invoked eagerly so
+        that failures surface before any output is produced.
+        """
+        pathspecs = [self._relative(t) for t in target_paths]
+        listing = run_git(self.root_dir, "ls-tree", "-r", "-z", "--long", rev, "--", *pathspecs)
+        try:
+            mtime_ns = int(run_git(self.root_dir, "log", "-1", "--format=%ct", f"{rev}^{{commit}}").strip() or 0) * 1_000_000_000
+        except GitCommandError:
+            mtime_ns = 0  # A bare tree has no commit time.
+
+        modes: Dict[str, bytes] = {}
+        members: Dict[str, Tuple[ArchiveMember, Callable[[], bytes]]] = {}
+        for record in listing.split(b"\0"):
+            meta, _, raw_path = record.partition(b"\t")
+            if not raw_path:
+                continue
+            mode, _, oid, size = meta.split()
+            rel_f = os.fsdecode(raw_path)
+            modes[rel_f] = mode
+            members[rel_f] = ArchiveMember(rel_f, int(size) if size.isdigit() else 0, mtime_ns), partial(blobs.read, oid.decode("ascii"))
+
+        return self._iter_listed(modes, root_node, members)
+
+    def _iter_listed(
+        self, modes: Dict[str, bytes], root_node: DirectoryNode, members: Optional[Dict[str, Tuple[ArchiveMember, Callable[[], bytes]]]] = None
+    ) -> Iterator[ScanEntry]:
+        root_str = str(self.root_dir)
+        entered: Dict[str, bool] = {}
+        on_enter = partial(self._load_listed_scopes, members=members) if self.matcher.scope_positions else None
+        for rel_f in sorted(modes, key=lambda p: p.split("/")):
+            if not self._enter_parents(rel_f, root_node, entered, on_enter):
+                continue
+            if modes[rel_f] in (b"120000", b"160000"):
+                self.telemetry.pruned_paths += 1
+                continue
+            path_str = os.path.normpath(os.path.join(root_str, rel_f))
+            if members is None:
+                scan_entry = self._process_file(path_str, rel_f, root_node)
+            else:
+                member, load = members[rel_f]
+                scan_entry = self._process_file(path_str, rel_f, root_node, member)
+                if scan_entry:
+                    scan_entry = VirtualFile.member(Path(path_str), b"", member.size, member.mtime_ns, load), scan_entry[1]
+            if scan_entry:
+                yield scan_entry
+
+    def _load_ancestor_scopes(self, rel_path: str) -> None:
+        """Loads the nested ignore files of every directory between the root and a target."""
+        if not self.matcher.scope_positions or rel_path.startswith("../"):
+            return
+        rel_dir = ""
+        for part in rel_path.split("/")[:-1]:
+            rel_dir = f"{rel_dir}/{part}" if rel_dir else part
+            self._load_listed_scopes(rel_dir)
+
+    def _load_listed_scopes(self, rel_dir: str, members: Optional[Dict[str, Tuple[ArchiveMember, Callable[[], bytes]]]] = None) -> None:
+        """Loads the nested ignore files of a directory reached through a listing instead of a walk.
+
+        With members, the files are read from the listed revision rather than
+        the working tree.
+        """
+        for file_name in self.matcher.scope_positions:
+            rel_f = f"{rel_dir}/{file_name}"
+            if members is None:
+                self.matcher.load_scope(rel_dir, file_name, os.path.join(self.root_dir, rel_f))
+            elif rel_f in members:
+                text = members[rel_f][1]().decode("utf-8", "replace")
+                self.matcher.load_scope(rel_dir, file_name, os.path.join(self.root_dir, rel_f), text)
+
+    def _iter_archive(self, archive: Path, root_node: DirectoryNode) -> Iterator[ScanEntry]:
+        """Scans a tar or zip target in place, yielding its members in path order.
+
+        Members are matched by their path inside the archive, as if the archive
+        were the repository root, and are listed beneath the archive's name in
+        the tree. The archive is read once front to back; contents of rendered
+        members are kept in memory as VirtualFile paths, so nothing is extracted.
+        """
+        archive_node = DirectoryNode(archive.name)
+        outer_ghosts, self.ghosted_dirs = self.ghosted_dirs, set()
+        entered: Dict[str, bool] = {}
+        found: List[ScanEntry] = []
+        try:
+            for member, read in iter_archive_members(archive):
+                if member.is_link:
+                    self.telemetry.pruned_paths += 1
+                    continue
+                if not self._enter_parents(member.name, archive_node, entered):
+                    continue
+                virtual_path = archive / member.name
+                scan_entry = self._process_file(str(virtual_path), member.name, archive_node, member)
+                if scan_entry is not None:
+                    data = read() if scan_entry[1] is None else b""
+                    found.append((VirtualFile.member(virtual_path, data, member.size, member.mtime_ns), scan_entry[1]))
+        except (OSError, EOFError, tarfile.TarError, zipfile.BadZipFile) as e:
+            print(f"[warning] Cannot read archive {archive}: {e}", file=sys.stderr)
+        finally:
+            self.ghosted_dirs = outer_ghosts
+
+        root_node.insert(self._relative(archive), is_file=False).merge(archive_node)
+        found.sort(key=lambda scan_entry: scan_entry[0])
+        yield from found
+
+    def _enter_parents(
+        self, rel_f: str, root_node: DirectoryNode, entered: Dict[str, bool], on_enter: Optional[Callable[[str], None]] = None
+    ) -> bool:
+        """Applies directory visibility to every ancestor of a listed file, once each.
+
+        on_enter is called for each newly entered directory whose contents are
+        needed, before any of its children are matched.
+        """
+        rel_dir = ""
+        for part in rel_f.split("/")[:-1]:
+            rel_dir = f"{rel_dir}/{part}" if rel_dir else part
+            state = entered.get(rel_dir)
+            if state is None:
+                state = entered[rel_dir] = self._enter_directory(rel_dir, root_node)
+                if state and on_enter is not None:
+                    on_enter(rel_dir)
+            if not state:
+                return False
+        return True
+
+    def _relative(self, path: Path) -> str:
+        if path == self.root_dir:
+            return "."
+        try:
+            return path.relative_to(self.root_dir).as_posix()
+        except ValueError:
+            return Path(os.path.relpath(path, self.root_dir)).as_posix()
+
+    @staticmethod
+    def _suffix(name: str) -> str:
+        """Mirrors ``PurePath.suffix`` without constructing a path object."""
+        i = name.rfind(".")
+        return name[i:] if 0 < i < len(name) - 1 else ""
+
+    def _enter_directory(self, rel_dir: str, root_node: DirectoryNode) -> bool:
+        """Records a directory's visibility and reports whether its contents are needed."""
+        vis, _ = self.matcher.get_visibility(rel_dir)
         if vis == Visibility.PRUNED:
             self.telemetry.pruned_paths += 1
+            return not self.matcher.can_skip_dir(rel_dir, vis)
+        if vis == Visibility.GHOSTED:
+            if self._inside_ghost(rel_dir):
+                self.telemetry.pruned_paths += 1
+            else:
+                self.telemetry.ghosted_paths += 1
+                self._insert_into_tree(root_node, rel_dir, is_file=False)
+            if self.matcher.can_skip_dir(rel_dir, vis):
+                return False
+            self.ghosted_dirs.add(rel_dir)
+        else:
+            self._insert_into_tree(root_node, rel_dir, is_file=False)
+        return True
+
+    def _inside_ghost(self, rel_path: str) -> bool:
+        """True for ghosted entries reached only because an override lies deeper.
+
+        The ghosted ancestor already stands in for them in the tree.
+        """
+        return rel_path.rpartition("/")[0] in self.ghosted_dirs
+
+    def _traverse_directory(
+        self, dir_path: str, rel_current: str, root_node: DirectoryNode, shards: Optional[List[Tuple[str, str]]] = None
+    ) -> Iterator[ScanEntry]:
+        if rel_current != "." and not self._enter_directory(rel_current, root_node):
+            return
+
+        # DirEntry caches the d_type reported by readdir, so classifying entries
+        # below costs no additional stat calls on filesystems that provide it.
+        try:
+            if self.listings is not None:
+                entries: List[Union[os.DirEntry[str], ListedEntry]] = self.listings.list(dir_path)
+            else:
+                with os.scandir(dir_path) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+        except PermissionError:
+            print(f"[warning] Permission denied: {dir_path}", file=sys.stderr)
             return
+        self.visited_dirs.append(dir_path)
+
+        if rel_current != "." and self.matcher.scope_positions:
+            for entry in entries:
+                if entry.name in SCOPED_IGNORE_FILES:
+                    self.matcher.load_scope(rel_current, entry.name, entry.path)
+
+        prefix = "" if rel_current == "." else rel_current + "/"
+        for entry in entries:
+            try:
+                is_symlink = entry.is_symlink()
+                is_dir = not is_symlink and entry.is_dir(follow_symlinks=False)
+                is_file = not is_symlink and not is_dir and entry.is_file(follow_symlinks=False)
+            except OSError:
+                continue
+
+            if is_symlink:
+                self.telemetry.pruned_paths += 1
+            elif is_dir and shards is not None:
+                shards.append((entry.path, prefix + entry.name))
+            elif is_dir:
+                yield from self._traverse_directory(entry.path, prefix + entry.name, root_node)
+            elif is_file:
+                scan_entry = self._process_file(entry.path, prefix + entry.name, root_node, entry)
+                if scan_entry:
+                    yield scan_entry
+
+    def _process_file(
+        self, path_str: str, rel_f: str, root_node: DirectoryNode, entry: Optional[Union[os.DirEntry[str], ListedEntry, ArchiveMember]] = None
+    ) -> Optional[ScanEntry]:
+        # Prevent self-referential scanning of the output destination. Traversal
+        # never follows symlinks, so plain path equality is sufficient here.
+        if path_str in self.own_files:
+            self.telemetry.pruned_paths += 1
+            return None
+
+        self.telemetry.scanned_paths += 1
+
+        vis, reason = self.matcher.get_visibility(rel_f)
+        is_explicit_override = (reason == "EXPLICIT_INCLUDE")
+
+        if vis == Visibility.PRUNED:
+            self.telemetry.pruned_paths += 1
+            return None
 
         if vis == Visibility.GHOSTED:
+            if self._inside_ghost(rel_f):
+                self.telemetry.pruned_paths += 1
+                return None
             self.telemetry.ghosted_paths += 1
             self._insert_into_tree(root_node, rel_f, is_file=True)
-            return
+            return None
 
         if vis == Visibility.REDACTED:
             self.telemetry.redacted_files += 1
             if reason and "SECURITY" in reason:
                 self.telemetry.secrets_redacted += 1
             self._insert_into_tree(root_node, rel_f, is_file=True)
-            redacted.append((file_path, reason or "USER_OVERRIDE"))
-            return
+            return Path(path_str), reason or "USER_OVERRIDE"
 
-        if vis == Visibility.INCLUDED:
-            if self.file_types and file_path.suffix not in self.file_types and not is_explicit_override:
-                self.telemetry.pruned_paths += 1
-                return
+        if self.file_types and self._suffix(rel_f.rpartition("/")[2]) not in self.file_types and not is_explicit_override:
+            self.telemetry.pruned_paths += 1
+            return None
 
-            try:
-                f_size = file_path.stat().st_size
-                if f_size > self.max_file_bytes and not is_explicit_override:
-                    self.telemetry.redacted_files += 1
-                    self._insert_into_tree(root_node, rel_f, is_file=True)
-                    mb_size = f_size / (1024 * 1024)
-                    redacted.append((file_path, f"EXCEEDS_FILE_SIZE_LIMIT (> {mb_size:.1f} MB)"))
-                    return
-            except OSError:
-                pass
+        try:
+            f_size = entry.stat(follow_symlinks=False).st_size if entry else os.stat(path_str).st_size
+            if f_size > self.max_file_bytes and not is_explicit_override and not self.excerpt_oversized:
+                self.telemetry.redacted_files += 1
+                self._insert_into_tree(root_node, rel_f, is_file=True)
+                mb_size = f_size / (1024 * 1024)
+                return Path(path_str), f"EXCEEDS_FILE_SIZE_LIMIT (> {mb_size:.1f} MB)"
+        except OSError:
+            pass
 
-            self.telemetry.included_files += 1
-            self._insert_into_tree(root_node, rel_f, is_file=True)
-            included.append(file_path)
+        self.telemetry.included_files += 1
+        self._insert_into_tree(root_node, rel_f, is_file=True)
+        return Path(path_str), None
 
     def _insert_into_tree(self, root: DirectoryNode, rel_path: str, is_file: bool) -> None:
-        parts = [p for p in rel_path.split("/") if p]
-        node = root
-        for i, part in enumerate(parts):
-            if i == len(parts) - 1 and is_file:
-                node.files.add(part)
-            else:
-                if part not in node.directories:
-                    node.directories[part] = DirectoryNode(part)
-                node = node.directories[part]
+        root.insert(rel_path, is_file)
+
+
+# Per-process scanner installed by the ProcessPoolExecutor initializer.
+_SCAN_WORKER: Optional[RepoScanner] = None
+
+
+def _init_scan_worker(scanner: RepoScanner) -> None:
+    global _SCAN_WORKER
+    _SCAN_WORKER = scanner
+
+
+def _scan_shard(shard: Tuple[str, str]) -> Tuple[DirectoryNode, List[ScanEntry], Telemetry, Optional[RunStats]]:
+    """Walks one subtree in a worker process with fresh telemetry and stats."""
+    scanner = _SCAN_WORKER
+    scanner.telemetry = Telemetry()
+    if scanner.matcher.stats is not None:
+        scanner.matcher.stats = RunStats()
+    root_node = DirectoryNode("/")
+    entries = list(scanner._traverse_directory(shard[0], shard[1], root_node))
+    return root_node, entries, scanner.telemetry, scanner.matcher.stats
 
 
 class LimitReachedError(Exception):
@@ -446,65 +1884,258 @@ class LimitReachedError(Exception):
 class XMLRepoRenderer:
     """Manages the generation of structured XML payload."""
 
-    def __init__(self, root_dir: Path, telemetry: Telemetry, max_bytes: Optional[int]):
+    def __init__(
+        self, root_dir: Path, telemetry: Telemetry, max_bytes: Optional[int], jobs: int = 1,
+        cache: Optional[Union[RenderCache, "RenderMemo"]] = None, dedup: bool = False
+    ):
         self.root_dir = root_dir
         self.telemetry = telemetry
         self.max_bytes = max_bytes
-        self.stream: Optional[TextIO] = None
-
-    def _write(self, text: str) -> None:
-        """Writes text payload while enforcing global size limits transactionally."""
+        self.jobs = max(1, jobs)
+        self.cache = cache
+        self.dedup = ContentDeduplicator(self._reload) if dedup else None
+        self.stats: Optional[RunStats] = None
+        self.stream: Optional[BinaryIO] = None
+        # Set in delta mode: the git ref or manifest compared against, and the paths deleted since.
+        self.delta_base: Optional[str] = None
+        self.deleted: List[str] = []
+        # Set when rendering a git revision instead of the working tree.
+        self.revision: Optional[str] = None
+        # Set when files over the per-file limit are rendered as head and tail excerpts.
+        self.excerpt: Optional[ExcerptPolicy] = None
+        # Files render_shards listed as redacted because no part could hold them.
+        self.shard_redacted: List[str] = []
+
+    def _write(self, data: bytes) -> None:
+        """Writes an encoded payload while enforcing global size limits transactionally."""
         if self.telemetry.limit_reached:
             raise LimitReachedError()
 
-        chunk_size = len(text.encode('utf-8'))
+        chunk_size = len(data)
 
         if self.max_bytes and self.telemetry.bytes_written + chunk_size > self.max_bytes:
             self.telemetry.limit_reached = True
-            warning = "\n  <warning>Extraction halted: Global size limit reached. Context is incomplete.</warning>\n  </files>\n</repository>\n"
+            warning = b"\n  <warning>Extraction halted: Global size limit reached. Context is incomplete.</warning>\n  </files>\n</repository>\n"
             if self.stream:
                 self.stream.write(warning)
             raise LimitReachedError()
 
-        if self.stream:
-            self.stream.write(text)
+        if self.stream and self.stats:
+            with self.stats.phase("write"):
+                self.stream.write(data)
+        elif self.stream:
+            self.stream.write(data)
         self.telemetry.bytes_written += chunk_size
 
-    def render(self, tree_root: DirectoryNode, included: List[Path], redacted: List[Tuple[Path, str]], target_paths: List[Path], out_stream: TextIO) -> None:
+    def render(self, tree_root: DirectoryNode, included: List[Path], redacted: List[Tuple[Path, str]], target_paths: List[Path], out_stream: BinaryIO) -> None:
         self.stream = out_stream
-        norm_paths = ", ".join(sorted(p.relative_to(self.root_dir).as_posix() if self.root_dir in p.parents else p.as_posix() for p in target_paths))
+        entries = chain(redacted, ((file_path, None) for file_path in included))
 
         try:
-            self._write("<repository>\n")
-            self._write("  <system_note>\n    This is a read-only repository snapshot. Some files are GHOSTED (in tree only) or REDACTED (content hidden). Do not hallucinate missing content.\n  </system_note>\n\n")
-
-            self._write("  <metadata>\n")
-            self._write(f"    <root>{self.root_dir.resolve()}</root>\n")
-            self._write(f"    <included_paths>{norm_paths}</included_paths>\n")
-            self._write(f"    <date>{datetime.now(timezone.utc).isoformat()}</date>\n")
-            self._write("  </metadata>\n\n")
+            self._write_header(target_paths)
+            self._write_tree(tree_root)
+            for chunk in self.deleted_chunks():
+                self._write(chunk.encode("utf-8"))
+            self._write_files(entries)
+            self._write(b"</repository>\n")
 
-            self._write("  <directory_tree>\n")
-            lines: List[str] = ["/"]
-            self._render_tree_nodes(tree_root, lines)
-            self._write("\n".join("    " + line for line in lines) + "\n")
-            self._write("  </directory_tree>\n\n")
-
-            self._write("  <files>\n")
+        except LimitReachedError:
+            pass
 
-            for file_path, reason in redacted:
-                self._write(self._build_redacted_xml(file_path, reason))
+    def render_stream(self, tree_root: DirectoryNode, entries: Iterable[ScanEntry], target_paths: List[Path], out_stream: BinaryIO) -> None:
+        """Renders files as the scanner yields them, emitting the directory tree last.
 
-            for file_path in included:
-                xml_chunk = self._build_included_xml(file_path)
-                if xml_chunk:
-                    self._write(xml_chunk)
+        Only the tree of names is retained; file lists and contents are never
+        accumulated, so output starts before the scan finishes.
+        """
+        self.stream = out_stream
 
-            self._write("  </files>\n</repository>\n")
+        try:
+            self._write_header(target_paths)
+            self.stream.flush()
+            self._write_files(entries)
+            self._write_tree(tree_root)
+            self._write(b"</repository>\n")
 
         except LimitReachedError:
             pass
 
+    def render_shards(
+        self, tree_root: DirectoryNode, included: List[Path], redacted: List[Tuple[Path, str]], target_paths: List[Path],
+        shard_bytes: int, open_part: Callable[[int], BinaryIO]
+    ) -> int:
+        """Splits the snapshot into well-formed parts of at most shard_bytes each.
+
+        Entries are taken in directory-tree order, so each part carries a
+        contiguous slice of the tree: its own files plus the tree-only entries
+        between them. Tree lines are costed at their widest possible prefix,
+        because connectors are only known once a slice is complete. Finished
+        parts are written on a thread pool while later files are rendered. A file
+        too large for any part is listed as redacted instead.
+
+        Returns:
+            The number of parts written.
+
+        Raises:
+            ValueError: If shard_bytes cannot hold a part with a single entry.
+        """
+        by_rel: Dict[str, ScanEntry] = {self.rel_path(p): (p, r) for p, r in redacted}
+        by_rel.update((self.rel_path(p), (p, None)) for p in included)
+        leaves = list(self._tree_leaves(tree_root, ""))
+        in_tree = {rel_path for rel_path, _ in leaves}
+        leaves.extend((rel_path, False) for rel_path in sorted(by_rel) if rel_path not in in_tree)
+
+        skeleton = len("".join(self.tree_chunks(DirectoryNode("/"))).encode("utf-8")) + len(b"  <files>\n  </files>\n</repository>\n")
+        deleted = "".join(self.deleted_chunks()).encode("utf-8")
+        parts_written = 0
+        pending: Deque[Future[None]] = deque()
+
+        with ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="repo2txt-part") as pool:
+            header = "".join(self.header_chunks(target_paths, part=1)).encode("utf-8")
+            part_leaves: List[Tuple[str, bool]] = []
+            part_chunks: List[bytes] = []
+            part_dirs: Set[str] = set()
+            used = len(header) + skeleton + len(deleted)
+
+            def flush() -> None:
+                nonlocal parts_written
+                parts_written += 1
+                tree = DirectoryNode("/")
+                for rel_path, is_dir in part_leaves:
+                    tree.insert(rel_path, is_file=not is_dir)
+                data = b"".join([
+                    header, "".join(self.tree_chunks(tree)).encode("utf-8"), deleted if parts_written == 1 else b"",
+                    b"  <files>\n", *part_chunks, b"  </files>\n</repository>\n",
+                ])
+                self.telemetry.bytes_written += len(data)
+                if len(pending) >= self.jobs * 2:
+                    pending.popleft().result()
+                pending.append(pool.submit(self._write_part, open_part, parts_written, data))
+
+            entries = (by_rel[rel_path] for rel_path, is_dir in leaves if not is_dir and rel_path in by_rel)
+            with closing(self._iter_file_xml(entries)) as chunks:
+                for rel_path, is_dir in leaves:
+                    chunk = next(chunks) if not is_dir and rel_path in by_rel else None
+                    cost = self._tree_cost(rel_path, is_dir, part_dirs) + (len(chunk) if chunk else 0)
+                    if used + cost > shard_bytes and part_leaves:
+                        flush()
+                        header = "".join(self.header_chunks(target_paths, part=parts_written + 1)).encode("utf-8")
+                        part_leaves, part_chunks, part_dirs = [], [], set()
+                        used = len(header) + skeleton
+                        cost = self._tree_cost(rel_path, is_dir, part_dirs) + (len(chunk) if chunk else 0)
+                    if used + cost > shard_bytes and chunk and by_rel[rel_path][1] is None:
+                        print(f"[warning] {rel_path} does not fit in a {shard_bytes}-byte part and is listed as redacted.", file=sys.stderr)
+                        self.telemetry.included_files -= 1
+                        self.telemetry.redacted_files += 1
+                        self.shard_redacted.append(rel_path)
+                        if self.dedup:
+                            # Later copies must carry the content themselves.
+                            self.dedup.forget(rel_path, chunk)
+                        chunk = self.build_redacted_xml(by_rel[rel_path][0], "EXCEEDS_SHARD_SIZE").encode("utf-8")
+                        cost = self._tree_cost(rel_path, is_dir, part_dirs) + len(chunk)
+                    if used + cost > shard_bytes:
+                        raise ValueError(f"--shard-size of {shard_bytes} bytes cannot hold a part containing {rel_path}.")
+
+                    self._tree_cost(rel_path, is_dir, part_dirs, record=True)
+                    part_leaves.append((rel_path, is_dir))
+                    if chunk:
+                        part_chunks.append(chunk)
+                    used += cost
+
+            if part_leaves or not parts_written:
+                flush()
+            for future in pending:
+                future.result()
+        return parts_written
+
+    def _write_part(self, open_part: Callable[[int], BinaryIO], index: int, data: bytes) -> None:
+        with self.stats.phase("write") if self.stats else nullcontext():
+            with open_part(index) as sink:
+                sink.write(data)
+
+    @classmethod
+    def _tree_leaves(cls, node: DirectoryNode, prefix: str) -> Iterator[Tuple[str, bool]]:
+        """Yields entries without children in display order as (relative path, is directory)."""
+        for name in sorted(node.directories, key=str.lower):
+            child = node.directories[name]
+            if child.directories or child.files:
+                yield from cls._tree_leaves(child, f"{prefix}{name}/")
+            else:
+                yield prefix + name, True
+        for name in sorted(node.files, key=str.lower):
+            yield prefix + name, False
+
+    @staticmethod
+    def _tree_cost(rel_path: str, is_dir: bool, part_dirs: Set[str], record: bool = False) -> int:
+        """Upper bound on the tree bytes a leaf adds to a part, counting ancestors not yet listed in it."""
+        parts = rel_path.split("/")
+        cost = 0
+        for depth, name in enumerate(parts):
+            is_last = depth == len(parts) - 1
+            ancestor = "/".join(parts[:depth + 1])
+            if not is_last and ancestor in part_dirs:
+                continue
+            # Indent, one prefix per ancestor, connector, name, trailing slash and newline.
+            cost += 4 + TREE_PREFIX_BYTES * depth + TREE_CONNECTOR_BYTES + len(name.encode("utf-8")) + (1 if is_dir or not is_last else 0) + 1
+            if record and not is_last:
+                part_dirs.add(ancestor)
+        return cost
+
+    def _write_header(self, target_paths: List[Path]) -> None:
+        for chunk in self.header_chunks(target_paths):
+            self._write(chunk.encode("utf-8"))
+
+    def _write_tree(self, tree_root: DirectoryNode) -> None:
+        for chunk in self.tree_chunks(tree_root):
+            self._write(chunk.encode("utf-8"))
+
+    def header_chunks(self, target_paths: List[Path], part: Optional[int] = None) -> List[str]:
+        """Returns the opening repository and metadata elements, numbered when writing parts."""
+        norm_paths = ", ".join(sorted(p.relative_to(self.root_dir).as_posix() if self.root_dir in p.parents else p.as_posix() for p in target_paths))
+        note = "This is a read-only repository snapshot. Some files are GHOSTED (in tree only) or REDACTED (content hidden). Do not hallucinate missing content."
+        since = ""
+        if self.delta_base is not None:
+            note += " Only files added or modified since the point named in changes_since are listed; earlier content of all other files is still current."
+            since = f"    <changes_since>{self.delta_base}</changes_since>\n"
+        if self.excerpt is not None:
+            note += " Files over the size limit may show only their first and last lines, with a truncated element marking the omitted bytes."
+        return [
+            "<repository>\n",
+            f"  <system_note>\n    {note}\n  </system_note>\n\n",
+            "  <metadata>\n",
+            f"    <root>{self.root_dir.resolve()}</root>\n",
+            f"    <included_paths>{norm_paths}</included_paths>\n",
+            f"    <revision>{self.revision}</revision>\n" if self.revision else "",
+            since,
+            f"    <part>{part}</part>\n" if part is not None else "",
+            f"    <date>{datetime.now(timezone.utc).isoformat()}</date>\n",
+            "  </metadata>\n\n",
+        ]
+
+    def tree_chunks(self, tree_root: DirectoryNode) -> List[str]:
+        """Returns the directory_tree element for a scanned tree."""
+        lines: List[str] = ["/"]
+        self._render_tree_nodes(tree_root, lines)
+        return [
+            "  <directory_tree>\n",
+            "\n".join("    " + line for line in lines) + "\n",
+            "  </directory_tree>\n\n",
+        ]
+
+    def deleted_chunks(self) -> List[str]:
+        """Returns the deleted_files element of a delta snapshot, or nothing if no file was removed."""
+        if not self.deleted:
+            return []
+        return ["  <deleted_files>\n", *(f'    <file path="{rel_path}"/>\n' for rel_path in self.deleted), "  </deleted_files>\n\n"]
+
+    def _write_files(self, entries: Iterable[ScanEntry]) -> None:
+        self._write(b"  <files>\n")
+        with closing(self._iter_file_xml(entries)) as chunks:
+            for xml_chunk in chunks:
+                if xml_chunk:
+                    self._write(xml_chunk)
+        self._write(b"  </files>\n")
+
     def _render_tree_nodes(self, node: DirectoryNode, lines: List[str], prefix: str = "") -> None:
         dirs = sorted(node.directories.keys(), key=str.lower)
         files = sorted(list(node.files), key=str.lower)
@@ -519,11 +2150,8 @@ class XMLRepoRenderer:
             else:
                 lines.append(f"{prefix}{connector}{name}")
 
-    def _build_redacted_xml(self, file_path: Path, reason: str) -> str:
-        try:
-            rel_path = file_path.relative_to(self.root_dir).as_posix()
-        except ValueError:
-            rel_path = file_path.as_posix()
+    def build_redacted_xml(self, file_path: Path, reason: str) -> str:
+        rel_path = self.rel_path(file_path)
 
         summary = "Content omitted."
         if "SECURITY" in reason:
@@ -540,24 +2168,160 @@ class XMLRepoRenderer:
             f'    </file>\n'
         )
 
-    def _build_included_xml(self, file_path: Path) -> Optional[str]:
+    def _iter_file_xml(self, entries: Iterable[ScanEntry]) -> Iterator[Optional[bytes]]:
+        """Yields rendered file chunks in input order, reading ahead on a worker pool.
+
+        Workers only read, decode and escape; telemetry and writes stay on the
+        calling thread so size limits are enforced exactly as in a serial run.
+        """
+        if self.jobs == 1:
+            for file_path, reason in entries:
+                if reason is None:
+                    yield self._build_included_xml(file_path)
+                else:
+                    yield self.build_redacted_xml(file_path, reason).encode("utf-8")
+            return
+
+        entries = iter(entries)
+        window = self.jobs * 4
+        pending: Deque[Tuple[Path, Optional[FileIdentity], Future[RenderedFile]]] = deque()
+        with ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="repo2txt") as pool:
+            try:
+                for scan_entry in entries:
+                    pending.append(self._schedule(pool, scan_entry))
+                    if len(pending) >= window:
+                        break
+                while pending:
+                    file_path, ident, future = pending.popleft()
+                    rendered = future.result()
+                    if ident is not None:
+                        self.cache.put(self.rel_path(file_path), ident, rendered)
+                    scan_entry = next(entries, None)
+                    if scan_entry is not None:
+                        pending.append(self._schedule(pool, scan_entry))
+                    yield self._account_included(file_path, rendered)
+            finally:
+                for _, _, future in pending:
+                    future.cancel()
+
+    def _schedule(self, pool: ThreadPoolExecutor, scan_entry: ScanEntry) -> Tuple[Path, Optional[FileIdentity], Future[RenderedFile]]:
+        """Resolves redactions and cache hits immediately and submits the rest.
+
+        The returned identity is only set for misses that should be stored once
+        the worker finishes; the cache itself is only touched on this thread.
+        """
+        file_path, reason = scan_entry
+        ready: Optional[RenderedFile] = None
+        ident = self._cache_identity(file_path) if self.cache and reason is None else None
+
+        if reason is not None:
+            ready = RenderedFile(self.build_redacted_xml(file_path, reason).encode("utf-8"), 0, False)
+        elif ident is not None:
+            ready = self.cache.get(self.rel_path(file_path), ident)
+            if ready is not None:
+                self.telemetry.cache_hits += 1
+                ident = None
+
+        if ready is None:
+            return file_path, ident, pool.submit(self._render_included, file_path)
+        future: Future[RenderedFile] = Future()
+        future.set_result(ready)
+        return file_path, None, future
+
+    def _cache_identity(self, file_path: Path) -> Optional[FileIdentity]:
+        """Returns the cache key of a file, or None for excerpts, which depend on the excerpt options."""
+        ident = RenderCache.identity(file_path)
+        if ident is not None and self.excerpt is not None and self.excerpt.applies(ident[2]):
+            return None
+        return ident
+
+    def _account_included(self, file_path: Path, rendered: RenderedFile) -> Optional[bytes]:
+        if rendered.is_binary:
+            self.telemetry.ghosted_paths += 1
+            self.telemetry.included_files -= 1
+            return None
+        if rendered.excerpted:
+            self.telemetry.excerpted_files += 1
+        if self.dedup and rendered.line_count:
+            rel_path = self.rel_path(file_path)
+            original = self.dedup.first_copy(rel_path, file_path, rendered.xml)
+            if original is not None:
+                self.telemetry.duplicate_files += 1
+                return f'    <file path="{rel_path}" duplicate_of="{original}"/>\n'.encode("utf-8")
+        return rendered.xml
+
+    def _reload(self, file_path: Path) -> Optional[bytes]:
+        """Re-renders an earlier file so the deduplicator can confirm a checksum match."""
+        return self._render_included(file_path).xml
+
+    def _build_included_xml(self, file_path: Path) -> Optional[bytes]:
+        ident = self._cache_identity(file_path) if self.cache else None
+        if ident is None:
+            return self._account_included(file_path, self._render_included(file_path))
+
+        rel_path = self.rel_path(file_path)
+        rendered = self.cache.get(rel_path, ident)
+        if rendered is not None:
+            self.telemetry.cache_hits += 1
+        else:
+            rendered = self._render_included(file_path)
+            self.cache.put(rel_path, ident, rendered)
+        return self._account_included(file_path, rendered)
+
+    def rel_path(self, file_path: Path) -> str:
         try:
-            rel_path = file_path.relative_to(self.root_dir).as_posix()
+            return file_path.relative_to(self.root_dir).as_posix()
         except ValueError:
-            rel_path = file_path.as_posix()
+            return file_path.as_posix()
 
+    def _render_included(self, file_path: Path) -> RenderedFile:
+        """Reads and formats a single file. Safe to call from worker threads."""
+        rel_path = self.rel_path(file_path)
+        if self.excerpt is not None:
+            try:
+                oversized = self.excerpt.applies(file_path.stat().st_size)
+            except OSError:
+                oversized = False  # read_text reports the file as unreadable.
+            if oversized:
+                return self.render_excerpt(file_path)
+        if self.stats:
+            wall, cpu = time.perf_counter(), time.thread_time()
         text, line_count, is_binary = FileReader.read_text(file_path)
+        if self.stats:
+            read_s = time.perf_counter() - wall
+            self.stats.add_phase("read", read_s, time.thread_time() - cpu)
+            try:
+                self.stats.record_file(rel_path, file_path.stat().st_size, read_s)
+            except OSError:
+                pass
 
         if is_binary:
-            self.telemetry.ghosted_paths += 1
-            self.telemetry.included_files -= 1
-            return None
+            return RenderedFile(None, 0, True)
+
+        with self.stats.phase("format") if self.stats else nullcontext():
+            lang = EXT_TO_LANG.get(file_path.suffix, "text")
 
-        lang = EXT_TO_LANG.get(file_path.suffix, "text")
+            content = text or ""
+            escaped_cdata = content.replace("]]>", "]]]]><![CDATA[>")
 
-        content = text or ""
-        escaped_cdata = content.replace("]]>", "]]]]><![CDATA[>")
+            xml = self.format_included_xml(rel_path, lang, line_count, escaped_cdata).encode("utf-8")
+        return RenderedFile(xml, line_count, False)
 
+    def render_excerpt(self, file_path: Path) -> RenderedFile:
+        """Reads and formats the head and tail of a file over the per-file limit."""
+        with self.stats.phase("read") if self.stats else nullcontext():
+            excerpt = FileReader.read_excerpt(file_path, self.excerpt)
+        if excerpt is None:
+            return RenderedFile(None, 0, True)
+
+        head = excerpt.head.replace("]]>", "]]]]><![CDATA[>")
+        tail = excerpt.tail.replace("]]>", "]]]]><![CDATA[>")
+        escaped_cdata = f'{head}\n]]><truncated bytes_omitted="{excerpt.bytes_omitted}"/><![CDATA[\n{tail}'
+        xml = self.format_included_xml(self.rel_path(file_path), EXT_TO_LANG.get(file_path.suffix, "text"), excerpt.line_count, escaped_cdata)
+        return RenderedFile(xml.encode("utf-8"), excerpt.line_count, False, excerpted=True)
+
+    @staticmethod
+    def format_included_xml(rel_path: str, lang: str, line_count: int, escaped_cdata: str) -> str:
         return (
             f'    <file path="{rel_path}">\n'
             f'      <metadata>\n'
@@ -569,13 +2333,1026 @@ class XMLRepoRenderer:
         )
 
 
+@dataclass
+class SubtreeEstimate:
+    """Predicted output contribution of the files beneath one directory."""
+    path: str
+    files: int = 0
+    bytes: int = 0
+    tokens: int = 0
+
+
+class OutputEstimator:
+    """Predicts output bytes and tokens per directory from stat sizes, without opening any file.
+
+    Content is assumed to be emitted as-is, so the prediction is an upper bound
+    whenever files turn out to be binary at render time. Wrapper elements are
+    formatted exactly; only the digits of the line count are guessed.
+    """
+
+    # Typical bytes per source line, used only for the width of <size_lines>.
+    BYTES_PER_LINE = 40
+    # Source code averages somewhat under four bytes per token with common BPE vocabularies.
+    BYTES_PER_TOKEN = 3.5
+
+    def __init__(self, renderer: "XMLRepoRenderer"):
+        self.renderer = renderer
+
+    def estimate(
+        self, tree_root: DirectoryNode, included: List[Path], redacted: List[Tuple[Path, str]], target_paths: List[Path]
+    ) -> List[SubtreeEstimate]:
+        """Records totals in telemetry and returns per-directory estimates, heaviest first."""
+        estimate = TokenEstimator.estimate
+        skeleton = "".join(self.renderer.header_chunks(target_paths) + self.renderer.tree_chunks(tree_root) + self.renderer.deleted_chunks())
+        skeleton_bytes = (skeleton + "  <files>\n  </files>\n</repository>\n").encode("utf-8")
+        total = SubtreeEstimate(".", 0, len(skeleton_bytes), estimate(skeleton_bytes))
+        subtrees: Dict[str, SubtreeEstimate] = {}
+
+        def account(rel_path: str, nbytes: int, tokens: int) -> None:
+            total.files += 1
+            total.bytes += nbytes
+            total.tokens += tokens
+            rel_dir = rel_path.rpartition("/")[0]
+            while rel_dir:
+                entry = subtrees.get(rel_dir)
+                if entry is None:
+                    entry = subtrees[rel_dir] = SubtreeEstimate(rel_dir)
+                entry.files += 1
+                entry.bytes += nbytes
+                entry.tokens += tokens
+                rel_dir = rel_dir.rpartition("/")[0]
+
+        for file_path, reason in redacted:
+            wrapper = self.renderer.build_redacted_xml(file_path, reason).encode("utf-8")
+            account(self.renderer.rel_path(file_path), len(wrapper), estimate(wrapper))
+        for file_path in included:
+            try:
+                size = file_path.stat().st_size
+            except OSError:
+                continue
+            excerpt = self.renderer.excerpt
+            if excerpt is not None and excerpt.applies(size):
+                side = excerpt.side_bytes if excerpt.side_lines is None else min(excerpt.side_bytes, excerpt.side_lines * self.BYTES_PER_LINE)
+                size = 2 * side
+            rel_path = self.renderer.rel_path(file_path)
+            wrapper = self.renderer.format_included_xml(
+                rel_path, EXT_TO_LANG.get(file_path.suffix, "text"), size // self.BYTES_PER_LINE, ""
+            ).encode("utf-8")
+            account(rel_path, len(wrapper) + size, estimate(wrapper) + math.ceil(size / self.BYTES_PER_TOKEN))
+
+        self.renderer.telemetry.estimated_bytes = total.bytes
+        self.renderer.telemetry.estimated_tokens = total.tokens
+        # A directory whose files all sit in one subdirectory would only repeat that row.
+        redundant = {
+            rel_dir.rpartition("/")[0] for rel_dir, entry in subtrees.items()
+            if subtrees.get(rel_dir.rpartition("/")[0], entry).files == entry.files and "/" in rel_dir
+        }
+        return sorted((e for e in subtrees.values() if e.path not in redundant), key=lambda e: (-e.bytes, e.path))
+
+    @staticmethod
+    def print_report(subtrees: List[SubtreeEstimate], top: int) -> None:
+        """Prints the heaviest directories to stderr."""
+        if not subtrees or top <= 0:
+            return
+        print(file=sys.stderr)
+        print("="*55, file=sys.stderr)
+        print(" HEAVIEST SUBTREES (estimated from stat sizes)", file=sys.stderr)
+        print("="*55, file=sys.stderr)
+        print(f" {'Size':>9}  {'Tokens':>10}  {'Files':>6}  Path", file=sys.stderr)
+        for entry in subtrees[:top]:
+            print(f" {entry.bytes / (1024 * 1024):>6.2f} MB  {entry.tokens:>10}  {entry.files:>6}  {entry.path}/", file=sys.stderr)
+        print("="*55, file=sys.stderr)
+
+
+class TokenBudgetPlanner:
+    """Selects the subset of included files that fits a token budget.
+
+    Selection is a 0/1 knapsack: each file's value is its priority from the
+    configured weights and its weight is the token cost of including it rather
+    than listing it as a budget redaction. Files are packed greedily by value
+    density, and the result is compared against the best single file to keep
+    the classic half-optimal guarantee.
+    """
+
+    def __init__(self, renderer: "XMLRepoRenderer", weights: TokenWeights, jobs: int = 1):
+        self.renderer = renderer
+        self.weights = weights
+        self.jobs = max(1, jobs)
+
+    def select(
+        self, tree_root: DirectoryNode, included: List[Path], redacted: List[Tuple[Path, str]],
+        target_paths: List[Path], max_tokens: int
+    ) -> Tuple[List[Path], List[Tuple[Path, str]]]:
+        """Returns the included files to keep and the redaction list extended with the rest."""
+        estimate = TokenEstimator.estimate
+        skeleton = "".join(self.renderer.header_chunks(target_paths) + self.renderer.tree_chunks(tree_root) + self.renderer.deleted_chunks())
+        skeleton += "  <files>\n  </files>\n</repository>\n"
+        fixed = estimate(skeleton.encode("utf-8"))
+        fixed += sum(estimate(self.renderer.build_redacted_xml(p, r).encode("utf-8")) for p, r in redacted)
+
+        if self.jobs > 1:
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                measured = list(pool.map(self._measure, included))
+        else:
+            measured = [self._measure(p) for p in included]
+
+        costs = [incl - excl for incl, excl, _ in measured]
+        budget = max_tokens - fixed - sum(excl for _, excl, _ in measured)
+        if budget < 0:
+            print(f"[warning] Token budget is below the ~{max_tokens - budget} tokens needed for the tree and metadata alone.", file=sys.stderr)
+        values = self._priorities(included, [mtime for _, _, mtime in measured])
+
+        chosen: Set[int] = set()
+        used = 0
+        total_value = 0.0
+        # Files cheaper to include than to list as redacted only free up budget.
+        order = sorted(range(len(included)), key=lambda i: (costs[i] > 0, -values[i] / max(costs[i], 1)))
+        for i in order:
+            if used + costs[i] <= budget:
+                chosen.add(i)
+                used += costs[i]
+                total_value += values[i]
+
+        singles = [i for i in range(len(included)) if costs[i] > 0 and costs[i] <= budget]
+        best = max(singles, key=lambda i: values[i], default=None)
+        if best is not None and values[best] > total_value:
+            chosen = {i for i in range(len(included)) if costs[i] <= 0} | {best}
+            used = sum(costs[i] for i in chosen)
+
+        self.renderer.telemetry.estimated_tokens = max_tokens - budget + used
+        kept: List[Path] = []
+        dropped = list(redacted)
+        for i, file_path in enumerate(included):
+            if i in chosen:
+                kept.append(file_path)
+            else:
+                self.renderer.telemetry.included_files -= 1
+                self.renderer.telemetry.redacted_files += 1
+                dropped.append((file_path, "EXCEEDS_TOKEN_BUDGET"))
+        dropped.sort(key=lambda x: x[0])
+        return kept, dropped
+
+    def _measure(self, file_path: Path) -> Tuple[int, int, float]:
+        """Returns (tokens if included, tokens if listed as redacted, mtime)."""
+        estimate = TokenEstimator.estimate
+        excluded = estimate(self.renderer.build_redacted_xml(file_path, "EXCEEDS_TOKEN_BUDGET").encode("utf-8"))
+        try:
+            excerpt = self.renderer.excerpt
+            if excerpt is not None and excerpt.applies(file_path.stat().st_size):
+                rendered = self.renderer.render_excerpt(file_path)
+                mtime = file_path.stat().st_mtime if self.weights.recency else 0.0
+                return (0 if rendered.is_binary else estimate(rendered.xml)), excluded, mtime
+            if isinstance(file_path, VirtualFile):
+                data, mtime = file_path.data, file_path.stat().st_mtime
+            else:
+                with open(file_path, "rb") as f:
+                    data = f.read()
+                    mtime = os.fstat(f.fileno()).st_mtime if self.weights.recency else 0.0
+        except OSError:
+            return 0, excluded, 0.0
+
+        if b"\x00" in data:
+            return 0, excluded, mtime
+
+        wrapper = self.renderer.format_included_xml(
+            self.renderer.rel_path(file_path), EXT_TO_LANG.get(file_path.suffix, "text"), data.count(b"\n"), ""
+        )
+        return estimate(data) + estimate(wrapper.encode("utf-8")), excluded, mtime
+
+    def _priorities(self, included: List[Path], mtimes: List[float]) -> List[float]:
+        weights = self.weights
+        ranks: Dict[int, float] = {}
+        if weights.recency and len(included) > 1:
+            for rank, i in enumerate(sorted(range(len(included)), key=lambda i: mtimes[i])):
+                ranks[i] = rank / (len(included) - 1)
+
+        values = []
+        for i, file_path in enumerate(included):
+            depth = self.renderer.rel_path(file_path).count("/")
+            value = weights.extensions.get(file_path.suffix, 1.0)
+            value /= 1.0 + weights.depth * depth
+            value *= 1.0 + weights.recency * ranks.get(i, 0.0)
+            values.append(value)
+        return values
+
+
+# ==============================================================================
+# DELTA MODE
+# ==============================================================================
+
+@dataclass(frozen=True)
+class ManifestEntry:
+    """Recorded state of one snapshot file.
+
+    ``digest`` is the SHA-256 of an included file's contents, or ``REDACTED:``
+    followed by the reason for a redacted one, since only the reason is emitted.
+    """
+    size: int
+    mtime_ns: int
+    digest: str
+
+
+class SnapshotManifest:
+    """Per-file size, mtime and content hash of one extraction, used as the base of a later delta.
+
+    A file whose size and mtime match the base manifest keeps its recorded hash
+    without being read, unless it was modified within the racy window before
+    the base snapshot was taken.
+    """
+
+    VERSION = 1
+    RACY_WINDOW_NS = RenderCache.RACY_WINDOW_NS
+    READ_CHUNK = 1 << 20
+
+    def __init__(self, files: Dict[str, ManifestEntry], created_ns: int):
+        self.files = files
+        self.created_ns = created_ns
+
+    @classmethod
+    def load(cls, path: Path) -> "SnapshotManifest":
+        """Reads a manifest written by save().
+
+        Raises:
+            ValueError: If the file cannot be read or was written in another format.
+        """
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            raise ValueError(f"Cannot read manifest {path}: {e}") from e
+        if not isinstance(data, dict) or data.get("version") != cls.VERSION:
+            raise ValueError(f"Unsupported manifest format in {path}.")
+        try:
+            files = {rel_path: ManifestEntry(int(size), int(mtime_ns), str(digest)) for rel_path, (size, mtime_ns, digest) in data["files"].items()}
+            return cls(files, int(data["created_ns"]))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Malformed manifest {path}: {e}") from e
+
+    def save(self, path: Path) -> None:
+        """Writes the manifest through a temporary file so readers never see a partial one."""
+        data = {
+            "version": self.VERSION,
+            "created_ns": self.created_ns,
+            "files": {rel_path: [e.size, e.mtime_ns, e.digest] for rel_path, e in sorted(self.files.items())},
+        }
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+            f.write("\n")
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def build(cls, scanned: List[Tuple[str, Path, Optional[str]]], base: Optional["SnapshotManifest"], jobs: int = 1) -> "SnapshotManifest":
+        """Records (relative path, path, redaction reason) scan results, hashing only files that may have changed."""
+        created_ns = time.time_ns()
+        files: Dict[str, ManifestEntry] = {}
+        to_hash: List[Tuple[str, Path, os.stat_result]] = []
+        for rel_path, file_path, reason in scanned:
+            try:
+                st = file_path.stat()
+            except OSError:
+                continue
+            if reason is not None:
+                files[rel_path] = ManifestEntry(st.st_size, st.st_mtime_ns, f"REDACTED:{reason}")
+                continue
+            known = base.files.get(rel_path) if base else None
+            if (
+                known is not None and not known.digest.startswith("REDACTED:")
+                and (known.size, known.mtime_ns) == (st.st_size, st.st_mtime_ns)
+                and base.created_ns - known.mtime_ns >= cls.RACY_WINDOW_NS
+            ):
+                files[rel_path] = known
+            else:
+                to_hash.append((rel_path, file_path, st))
+
+        if jobs > 1 and len(to_hash) > 1:
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                digests = list(pool.map(cls.content_digest, (file_path for _, file_path, _ in to_hash)))
+        else:
+            digests = [cls.content_digest(file_path) for _, file_path, _ in to_hash]
+        for (rel_path, _, st), digest in zip(to_hash, digests):
+            if digest is not None:
+                files[rel_path] = ManifestEntry(st.st_size, st.st_mtime_ns, digest)
+        return cls(files, created_ns)
+
+    @classmethod
+    def content_digest(cls, file_path: Path) -> Optional[str]:
+        if isinstance(file_path, VirtualFile):
+            return hashlib.sha256(file_path.data).hexdigest()
+        h = hashlib.sha256()
+        try:
+            with open(file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(cls.READ_CHUNK), b""):
+                    h.update(chunk)
+        except OSError:
+            return None
+        return h.hexdigest()
+
+    def mark_redacted(self, rel_path: str, reason: str) -> None:
+        """Records that a file was emitted as redacted, e.g. after it was dropped from a token budget or shard."""
+        entry = self.files.get(rel_path)
+        if entry is not None:
+            self.files[rel_path] = replace(entry, digest=f"REDACTED:{reason}")
+
+    def changes(self, base: "SnapshotManifest") -> Set[str]:
+        """Returns the paths that are new or whose recorded state differs from base."""
+        changed: Set[str] = set()
+        for rel_path, entry in self.files.items():
+            known = base.files.get(rel_path)
+            if known is None or known.digest != entry.digest:
+                changed.add(rel_path)
+        return changed
+
+    def deletions(self, base: "SnapshotManifest", scopes: List[str]) -> List[str]:
+        """Returns base paths within the scanned scopes that this snapshot no longer holds."""
+        def in_scope(rel_path: str) -> bool:
+            return any(scope == "." or rel_path == scope or rel_path.startswith(scope + "/") for scope in scopes)
+        return sorted(rel_path for rel_path in base.files if rel_path not in self.files and in_scope(rel_path))
+
+
+# ==============================================================================
+# WATCH MODE
+# ==============================================================================
+
+class RenderMemo:
+    """In-process store of rendered chunks shared by successive extractions.
+
+    Entries are validated by file identity like RenderCache. Watch mode runs
+    without a racy window because it discards paths it was told changed; the
+    server sets one, and bounds the memo to max_bytes with LRU eviction. Misses
+    fall back to an optional persistent cache until it is closed.
+    """
+
+    def __init__(self, backing: Optional[RenderCache] = None, max_bytes: Optional[int] = None, racy_window_ns: int = 0):
+        self.backing = backing
+        self.max_bytes = max_bytes
+        self.racy_window_ns = racy_window_ns
+        self.entries: Dict[str, Tuple[FileIdentity, RenderedFile]] = {}
+        self.nbytes = 0
+
+    def get(self, rel_path: str, ident: FileIdentity) -> Optional[RenderedFile]:
+        entry = self.entries.get(rel_path)
+        if entry is not None and entry[0] == ident:
+            if self.max_bytes is not None:
+                self.entries[rel_path] = self.entries.pop(rel_path)
+            return entry[1]
+        rendered = self.backing.get(rel_path, ident) if self.backing else None
+        if rendered is not None:
+            self._store(rel_path, ident, rendered)
+        return rendered
+
+    def put(self, rel_path: str, ident: FileIdentity, rendered: RenderedFile) -> None:
+        if self.backing:
+            self.backing.put(rel_path, ident, rendered)
+        if self.racy_window_ns and time.time_ns() - ident[3] < self.racy_window_ns:
+            self.discard(rel_path)
+            return
+        self._store(rel_path, ident, rendered)
+
+    def _store(self, rel_path: str, ident: FileIdentity, rendered: RenderedFile) -> None:
+        self.discard(rel_path)
+        self.entries[rel_path] = (ident, rendered)
+        self.nbytes += len(rendered.xml or b"")
+        if self.max_bytes is not None:
+            while self.nbytes > self.max_bytes:
+                self.discard(next(iter(self.entries)))
+
+    def discard(self, rel_path: str) -> None:
+        entry = self.entries.pop(rel_path, None)
+        if entry is not None:
+            self.nbytes -= len(entry[1].xml or b"")
+
+    def retain(self, rel_paths: Set[str]) -> None:
+        """Drops entries for files that are no longer part of the snapshot."""
+        for rel_path in [r for r in self.entries if r not in rel_paths]:
+            self.discard(rel_path)
+
+    def close(self) -> None:
+        """Commits and detaches the persistent cache; the memo stays usable."""
+        if self.backing:
+            self.backing.close()
+            self.backing = None
+
+
+# A batch of filesystem changes: files whose content changed, and whether any
+# entry was created, removed or renamed.
+ChangeSet = Tuple[Set[str], bool]
+
+
+class InotifyWatcher:
+    """Watches scanned directories through the Linux inotify API via ctypes.
+
+    Raises:
+        OSError: If inotify is unavailable or the watch limit is exhausted.
+    """
+
+    IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+    IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+    IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW, IN_IGNORED = 0x400, 0x800, 0x4000, 0x8000
+    CONTENT = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE
+    STRUCTURE = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    EVENT = struct.Struct("iIII")
+    # Editors write in bursts; events arriving within this delay form one batch.
+    SETTLE_SECONDS = 0.1
+
+    def __init__(self, ignored: Set[str]):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.ignored = ignored
+        self.dirs: Dict[int, str] = {}
+
+    def watch(self, dirs: List[str], files: Iterable[str]) -> None:
+        """Replaces the watched directory set; files are covered by their directories."""
+        wanted = set(dirs)
+        for wd, dir_path in list(self.dirs.items()):
+            if dir_path not in wanted:
+                self._libc.inotify_rm_watch(self.fd, wd)
+                del self.dirs[wd]
+        watched = set(self.dirs.values())
+        for dir_path in wanted - watched:
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(dir_path), self.CONTENT | self.STRUCTURE)
+            if wd >= 0:
+                self.dirs[wd] = dir_path
+            elif ctypes.get_errno() == errno.ENOSPC:
+                raise OSError(errno.ENOSPC, "inotify watch limit reached")
+
+    def wait(self) -> ChangeSet:
+        """Blocks until at least one relevant change arrives and returns the batch."""
+        while True:
+            select.select([self.fd], [], [])
+            time.sleep(self.SETTLE_SECONDS)
+            modified: Set[str] = set()
+            structural = False
+            for wd, mask, name in self._drain():
+                if mask & self.IN_IGNORED:
+                    self.dirs.pop(wd, None)
+                    continue
+                if mask & self.IN_Q_OVERFLOW:
+                    structural = True
+                    continue
+                dir_path = self.dirs.get(wd)
+                if dir_path is None:
+                    continue
+                path = os.path.join(dir_path, name) if name else dir_path
+                if path in self.ignored:
+                    continue
+                if mask & self.STRUCTURE:
+                    structural = True
+                elif name:
+                    modified.add(path)
+            if modified or structural:
+                return modified, structural
+
+    def _drain(self) -> Iterator[Tuple[int, int, str]]:
+        data = b""
+        while True:
+            try:
+                chunk = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            data += chunk
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = os.fsdecode(data[offset:offset + name_len].rstrip(b"\0"))
+            offset += name_len
+            yield wd, mask, name
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Portable fallback that periodically compares stat results.
+
+    Directories are compared by mtime first and by listing only when the mtime
+    moved, so ignored entries (the output file) never trigger a rescan.
+    """
+
+    def __init__(self, ignored: Set[str], interval: float = 1.0):
+        self.ignored = ignored
+        self.interval = interval
+        self.dirs: Dict[str, Tuple[int, Set[str]]] = {}
+        self.files: Dict[str, Optional[FileIdentity]] = {}
+
+    def watch(self, dirs: List[str], files: Iterable[str]) -> None:
+        self.dirs = {d: state for d in dirs if (state := self._dir_state(d)) is not None}
+        self.files = {f: RenderCache.identity(Path(f)) for f in files}
+
+    def _dir_state(self, dir_path: str, known: Optional[Tuple[int, Set[str]]] = None) -> Optional[Tuple[int, Set[str]]]:
+        try:
+            mtime = os.stat(dir_path).st_mtime_ns
+            if known is not None and known[0] == mtime:
+                return known
+            names = {n for n in os.listdir(dir_path) if os.path.join(dir_path, n) not in self.ignored}
+        except OSError:
+            return None
+        return mtime, names
+
+    def wait(self) -> ChangeSet:
+        while True:
+            time.sleep(self.interval)
+            structural = False
+            for dir_path, known in self.dirs.items():
+                state = self._dir_state(dir_path, known)
+                if state is None or state[1] != known[1]:
+                    structural = True
+                    break
+                self.dirs[dir_path] = state
+            modified = {f for f, ident in self.files.items() if RenderCache.identity(Path(f)) != ident}
+            for file_path in modified:
+                self.files[file_path] = RenderCache.identity(Path(file_path))
+            if modified or structural:
+                return modified, structural
+
+    def close(self) -> None:
+        pass
+
+
+class WatchSession:
+    """Keeps an output file current by re-rendering only what changed.
+
+    Content changes re-classify and re-render just the touched files; creations,
+    deletions, renames and edits to ignore files rescan the tree, which still
+    serves every unchanged file from the in-memory memo. Each refresh replaces
+    the output atomically so readers never observe a partial snapshot.
+    """
+
+    def __init__(
+        self, args: argparse.Namespace, root_dir: Path, target_paths: List[Path], output_path: Path,
+        limits: ExtractionLimits, cache: Optional[RenderCache]
+    ):
+        self.args = args
+        self.root_dir = root_dir
+        self.target_paths = target_paths
+        self.output_path = output_path
+        self.temp_path = output_path.with_name(f".{output_path.name}.tmp")
+        self.limits = limits
+        self.memo = RenderMemo(cache)
+        self.rule_files = {str(Path(p).resolve()) for p in args.exclusion_file or []}
+
+        self.scanner: Optional[RepoScanner] = None
+        self.tree_root = DirectoryNode("/")
+        self.entries: Dict[str, ScanEntry] = {}
+        self.scan_telemetry = Telemetry()
+
+    def run(self) -> None:
+        ignored = {str(self.output_path), str(self.temp_path)}
+        try:
+            watcher: Union[InotifyWatcher, PollingWatcher] = InotifyWatcher(ignored)
+        except OSError as e:
+            print(f"[warning] inotify unavailable ({e}); polling for changes instead.", file=sys.stderr)
+            watcher = PollingWatcher(ignored)
+
+        try:
+            self.rescan()
+            watcher.watch(self.scanner.visited_dirs, self.entries)
+            self.render().print_summary()
+            self.memo.close()
+            print(f"\n[watch] Watching {len(self.scanner.visited_dirs)} directories. Press Ctrl+C to stop.", file=sys.stderr)
+            failed = False
+            while True:
+                modified, structural = watcher.wait()
+                started = time.perf_counter()
+                structural = failed or structural or bool(modified & self.rule_files) or any(
+                    os.path.basename(p) in SCOPED_IGNORE_FILES for p in modified
+                )
+                try:
+                    if structural:
+                        for file_path in modified:
+                            self.memo.discard(self._rel(file_path))
+                        self.rescan()
+                        watcher.watch(self.scanner.visited_dirs, self.entries)
+                        touched = "rescanned"
+                    else:
+                        touched = f"{self.refresh(modified)} file(s) updated"
+                    telemetry = self.render()
+                except OSError as e:
+                    # Bursts such as a checkout move paths under a refresh; the
+                    # events they raise retry it with a full rescan.
+                    failed = True
+                    print(f"[watch] Refresh failed ({e}); retrying on the next change.", file=sys.stderr)
+                    continue
+                failed = False
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                status = " (size limit reached)" if telemetry.limit_reached else ""
+                print(f"[watch] {touched}, {telemetry.bytes_written} bytes written in {elapsed_ms:.0f} ms{status}.", file=sys.stderr)
+        except KeyboardInterrupt:
+            print("\n[watch] Stopped.", file=sys.stderr)
+        finally:
+            watcher.close()
+            self.memo.close()
+
+    def rescan(self) -> None:
+        """Rebuilds rules and walks the targets, keeping memo entries that still apply."""
+        scope_positions: Dict[str, int] = {}
+        matcher = VisibilityMatcher(build_rules(self.args, scope_positions), scope_positions)
+        self.scan_telemetry = Telemetry()
+        self.scanner = RepoScanner(
+            self.root_dir, matcher, self.scan_telemetry, self.args.file_types, self.limits.max_file_bytes, self.output_path
+        )
+        self.scanner.excerpt_oversized = self.limits.excerpt is not None
+        self.tree_root = DirectoryNode("/")
+        self.entries = {str(p): (p, r) for p, r in self.scanner.iter_scan(self.target_paths, self.tree_root)}
+        self.memo.retain({self._rel(p) for p in self.entries})
+
+    def refresh(self, modified: Set[str]) -> int:
+        """Re-classifies changed files in place, e.g. for the per-file size limit."""
+        # Visibility is path-based, so only the included/redacted split can move;
+        # render() recounts it from the entries rather than from scan counters.
+        self.scanner.telemetry = Telemetry()
+        count = 0
+        for file_path in modified:
+            if file_path not in self.entries:
+                continue
+            self.memo.discard(self._rel(file_path))
+            found = list(self.scanner.iter_scan([Path(file_path)], self.tree_root))
+            if found:
+                self.entries[file_path] = found[0]
+            else:
+                del self.entries[file_path]
+            count += 1
+        self.scanner.telemetry = self.scan_telemetry
+        return count
+
+    def _rel(self, file_path: str) -> str:
+        """Mirrors XMLRepoRenderer.rel_path, which keys the memo."""
+        try:
+            return Path(file_path).relative_to(self.root_dir).as_posix()
+        except ValueError:
+            return Path(file_path).as_posix()
+
+    def render(self) -> Telemetry:
+        """Renders the current entries to a temporary file and swaps it into place."""
+        telemetry = replace(self.scan_telemetry)
+        included = sorted(p for p, r in self.entries.values() if r is None)
+        redacted = sorted(((p, r) for p, r in self.entries.values() if r is not None), key=lambda x: x[0])
+        telemetry.included_files, telemetry.redacted_files = len(included), len(redacted)
+
+        renderer = XMLRepoRenderer(self.root_dir, telemetry, self.limits.max_bytes, self.args.jobs, self.memo, self.args.dedup)
+        renderer.excerpt = self.limits.excerpt
+        try:
+            with open_output_sink(self.temp_path, self.limits.compression, self.args.compress_level, self.args.compress_threads) as sink:
+                renderer.render(self.tree_root, included, redacted, self.target_paths, sink)
+            os.replace(self.temp_path, self.output_path)
+        except BaseException:
+            self.temp_path.unlink(missing_ok=True)
+            raise
+        if self.limits.compression:
+            telemetry.compressed_bytes = self.output_path.stat().st_size
+        return telemetry
+
+
+# ==============================================================================
+# SERVE MODE
+# ==============================================================================
+
+class RequestArgumentParser(argparse.ArgumentParser):
+    """Argument parser that reports errors as exceptions instead of exiting."""
+
+    def error(self, message: str) -> None:  # type: ignore[override]
+        raise ValueError(message)
+
+    def exit(self, status: int = 0, message: Optional[str] = None) -> None:  # type: ignore[override]
+        raise ValueError(message or self.format_help())
+
+    def print_help(self, file: Optional[object] = None) -> None:
+        # --help is answered through exit() so nothing is printed server-side.
+        pass
+
+
+class WarmCaches:
+    """State kept alive across extractions by the server.
+
+    Compiled matchers are keyed by every rule-affecting option plus the identity
+    of the ignore files they read; directory listings and rendered chunks are
+    validated against the filesystem on every use.
+    """
+
+    MATCHER_SLOTS = 32
+    RULE_OPTIONS = (
+        "include", "prune", "ghost", "redact", "exclusion_file",
+        "include_deps", "include_build", "include_lockfiles", "allow_secrets", "from_git_index", "lock_secrets",
+    )
+
+    def __init__(self, root_dir: Path, cache_bytes: int):
+        self.root_dir = root_dir
+        self.matchers: Dict[Tuple, VisibilityMatcher] = {}
+        self.listings = DirectoryListingCache()
+        self.memo = RenderMemo(max_bytes=cache_bytes, racy_window_ns=RenderCache.RACY_WINDOW_NS)
+
+    def matcher_for(self, args: argparse.Namespace) -> VisibilityMatcher:
+        rule_files = [".gitignore", ".llmignore", *(args.exclusion_file or [])]
+        key = (
+            tuple(tuple(v) if isinstance(v, list) else v for v in (getattr(args, o) for o in self.RULE_OPTIONS)),
+            tuple(RenderCache.identity(self.root_dir / f) for f in rule_files),
+        )
+        # A revision's rules come from git and may change under the same name.
+        matcher = self.matchers.pop(key, None) if not args.rev else None
+        if matcher is None:
+            scope_positions: Dict[str, int] = {}
+            matcher = VisibilityMatcher(build_rules(args, scope_positions), scope_positions)
+            if len(self.matchers) >= self.MATCHER_SLOTS:
+                del self.matchers[next(iter(self.matchers))]
+        else:
+            matcher.reset_scopes()
+        self.matchers[key] = matcher
+        return matcher
+
+
+class ExtractionService:
+    """Answers extraction requests for one root directory using warm caches.
+
+    Requests carry the same arguments as the command line, minus the options
+    that only make sense for a standalone run. Requests are handled one at a
+    time so the caches need no further locking. Requests can only read files
+    below root_dir, and credential files stay redacted unless the server was
+    started with allow_secrets.
+    """
+
+    UNSUPPORTED = {
+        "output": "--output", "watch": "--watch", "cache": "--cache", "cache_dir": "--cache-dir", "stats_json": "--stats-json",
+        "manifest_out": "--manifest-out", "explain_rules": "--explain-rules", "explain": "--explain",
+    }
+
+    def __init__(self, root_dir: Path, cache_bytes: int, allow_secrets: bool = False):
+        self.root_dir = root_dir
+        self.allow_secrets = allow_secrets
+        self.parser = build_parser(RequestArgumentParser)
+        self.warm = WarmCaches(root_dir, cache_bytes)
+        self.lock = threading.Lock()
+
+    def extract(self, argv: List[str]) -> Tuple[bytes, Telemetry]:
+        """Runs one extraction and returns the payload with its telemetry.
+
+        Raises:
+            ValueError: If the arguments are invalid or not supported by the server.
+            GitCommandError: If a --since or --rev ref is invalid, or git cannot be queried.
+        """
+        args = parse_extraction_args(self.parser, argv)
+        for option, flag in self.UNSUPPORTED.items():
+            if getattr(args, option):
+                raise ValueError(f"{flag} is not supported in server requests.")
+        if args.scan_workers > 1:
+            raise ValueError("--scan-workers is not supported in server requests.")
+        if args.allow_secrets and not self.allow_secrets:
+            raise ValueError("--allow-secrets requires the server to be started with --allow-secrets.")
+        args.lock_secrets = not self.allow_secrets
+        root = self.root_dir.resolve()
+        for p in [*args.paths, *(args.exclusion_file or []), *([args.since_manifest] if args.since_manifest else [])]:
+            resolved = (self.root_dir / p).resolve()
+            if resolved != root and root not in resolved.parents:
+                raise ValueError(f"{p} is outside the served directory.")
+        # Refs pass the same check as on the command line before the lock is taken.
+        for ref in (args.since, args.rev):
+            if ref:
+                resolve_git_ref(self.root_dir, ref, "object")
+        limits = ExtractionLimits.from_args(args)
+
+        out = io.BytesIO()
+        with self.lock:
+            telemetry = run_extraction(args, self.root_dir, limits, out_stream=out, warm=self.warm)
+        return out.getvalue(), telemetry
+
+
+class ExtractionRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Handles POST requests whose body is a JSON array of CLI arguments."""
+
+    server_version = "repo2txt"
+
+    # Host names a loopback HTTP request may carry; anything else may be a DNS rebinding page.
+    ALLOWED_HOSTS = {"127.0.0.1", "localhost"}
+
+    def do_POST(self) -> None:
+        if isinstance(self.client_address, tuple):
+            host = self.headers.get("Host", "")
+            if host.partition(":")[0].lower() not in self.ALLOWED_HOSTS:
+                self._reply(403, b"Host header must be 127.0.0.1 or localhost.\n", "text/plain; charset=utf-8")
+                return
+        try:
+            argv = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"null")
+            if not isinstance(argv, list) or not all(isinstance(a, str) for a in argv):
+                raise ValueError("Request body must be a JSON array of argument strings.")
+            started = time.perf_counter()
+            body, telemetry = self.server.service.extract(argv)
+        except (ValueError, GitCommandError) as e:
+            self._reply(400, f"{e}\n".encode("utf-8"), "text/plain; charset=utf-8")
+            return
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._reply(200, body, "application/xml; charset=utf-8", {
+            "X-Repo2txt-Telemetry": json.dumps(asdict(telemetry), separators=(",", ":")),
+            "X-Repo2txt-Elapsed-Ms": f"{elapsed_ms:.1f}",
+        })
+
+    def _reply(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # Unix socket peers have no address tuple.
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "local"
+
+    def log_message(self, format: str, *args: object) -> None:
+        print(f"[serve] {self.address_string()} {format % args}", file=sys.stderr)
+
+
+class ExtractionHTTPServer(http.server.HTTPServer):
+    def __init__(self, address: Tuple[str, int], service: ExtractionService):
+        super().__init__(address, ExtractionRequestHandler)
+        self.service = service
+
+
+class ExtractionUnixServer(socketserver.UnixStreamServer):
+    def __init__(self, socket_path: str, service: ExtractionService):
+        super().__init__(socket_path, ExtractionRequestHandler)
+        self.service = service
+
+
+def serve_main(argv: List[str]) -> None:
+    """Entrypoint for `repo2txt serve`: answers extraction requests over HTTP."""
+    parser = argparse.ArgumentParser(
+        prog="repo2txt serve",
+        description="Serves extractions of the current directory over localhost HTTP or a Unix socket. "
+                    "POST a JSON array of repo2txt arguments, e.g. [\"src\", \"-t\", \"py\"].",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind for HTTP (default: loopback only).")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port to listen on.")
+    parser.add_argument("--socket", type=str, help="Listen on this Unix socket path instead of TCP.")
+    parser.add_argument("--cache-size", type=str, default="256MB", help="Upper bound for rendered content kept in memory.")
+    parser.add_argument("--allow-secrets", action="store_true", help="Let requests pass --allow-secrets and explicitly include credential files.")
+    args = parser.parse_args(argv)
+
+    try:
+        cache_bytes = parse_size_to_bytes(args.cache_size, 256 * 1024 * 1024)
+    except ValueError as e:
+        print(f"Configuration Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    service = ExtractionService(Path.cwd(), cache_bytes, args.allow_secrets)
+    if args.socket:
+        if os.path.lexists(args.socket):
+            if not stat.S_ISSOCK(os.lstat(args.socket).st_mode):
+                print(f"Configuration Error: {args.socket} exists and is not a socket.", file=sys.stderr)
+                sys.exit(1)
+            os.unlink(args.socket)
+        server: socketserver.BaseServer = ExtractionUnixServer(args.socket, service)
+        where = args.socket
+    else:
+        server = ExtractionHTTPServer((args.host, args.port), service)
+        where = f"http://{args.host}:{server.server_address[1]}/"
+
+    print(f"[serve] Serving {service.root_dir} on {where}. Press Ctrl+C to stop.", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[serve] Stopped.", file=sys.stderr)
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+# ==============================================================================
+# RULE DIAGNOSTICS
+# ==============================================================================
+
+@dataclass
+class RuleTrace:
+    """Counters gathered for one rule by --explain-rules."""
+    rule: Rule
+    matches: int = 0
+    wins: int = 0
+    seconds: float = 0.0
+    example: Optional[str] = None
+
+
+class RuleTracer:
+    """Evaluates every applicable rule against every decided path for --explain-rules.
+
+    The index normally skips most rules; here each rule's regex is run and timed
+    on its own, so the report shows how often a rule matches, how often it has
+    the last word, what it costs and one path it matched. Rules that never match
+    are dead, and rules that match but never win are shadowed by later ones.
+    """
+
+    def __init__(self, rules: List[Rule]):
+        self.paths = 0
+        # Keyed by object identity: nested scopes are parsed once, and equal
+        # patterns from different sources must be reported separately.
+        self.traces: Dict[int, RuleTrace] = {}
+        for rule in rules:
+            self._trace(rule)
+
+    def _trace(self, rule: Rule) -> RuleTrace:
+        trace = self.traces.get(id(rule))
+        if trace is None:
+            trace = self.traces[id(rule)] = RuleTrace(rule)
+        return trace
+
+    def observe(self, matcher: VisibilityMatcher, path: str, winner: Optional[Rule]) -> None:
+        self.paths += 1
+        for _, rule, sub_path in matcher.candidate_rules(path):
+            trace = self._trace(rule)
+            started = time.perf_counter()
+            hit = rule.regex.match(sub_path)
+            trace.seconds += time.perf_counter() - started
+            if hit:
+                trace.matches += 1
+                if trace.example is None:
+                    trace.example = path
+        if winner is not None:
+            self._trace(winner).wins += 1
+
+    def print_report(self) -> None:
+        """Prints every rule, most expensive first, to stderr."""
+        traces = sorted(self.traces.values(), key=lambda t: -t.seconds)
+        dead = sum(1 for t in traces if not t.matches)
+        shadowed = sum(1 for t in traces if t.matches and not t.wins)
+        print(file=sys.stderr)
+        print("="*55, file=sys.stderr)
+        print(f" RULE REPORT ({self.paths} paths, {len(traces)} rules, {dead} dead, {shadowed} shadowed)", file=sys.stderr)
+        print("="*55, file=sys.stderr)
+        print(f" {'Regex ms':>9} {'Matches':>8} {'Wins':>7}  {'Status':<8} {'Visibility':<10} {'Source':<18} Pattern -> example", file=sys.stderr)
+        for t in traces:
+            status = "dead" if not t.matches else "shadowed" if not t.wins else ""
+            example = f" -> {t.example}" if t.example else ""
+            print(
+                f" {t.seconds * 1000:>9.2f} {t.matches:>8} {t.wins:>7}  {status:<8} {t.rule.visibility.name:<10} {t.rule.reason or '':<18} {t.rule.raw}{example}",
+                file=sys.stderr,
+            )
+        print("="*55, file=sys.stderr)
+
+
+def explain_path(matcher: VisibilityMatcher, root_dir: Path, rel_path: str) -> List[str]:
+    """Describes the last-match-wins decision for a path and each of its parent directories.
+
+    Nested ignore files along the path are loaded first, as a scan would have
+    done on the way down. Every matching rule is listed in precedence order and
+    the deciding one is marked.
+    """
+    parts = [p for p in rel_path.replace("\\", "/").split("/") if p not in ("", ".")]
+    lines = ["/".join(parts)]
+    outcome: Optional[str] = None
+    ghosted: Optional[str] = None
+    for depth in range(1, len(parts) + 1):
+        prefix = "/".join(parts[:depth])
+        is_dir = depth < len(parts)
+        vis, reason = matcher.get_visibility(prefix)
+        lines.append(f"  {prefix + ('/' if is_dir else '')}  {vis.name}{f' ({reason})' if reason else ''}")
+        matches = matcher.matching_rules(prefix)
+        for i, (key, rule) in enumerate(matches):
+            number = key[0] if key[1] == 0 else key[2]
+            decides = "  <- decides" if i == len(matches) - 1 else ""
+            lines.append(f"      #{number:<4} {rule.visibility.name:<9} {rule.raw:<30} {rule.reason or ''}{decides}")
+        if not matches:
+            lines.append("      no rule matched")
+
+        if not is_dir or outcome is not None:
+            continue
+        if vis in (Visibility.PRUNED, Visibility.GHOSTED) and matcher.can_skip_dir(prefix, vis):
+            outcome = f"not reached: {prefix}/ is {vis.name} and no later rule reaches beneath it"
+        elif vis == Visibility.GHOSTED and ghosted is None:
+            ghosted = prefix
+        for name in SCOPED_IGNORE_FILES:
+            ignore_file = root_dir / prefix / name
+            if ignore_file.is_file():
+                matcher.load_scope(prefix, name, str(ignore_file))
+
+    if outcome is None:
+        vis, reason = matcher.get_visibility("/".join(parts))
+        if ghosted is not None and vis == Visibility.GHOSTED:
+            outcome = f"not listed: {ghosted}/ is GHOSTED and stands in for its contents"
+        else:
+            outcome = f"{vis.name}{f' ({reason})' if reason else ''}"
+    lines.append(f"  => {outcome}")
+    return lines
+
+
 # ==============================================================================
 # CLI ASSEMBLY & EXECUTION
 # ==============================================================================
 
-def build_rules(args: argparse.Namespace) -> List[Rule]:
-    """Compiles operational rules adhering to strict precedence hierarchy."""
+def build_rules(args: argparse.Namespace, scope_positions: Optional[Dict[str, int]] = None) -> List[Rule]:
+    """Compiles operational rules adhering to strict precedence hierarchy.
+
+    When scope_positions is given, it is filled with the rank at which nested
+    ignore files of each enabled kind slot into the hierarchy.
+    """
     rules: List[Rule] = []
+    if scope_positions is None:
+        scope_positions = {}
 
     def append(patterns: List[str], vis: Visibility, reason: Optional[str] = None) -> None:
         for p in patterns:
@@ -592,29 +3369,24 @@ def build_rules(args: argparse.Namespace) -> List[Rule]:
     if not args.include_lockfiles: append(DEFAULT_GHOST_LOCKFILES, Visibility.GHOSTED, "LOCKFILE")
     if not args.allow_secrets: append(DEFAULT_REDACT_SECRETS, Visibility.REDACTED, "SECURITY_RISK")
 
-    # 2. Local Project Configuration (.gitignore)
-    p_git = Path(".gitignore")
-    if p_git.exists():
-        try:
-            for line in p_git.read_text("utf-8").splitlines():
-                if line.strip() and not line.startswith("#"):
-                    rules.append(VisibilityMatcher.compile_pattern(line.strip(), Visibility.GHOSTED, ".gitignore"))
-        except Exception:
-            pass
+    # 2. Local Project Configuration (.gitignore), with nested files ranking just
+    # after the root one. Index and revision enumeration only list tracked
+    # files, which git has already filtered.
+    if not args.from_git_index and not args.rev:
+        rules.extend(VisibilityMatcher.load_pattern_file(Path(".gitignore"), Visibility.GHOSTED, ".gitignore"))
+        scope_positions[".gitignore"] = len(rules)
 
     # 3. Explicit LLM Exclusion Configurations
     ex_files = [Path(".llmignore")]
     if args.exclusion_file:
         ex_files.extend(Path(p) for p in args.exclusion_file)
 
-    for p_ex in ex_files:
-        if p_ex.exists():
-            try:
-                for line in p_ex.read_text("utf-8").splitlines():
-                    if line.strip() and not line.startswith("#"):
-                        rules.append(VisibilityMatcher.compile_pattern(line.strip(), Visibility.PRUNED, p_ex.name))
-            except Exception:
-                pass
+    # A revision is filtered by the .llmignore it contains, not the checked-out one.
+    rev_text = (read_revision_file(Path("."), args.rev_oid, ex_files[0].name) or "") if args.rev else None
+    rules.extend(VisibilityMatcher.load_pattern_file(ex_files[0], Visibility.PRUNED, ex_files[0].name, rev_text))
+    scope_positions[".llmignore"] = len(rules)
+    for p_ex in ex_files[1:]:
+        rules.extend(VisibilityMatcher.load_pattern_file(p_ex, Visibility.PRUNED, p_ex.name))
 
     # 4. Command Line Overrides
     if args.prune: append(args.prune, Visibility.PRUNED, "EXPLICIT_PRUNE")
@@ -624,20 +3396,51 @@ def build_rules(args: argparse.Namespace) -> List[Rule]:
     # 5. Absolute Overrides
     if args.include: append(args.include, Visibility.INCLUDED, "EXPLICIT_INCLUDE")
 
+    # 6. Server requests may not re-include credential files.
+    if args.lock_secrets: append(DEFAULT_REDACT_SECRETS, Visibility.REDACTED, "SECURITY_RISK")
+
     return rules
 
 
-def main() -> None:
-    """Primary execution entrypoint."""
-    parser = argparse.ArgumentParser(description="Extracts repository structures into LLM-optimized XML.")
-    parser.add_argument("paths", nargs="+", help="Target paths to include in the scan.")
-    parser.add_argument("-o", "--output", type=str, help="Destination file path (defaults to standard output).")
+def build_parser(parser_class: Type[argparse.ArgumentParser] = argparse.ArgumentParser) -> argparse.ArgumentParser:
+    """Declares the extraction options shared by the CLI and server requests."""
+    parser = parser_class(description="Extracts repository structures into LLM-optimized XML. Run 'repo2txt serve --help' for server mode.")
+    parser.add_argument("paths", nargs="+", help="Target paths to include in the scan; tar and zip archives are read in place.")
+    # Set by the server so that explicit includes cannot expose credential files,
+    # and to the object ID --rev resolves to before any other git command runs.
+    parser.set_defaults(lock_secrets=False, rev_oid=None)
+    parser.add_argument("-o", "--output", type=str, help="Destination file path (defaults to standard output). A .gz, .xz or .zst suffix compresses it.")
+    parser.add_argument("--compress-level", type=int, help="Compression level for compressed outputs (gzip/xz 0-9, zstd 1-22).")
+    parser.add_argument("--compress-threads", type=int, default=0, help="Worker threads for zstd compression (-1 for one per CPU).")
 
-    parser.add_argument("--dry-run", action="store_true", help="Calculate metrics without generating physical output.")
+    parser.add_argument("--dry-run", action="store_true", help="Calculate metrics and a stat-based size estimate without generating physical output.")
+    parser.add_argument("--estimate-top", type=int, default=10, help="Number of heaviest directories listed by --dry-run.")
     parser.add_argument("--force", action="store_true", help="Bypass interactive terminal confirmation prompts.")
 
-    parser.add_argument("--max-size", type=str, help="Enforce a global output byte limit (e.g., '2MB', '500KB').")
+    parser.add_argument("--max-size", type=str, help="Enforce a global output byte limit (e.g., '2MB', '500KB'), measured before compression.")
+    parser.add_argument("--shard-size", type=str, help="Split the output into numbered parts of at most this size (e.g. '1MB'), each a complete document.")
+    parser.add_argument("--max-tokens", type=int, help="Pack the highest-priority files into an estimated token budget.")
+    parser.add_argument("--token-weights", type=str, nargs="*", help="Budget priorities as key=value: depth, recency or an extension (e.g. '.md=2').")
     parser.add_argument("--max-file-size", type=str, default="2MB", help="Enforce a per-file byte limit. Exceeding files are REDACTED.")
+    parser.add_argument("--excerpt", type=str, metavar="SIZE", help="Render files over --max-file-size as their first and last SIZE bytes (whole lines) instead of redacting them.")
+    parser.add_argument("--excerpt-lines", type=int, metavar="N", help="Render files over --max-file-size as their first and last N lines instead of redacting them.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker threads used to read and render files concurrently.")
+    parser.add_argument("--cache", action="store_true", help="Reuse rendered files from a persistent cache keyed by inode, size and mtime.")
+    parser.add_argument("--cache-dir", type=str, help="Cache database location (defaults to .git/repo2txt-cache or $XDG_CACHE_HOME/repo2txt).")
+    parser.add_argument("--cache-size", type=str, default="256MB", help="Upper bound for cached content before LRU eviction.")
+    parser.add_argument("--from-git-index", action="store_true", help="Enumerate tracked files from the git index instead of walking the filesystem.")
+    parser.add_argument("--rev", type=str, metavar="REV", help="Render files of a git commit or tree instead of the working tree, without checking it out.")
+    parser.add_argument("--watch", action="store_true", help="Keep the output file current, re-rendering changed files until interrupted.")
+    parser.add_argument("--scan-workers", type=int, default=1, help="Number of processes that scan top-level subtrees in parallel.")
+    parser.add_argument("--since", type=str, metavar="REF", help="Render only files added or modified since a git ref, and list deleted ones.")
+    parser.add_argument("--since-manifest", type=str, metavar="FILE", help="Render only files that changed since the snapshot recorded in a manifest, and list deleted ones.")
+    parser.add_argument("--manifest-out", type=str, metavar="FILE", help="Record the size, mtime and content hash of every snapshot file for a later --since-manifest.")
+    parser.add_argument("--stream", action="store_true", help="Render files while scanning and emit the directory tree last, keeping memory flat.")
+    parser.add_argument("--stats-json", type=str, help="Write per-phase timings, rule counters, histograms and the slowest files as JSON.")
+    parser.add_argument("--stats-top", type=int, default=10, help="Number of slowest files listed in --stats-json.")
+    parser.add_argument("--explain-rules", action="store_true", help="Report per-rule matches, wins, regex time and an example path, flagging dead and shadowed rules.")
+    parser.add_argument("--explain", type=str, action="append", metavar="PATH", help="Print the rule decision chain for a path and exit without extracting (repeatable).")
+    parser.add_argument("--dedup", action="store_true", help="Emit repeated file contents once and reference the first copy from later ones.")
     parser.add_argument("-t", "--file-types", type=str, nargs="*", help="Restrict inclusion to specific file extensions.")
     parser.add_argument("-e", "--exclusion-file", type=str, nargs="*", help="Provide custom exclusion rulesets (appended to .llmignore).")
 
@@ -650,8 +3453,209 @@ def main() -> None:
     parser.add_argument("--include-build", action="store_true", help="Include build artifacts (e.g., dist, build).")
     parser.add_argument("--include-lockfiles", action="store_true", help="Include package lockfiles.")
     parser.add_argument("--allow-secrets", action="store_true", help="Disable secret redaction. WARNING: May leak credentials.")
+    return parser
+
+
+def parse_extraction_args(parser: argparse.ArgumentParser, argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parses arguments and rejects incompatible option combinations."""
+    args = parser.parse_args(argv)
+    if args.stream and args.max_tokens:
+        parser.error("--max-tokens needs the full file list and cannot be combined with --stream.")
+    if args.scan_workers > 1 and (args.stream or args.from_git_index):
+        parser.error("--scan-workers parallelizes filesystem walks and cannot be combined with --stream or --from-git-index.")
+    if args.excerpt and args.excerpt_lines:
+        parser.error("--excerpt and --excerpt-lines are mutually exclusive.")
+    if args.since and args.since_manifest:
+        parser.error("--since and --since-manifest are mutually exclusive.")
+    if args.stream and (args.since or args.since_manifest or args.manifest_out):
+        parser.error("--since, --since-manifest and --manifest-out need the full file list and cannot be combined with --stream.")
+    if args.since and (args.from_git_index or args.scan_workers > 1 or args.manifest_out):
+        parser.error("--since lists changed files from git and cannot be combined with --from-git-index, --scan-workers or --manifest-out.")
+    if args.explain_rules and args.scan_workers > 1:
+        parser.error("--explain-rules traces rules in this process and cannot be combined with --scan-workers.")
+    if args.shard_size and (not args.output or args.max_size or args.stream):
+        parser.error("--shard-size needs an --output file and cannot be combined with --max-size or --stream.")
+    if any(archive_kind(p) for p in args.paths) and (args.from_git_index or args.since or args.rev or args.watch):
+        parser.error("Archive targets are read in place and cannot be combined with --from-git-index, --since, --rev or --watch.")
+    if args.rev and (args.from_git_index or args.since or args.scan_workers > 1 or args.watch):
+        parser.error("--rev lists files from git and cannot be combined with --from-git-index, --since, --scan-workers or --watch.")
+    if args.watch and (not args.output or args.dry_run):
+        parser.error("--watch needs an --output file and cannot be combined with --dry-run.")
+    if args.watch and (args.stream or args.max_tokens or args.from_git_index or args.scan_workers > 1 or args.stats_json or args.since or args.since_manifest or args.manifest_out or args.shard_size or args.explain_rules):
+        parser.error("--watch cannot be combined with --stream, --max-tokens, --from-git-index, --scan-workers, --stats-json, --shard-size, --explain-rules or delta options.")
+    return args
+
+
+def run_extraction(
+    args: argparse.Namespace, root_dir: Path, limits: ExtractionLimits, cache: Optional[RenderCache] = None,
+    out_stream: Optional[BinaryIO] = None, warm: Optional[WarmCaches] = None, stats: Optional[RunStats] = None
+) -> Telemetry:
+    """Scans and renders one extraction.
+
+    Output goes to out_stream when given, else to the --output file or stdout.
+    With warm caches, the matcher, directory listings and rendered chunks of
+    earlier extractions are reused. When stats is given, phase timings and rule
+    counters are collected into it.
 
-    args = parser.parse_args()
+    Raises:
+        GitCommandError: If --from-git-index, --since or --rev cannot query git.
+        ValueError: If the --since-manifest file cannot be read.
+    """
+    if args.rev:
+        args.rev_oid = resolve_git_ref(root_dir, args.rev, "object")
+    blobs = GitBlobReader(root_dir) if args.rev else None
+    try:
+        return _extract(args, root_dir, limits, cache, out_stream, warm, stats, blobs)
+    finally:
+        if blobs is not None:
+            blobs.close()
+
+
+def _extract(
+    args: argparse.Namespace, root_dir: Path, limits: ExtractionLimits, cache: Optional[RenderCache], out_stream: Optional[BinaryIO],
+    warm: Optional[WarmCaches], stats: Optional[RunStats], blobs: Optional[GitBlobReader]
+) -> Telemetry:
+    target_paths = [(root_dir / p).resolve() for p in args.paths]
+    output_path = (root_dir / args.output).resolve() if args.output else None
+    base = SnapshotManifest.load(root_dir / args.since_manifest) if args.since_manifest else None
+
+    telemetry = Telemetry()
+    if warm is not None:
+        matcher = warm.matcher_for(args)
+        cache = warm.memo
+    else:
+        scope_positions: Dict[str, int] = {}
+        matcher = VisibilityMatcher(build_rules(args, scope_positions), scope_positions)
+
+    matcher.stats = stats
+    matcher.tracer = RuleTracer(matcher.rules) if args.explain_rules else None
+    phase = stats.phase if stats else (lambda name: nullcontext())
+    listings = warm.listings if warm is not None else None
+    scanner = RepoScanner(root_dir, matcher, telemetry, args.file_types, limits.max_file_bytes, output_path, listings)
+    scanner.excerpt_oversized = limits.excerpt is not None
+    scanner.own_files.update(str((root_dir / p).resolve()) for p in (args.since_manifest, args.manifest_out) if p)
+    if limits.shard_bytes:
+        scanner.own_files.update(str(p) for p in existing_shards(output_path, limits.compression))
+    tree_root = DirectoryNode("/")
+    deleted: List[str] = []
+    with phase("scan"):
+        if args.since:
+            entries, deleted = scanner.iter_git_changes(target_paths, tree_root, args.since)
+        elif args.from_git_index:
+            entries = scanner.iter_git_index(target_paths, tree_root)
+        elif blobs is not None:
+            entries = scanner.iter_git_tree(target_paths, tree_root, args.rev_oid, blobs)
+        elif args.scan_workers > 1:
+            entries = scanner.parallel_scan(target_paths, tree_root, args.scan_workers)
+        else:
+            entries = scanner.iter_scan(target_paths, tree_root)
+
+    renderer = XMLRepoRenderer(root_dir, telemetry, limits.max_bytes, args.jobs, cache, args.dedup)
+    renderer.stats = stats
+    renderer.revision = args.rev
+    renderer.excerpt = limits.excerpt
+
+    manifest = None
+    if not args.stream:
+        with phase("scan"):
+            included_files, redacted_files = scanner.collect(entries)
+        if base is not None or args.manifest_out:
+            scanned = [(renderer.rel_path(p), p, None) for p in included_files] + [(renderer.rel_path(p), p, r) for p, r in redacted_files]
+            with phase("delta"):
+                manifest = SnapshotManifest.build(scanned, base, args.jobs)
+            if base is not None:
+                changed = manifest.changes(base)
+                tree_root, included_files, redacted_files = scanner.narrow({p for rel_path, p, _ in scanned if rel_path in changed}, included_files, redacted_files)
+                deleted = manifest.deletions(base, [renderer.rel_path(t) for t in target_paths])
+        if args.since or base is not None:
+            renderer.delta_base = args.since or args.since_manifest
+            renderer.deleted = deleted
+            telemetry.deleted_files = len(deleted)
+        if args.max_tokens:
+            planner = TokenBudgetPlanner(renderer, limits.token_weights, args.jobs)
+            with phase("plan"):
+                included_files, redacted_files = planner.select(tree_root, included_files, redacted_files, target_paths, args.max_tokens)
+        if manifest is not None:
+            for file_path, reason in redacted_files:
+                manifest.mark_redacted(renderer.rel_path(file_path), reason)
+
+    if args.dry_run:
+        if args.stream:
+            with phase("scan"):
+                for _ in entries:
+                    pass
+        else:
+            with phase("estimate"):
+                subtrees = OutputEstimator(renderer).estimate(tree_root, included_files, redacted_files, target_paths)
+            if out_stream is None:
+                OutputEstimator.print_report(subtrees, args.estimate_top)
+        if matcher.tracer is not None:
+            matcher.tracer.print_report()
+        return telemetry
+
+    if limits.shard_bytes:
+        def open_part(index: int) -> BinaryIO:
+            return open_output_sink(shard_path(output_path, index, limits.compression), limits.compression, args.compress_level, args.compress_threads)
+
+        with phase("render"):
+            telemetry.output_parts = renderer.render_shards(tree_root, included_files, redacted_files, target_paths, limits.shard_bytes, open_part)
+        if manifest is not None:
+            for rel_path in renderer.shard_redacted:
+                manifest.mark_redacted(rel_path, "EXCEEDS_SHARD_SIZE")
+        # Parts left over from an earlier run that needed more of them.
+        for stale in existing_shards(output_path, limits.compression, telemetry.output_parts + 1):
+            stale.unlink()
+        if limits.compression:
+            telemetry.compressed_bytes = sum(shard_path(output_path, i, limits.compression).stat().st_size for i in range(1, telemetry.output_parts + 1))
+    else:
+        if out_stream is not None:
+            sink = nullcontext(out_stream)
+        elif output_path:
+            sink = open_output_sink(output_path, limits.compression, args.compress_level, args.compress_threads)
+        else:
+            sink = nullcontext(sys.stdout.buffer)
+        with sink as stream:
+            if args.stream:
+                with phase("stream"):
+                    renderer.render_stream(tree_root, entries, target_paths, stream)
+            else:
+                with phase("render"):
+                    renderer.render(tree_root, included_files, redacted_files, target_paths, stream)
+        if limits.compression and out_stream is None:
+            telemetry.compressed_bytes = output_path.stat().st_size
+
+    if args.manifest_out:
+        if telemetry.limit_reached:
+            print("[warning] Output was truncated by --max-size; manifest not written so the next delta starts from the previous one.", file=sys.stderr)
+        else:
+            manifest.save(root_dir / args.manifest_out)
+    if matcher.tracer is not None:
+        matcher.tracer.print_report()
+    return telemetry
+
+
+def main() -> None:
+    """Primary execution entrypoint."""
+    if sys.argv[1:2] == ["serve"]:
+        serve_main(sys.argv[2:])
+        return
+
+    args = parse_extraction_args(build_parser())
+    root_dir = Path.cwd()
+
+    if args.explain:
+        try:
+            if args.rev:
+                args.rev_oid = resolve_git_ref(root_dir, args.rev, "object")
+        except GitCommandError as e:
+            print(f"Git Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        scope_positions: Dict[str, int] = {}
+        matcher = VisibilityMatcher(build_rules(args, scope_positions), scope_positions)
+        for i, path in enumerate(args.explain):
+            rel_path = Path(os.path.relpath(os.path.abspath(path), root_dir)).as_posix()
+            print(("\n" if i else "") + "\n".join(explain_path(matcher, root_dir, rel_path)))
+        return
 
     # Guard against accidental stdout flooding in interactive sessions.
     if not args.output and sys.stdout.isatty() and not args.force and not args.dry_run:
@@ -664,32 +3668,42 @@ def main() -> None:
             sys.exit(0)
 
     try:
-        max_bytes = parse_size_to_bytes(args.max_size, 0) if args.max_size else None
-        max_file_bytes = parse_size_to_bytes(args.max_file_size, 2 * 1024 * 1024)
+        limits = ExtractionLimits.from_args(args)
     except ValueError as e:
         print(f"Configuration Error: {e}", file=sys.stderr)
         sys.exit(1)
 
-    root_dir = Path.cwd()
-    target_paths = [Path(p).resolve() for p in args.paths]
-    output_path = Path(args.output).resolve() if args.output else None
-
-    telemetry = Telemetry()
-    rules = build_rules(args)
-    matcher = VisibilityMatcher(rules)
+    cache = None
+    if args.cache and not args.dry_run:
+        cache_path = Path(args.cache_dir) / f"v{RenderCache.SCHEMA_VERSION}.sqlite3" if args.cache_dir else RenderCache.default_location(root_dir)
+        cache = RenderCache(cache_path, limits.cache_bytes)
 
-    scanner = RepoScanner(root_dir, matcher, telemetry, args.file_types, max_file_bytes, output_path)
-    tree_root, included_files, redacted_files = scanner.scan(target_paths)
+    if args.watch:
+        target_paths = [Path(p).resolve() for p in args.paths]
+        WatchSession(args, root_dir, target_paths, Path(args.output).resolve(), limits, cache).run()
+        return
 
-    if not args.dry_run:
-        renderer = XMLRepoRenderer(root_dir, telemetry, max_bytes)
-        if args.output:
-            with open(args.output, "w", encoding="utf-8") as out_stream:
-                renderer.render(tree_root, included_files, redacted_files, target_paths, out_stream)
-        else:
-            renderer.render(tree_root, included_files, redacted_files, target_paths, sys.stdout)
+    stats = RunStats(args.stats_top) if args.stats_json else None
+    started, cpu_started = time.perf_counter(), time.process_time()
+    try:
+        telemetry = run_extraction(args, root_dir, limits, cache, stats=stats)
+    except GitCommandError as e:
+        print(f"Git Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as e:
+        print(f"Configuration Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if cache:
+            cache.close()
 
     telemetry.print_summary()
+    if stats:
+        report = stats.to_dict(telemetry, time.perf_counter() - started, time.process_time() - cpu_started)
+        with open(args.stats_json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f" Stats written to {args.stats_json}", file=sys.stderr)
 
 if __name__ == "__main__":
     main()
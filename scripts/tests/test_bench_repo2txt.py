@@ -0,0 +1,63 @@
+import io
+import json
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+
+from scripts import bench_repo2txt
+from scripts.bench_repo2txt import Scenario, generate_repository, main
+
+
+class TestBenchHarness(unittest.TestCase):
+    """
+    Runs the benchmark harness end to end on a tiny synthetic repository.
+    """
+
+    def setUp(self) -> None:
+        self.workdir = Path(tempfile.mkdtemp())
+        patcher = unittest.mock.patch.dict(bench_repo2txt.SCALES, {"tiny": 60})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.workdir)
+
+    def run_bench(self, *extra: str) -> int:
+        argv = ["--scale", "tiny", "--shape", "mixed", "--ignore-patterns", "20", "--repeat", "1", "--workdir", str(self.workdir), *extra]
+        with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+            return main(argv)
+
+    def test_generated_repository_is_deterministic(self) -> None:
+        """Verifies that generation honours the scale and is reproducible from the seed."""
+        scenario = Scenario("tiny", "deep", 10, 0.5, 64)
+        first = generate_repository(self.workdir / "a", scenario)
+        second = generate_repository(self.workdir / "b", scenario)
+        self.assertEqual(len(first), 60)
+        self.assertEqual(first, second)
+        self.assertEqual(len((self.workdir / "a" / ".gitignore").read_text().splitlines()), 10)
+
+    def test_save_and_compare(self) -> None:
+        """Verifies that a saved baseline compares clean, and that mismatched settings or an impossibly fast baseline are flagged."""
+        baseline = self.workdir / "baseline.json"
+        self.assertEqual(self.run_bench("--save", str(baseline)), 0)
+        report = json.loads(baseline.read_text())
+        self.assertEqual(set(report["results"]), {"tiny-mixed/match", "tiny-mixed/scan", "tiny-mixed/render"})
+
+        self.assertEqual(self.run_bench("--compare", str(baseline), "--threshold", "1000"), 0)
+        self.assertEqual(self.run_bench("--compare", str(baseline), "--threshold", "1000", "--ignore-patterns", "30"), 1)
+
+        for result in report["results"].values():
+            result["min_s"] = 1e-9
+        baseline.write_text(json.dumps(report))
+        self.assertEqual(self.run_bench("--compare", str(baseline)), 1)
+
+        report["version"] = 0
+        baseline.write_text(json.dumps(report))
+        self.assertEqual(self.run_bench("--compare", str(baseline)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,1221 @@
+import argparse
+import gzip
+import io
+import json
+import lzma
+import mmap
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree as ET
+import unittest
+import unittest.mock
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+from scripts.repo2txt import (
+    TokenBudgetPlanner,
+    TokenEstimator,
+    TokenWeights,
+    DirectoryListingCache,
+    DirectoryNode,
+    ExtractionHTTPServer,
+    ExcerptPolicy,
+    ExtractionLimits,
+    ExtractionService,
+    FileReader,
+    GitCommandError,
+    OutputEstimator,
+    RenderCache,
+    RepoScanner,
+    RuleTracer,
+    RunStats,
+    SnapshotManifest,
+    Telemetry,
+    Visibility,
+    VisibilityMatcher,
+    InotifyWatcher,
+    PollingWatcher,
+    WatchSession,
+    XMLRepoRenderer,
+    build_parser,
+    build_rules,
+    explain_path,
+    open_output_sink,
+    parse_extraction_args,
+    run_extraction,
+    output_compression,
+    shard_path,
+)
+
+
+def make_args(**overrides: Any) -> argparse.Namespace:
+    """Builds a namespace mirroring the CLI defaults."""
+    defaults: Dict[str, Any] = dict(
+        include=None, prune=None, ghost=None, redact=None, exclusion_file=None,
+        include_deps=False, include_build=False, include_lockfiles=False, allow_secrets=False,
+        from_git_index=False, rev=None, lock_secrets=False, file_types=None, jobs=1, dedup=False, compress_level=None, compress_threads=0,
+    )
+    defaults.update(overrides)
+    return argparse.Namespace(**defaults)
+
+
+class RepoTestCase(unittest.TestCase):
+    """Base fixture that builds a throwaway repository and runs extractions in it."""
+
+    LIMIT_WARNING = b"\n  <warning>Extraction halted: Global size limit reached. Context is incomplete.</warning>\n  </files>\n</repository>\n"
+
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name).resolve()
+        self._cwd = os.getcwd()
+        os.chdir(self.root)
+
+    def tearDown(self) -> None:
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def write(self, rel_path: str, content: str = "") -> Path:
+        path = self.root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content, encoding="utf-8")
+        return path
+
+    def extract(self, args: argparse.Namespace = None, max_bytes: int = None, jobs: int = 1, targets: List[Path] = None, cache: RenderCache = None, dedup: bool = False) -> str:
+        telemetry = Telemetry()
+        matcher = VisibilityMatcher(build_rules(args or make_args()))
+        scanner = RepoScanner(self.root, matcher, telemetry, None, 2 * 1024 * 1024, None)
+        targets = targets or [self.root]
+        tree, included, redacted = scanner.scan(targets)
+        out = io.BytesIO()
+        XMLRepoRenderer(self.root, telemetry, max_bytes, jobs, cache, dedup).render(tree, included, redacted, targets, out)
+        self.telemetry = telemetry
+        self.assertEqual(len(out.getvalue()), telemetry.bytes_written + (len(self.LIMIT_WARNING) if telemetry.limit_reached else 0))
+        return out.getvalue().decode("utf-8")
+
+    @staticmethod
+    def strip_date(xml: str) -> str:
+        return "\n".join(line for line in xml.splitlines() if "<date>" not in line)
+
+
+class TestRuleIndex(unittest.TestCase):
+    """Verifies the compiled matcher agrees with evaluating every rule regex."""
+
+    def test_index_matches_regex_scan(self) -> None:
+        """Verifies last-match-wins parity across literal, affix and wildcard rules."""
+        args = make_args(
+            include=["*.md", "/a/b/keep.txt", "x?z"], prune=["a/b", "/c"],
+            ghost=["[ab]*.py", "**/deep/**"], redact=["foo*"],
+        )
+        rules = build_rules(args)
+        matcher = VisibilityMatcher(rules)
+        names = ["a", "b", "c", "xyz", "keep.txt", "foo.py", "bar.py", "node_modules", ".git", "deep",
+                 "README.md", ".env.local", "x.pyc", "lib.egg-info", "build", "id_rsa", ".DS_Store"]
+        rng = random.Random(7)
+        for _ in range(2000):
+            path = "/".join(rng.choice(names) for _ in range(rng.randint(1, 5)))
+            expected = -1
+            for idx, rule in enumerate(rules):
+                if rule.regex.match(path):
+                    expected = idx
+            self.assertEqual(matcher.index.last_match(path), expected, path)
+
+    def test_get_visibility_last_match_wins(self) -> None:
+        """Verifies later rules override earlier ones through the index."""
+        matcher = VisibilityMatcher(build_rules(make_args(include=["node_modules/pkg/README.md"])))
+        self.assertEqual(matcher.get_visibility("node_modules/pkg/index.js")[0], Visibility.GHOSTED)
+        self.assertEqual(matcher.get_visibility("node_modules/pkg/README.md")[0], Visibility.INCLUDED)
+        self.assertEqual(matcher.get_visibility("src/.env.prod")[0], Visibility.REDACTED)
+        self.assertEqual(matcher.get_visibility("src/main.py"), (Visibility.INCLUDED, None))
+
+    def test_can_skip_dir_is_exact_for_anchored_overrides(self) -> None:
+        """Verifies pruned and ghosted trees are skipped unless an override can match beneath them."""
+        matcher = VisibilityMatcher(build_rules(make_args(prune=["vendor"], include=["/vendor/lib/*.h"])))
+        self.assertFalse(matcher.can_skip_dir("vendor", Visibility.PRUNED))
+        self.assertFalse(matcher.can_skip_dir("vendor/lib", Visibility.PRUNED))
+        self.assertTrue(matcher.can_skip_dir("vendor/other", Visibility.PRUNED))
+        self.assertTrue(matcher.can_skip_dir("node_modules", Visibility.GHOSTED))
+
+        floating = VisibilityMatcher(build_rules(make_args(prune=["vendor"], include=["*.md"])))
+        self.assertFalse(floating.can_skip_dir("vendor", Visibility.PRUNED))
+        self.assertTrue(floating.can_skip_dir("node_modules", Visibility.GHOSTED))
+
+    def test_unanchored_wildcard_on_deep_paths(self) -> None:
+        """Verifies floating wildcard rules match at any depth without backtracking on deep misses."""
+        matcher = VisibilityMatcher(build_rules(make_args(prune=["a*b?c"])))
+        self.assertEqual(matcher.get_visibility("x/" * 30 + "aXbYc")[0], Visibility.PRUNED)
+        self.assertEqual(matcher.get_visibility("/".join(["dir"] * 40) + "/file.txt")[0], Visibility.INCLUDED)
+
+
+class TestNestedIgnoreFiles(RepoTestCase):
+    """Verifies per-directory ignore files apply only to their own subtree."""
+
+    def scan(self, args: argparse.Namespace, *targets: Path) -> Any:
+        positions: Dict[str, int] = {}
+        matcher = VisibilityMatcher(build_rules(args, positions), positions)
+        self.matcher = matcher
+        return RepoScanner(self.root, matcher, Telemetry(), None, 1 << 20, None).scan(list(targets) or [self.root])
+
+    def test_nested_rules_are_scoped(self) -> None:
+        """Verifies nested patterns, anchoring and negation relative to their directory."""
+        self.write("svc/.gitignore", "/gen\n*.log\n!keep.log\n")
+        self.write("svc/gen/artifact.txt", "artifact\n")
+        self.write("svc/src/gen/generated.txt", "kept: not anchored here\n")
+        self.write("svc/src/debug.log", "noise\n")
+        self.write("svc/keep.log", "important\n")
+        self.write("other/trace.log", "sibling scope\n")
+
+        tree, included, _ = self.scan(make_args())
+        rel = sorted(p.relative_to(self.root).as_posix() for p in included)
+
+        self.assertEqual(rel, ["other/trace.log", "svc/.gitignore", "svc/keep.log", "svc/src/gen/generated.txt"])
+        self.assertEqual(tree.directories["svc"].directories["gen"].files, set())
+        self.assertEqual(self.matcher.get_visibility("svc/src/debug.log"), (Visibility.GHOSTED, "svc/.gitignore"))
+
+    def test_cli_overrides_outrank_nested_rules(self) -> None:
+        """Verifies nested files slot in below .llmignore and command line rules."""
+        self.write("svc/.gitignore", "*.md\n")
+        self.write("svc/README.md", "# svc\n")
+        self.write("svc/NOTES.md", "notes\n")
+        _, included, _ = self.scan(make_args(include=["/svc/README.md"]))
+        self.assertIn(self.root / "svc" / "README.md", included)
+        self.assertNotIn(self.root / "svc" / "NOTES.md", included)
+
+    def test_ancestor_rules_apply_to_subdirectory_targets(self) -> None:
+        """Verifies ignore files above a target apply just as in a scan from the root."""
+        self.write("a/.gitignore", "*.log\n")
+        self.write("a/b/c/debug.log", "noise\n")
+        self.write("a/b/c/app.py", "print()\n")
+        for target in (self.root, self.root / "a" / "b", self.root / "a" / "b" / "c" / "debug.log"):
+            with self.subTest(target=target):
+                _, included, _ = self.scan(make_args(), target)
+                self.assertNotIn(self.root / "a" / "b" / "c" / "debug.log", included)
+        _, included, _ = self.scan(make_args(), self.root / "a" / "b")
+        self.assertEqual(included, [self.root / "a" / "b" / "c" / "app.py"])
+
+
+class TestRepoScanner(RepoTestCase):
+    """Verifies scandir-based traversal semantics."""
+
+    def test_symlinks_and_output_file_are_pruned(self) -> None:
+        """Verifies symlinks are never followed and the output file is not scanned."""
+        self.write("src/app.py", "print('hi')\n")
+        self.write("snapshot.xml", "<repository/>\n")
+        os.symlink(self.root / "src", self.root / "linked_dir")
+        os.symlink(self.root / "src" / "app.py", self.root / "linked_file.py")
+
+        telemetry = Telemetry()
+        matcher = VisibilityMatcher(build_rules(make_args()))
+        scanner = RepoScanner(self.root, matcher, telemetry, ["py"], 1024, self.root / "snapshot.xml")
+        tree, included, redacted = scanner.scan([self.root])
+
+        self.assertEqual(included, [self.root / "src" / "app.py"])
+        self.assertEqual(redacted, [])
+        self.assertEqual(set(tree.directories), {"src"})
+        self.assertEqual(telemetry.pruned_paths, 3)
+
+    def test_ghosted_directory_reaches_anchored_override(self) -> None:
+        """Verifies an anchored include inside a ghosted tree is found without listing siblings."""
+        self.write("node_modules/pkg/README.md", "# pkg\n")
+        self.write("node_modules/pkg/index.js", "module.exports = 1;\n")
+        self.write("node_modules/other/README.md", "# other\n")
+        self.write("dist/bundle.js", "x\n")
+
+        matcher = VisibilityMatcher(build_rules(make_args(include=["/node_modules/pkg/*.md"])))
+        scanner = RepoScanner(self.root, matcher, Telemetry(), None, 1024, None)
+        listed: List[str] = []
+        real_scandir = os.scandir
+        with unittest.mock.patch("os.scandir", side_effect=lambda p: listed.append(p) or real_scandir(p)):
+            tree, included, _ = scanner.scan([self.root])
+
+        self.assertEqual(included, [self.root / "node_modules" / "pkg" / "README.md"])
+        self.assertEqual(set(tree.directories["node_modules"].directories), {"pkg"})
+        self.assertEqual(tree.directories["node_modules"].directories["pkg"].files, {"README.md"})
+        self.assertNotIn(str(self.root / "node_modules" / "other"), listed)
+        self.assertNotIn(str(self.root / "dist"), listed)
+
+
+    def test_middle_slash_anchors_like_gitignore(self) -> None:
+        """Verifies a pattern with an inner slash is anchored, so it reaches inside a ghosted tree."""
+        self.write("node_modules/pkg/README.md", "# pkg\n")
+        self.write("node_modules/pkg/index.js", "module.exports = 1;\n")
+        self.write("vendor/node_modules/pkg/README.md", "# nested\n")
+
+        matcher = VisibilityMatcher(build_rules(make_args(include=["node_modules/pkg/README.md"])))
+        self.assertTrue(matcher.rules[-1].anchored)
+        _, included, _ = RepoScanner(self.root, matcher, Telemetry(), None, 1024, None).scan([self.root])
+        self.assertEqual(included, [self.root / "node_modules" / "pkg" / "README.md"])
+
+class TestDeduplication(RepoTestCase):
+    """Verifies repeated file contents are emitted once and referenced afterwards."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        for rel in ("a/LICENSE", "b/LICENSE", "c/LICENSE"):
+            self.write(rel, "MIT License\n")
+        self.write("d/LICENSE", "Apache License\n")
+
+    def test_later_copies_reference_the_first(self) -> None:
+        """Verifies duplicates become references in both serial and parallel rendering."""
+        for jobs in (1, 4):
+            with self.subTest(jobs=jobs):
+                xml = self.extract(jobs=jobs, dedup=True)
+                self.assertEqual(xml.count("MIT License"), 1)
+                self.assertIn('<file path="b/LICENSE" duplicate_of="a/LICENSE"/>', xml)
+                self.assertIn('<file path="c/LICENSE" duplicate_of="a/LICENSE"/>', xml)
+                self.assertIn("Apache License", xml)
+                self.assertEqual(self.telemetry.duplicate_files, 2)
+
+    def test_checksum_collision_is_confirmed(self) -> None:
+        """Verifies distinct contents sharing a CRC32 are both emitted in full."""
+        with unittest.mock.patch("zlib.crc32", return_value=0):
+            xml = self.extract(dedup=True)
+        self.assertIn("Apache License", xml)
+        self.assertEqual(self.telemetry.duplicate_files, 2)
+
+
+class TestCompressedOutput(RepoTestCase):
+    """Verifies compressed sinks are chosen by extension and limit the raw payload."""
+
+    def render_to(self, name: str, max_bytes: int = None) -> bytes:
+        path = self.root / name
+        telemetry = Telemetry()
+        matcher = VisibilityMatcher(build_rules(make_args()))
+        scanner = RepoScanner(self.root, matcher, telemetry, None, 1 << 20, path)
+        tree, included, redacted = scanner.scan([self.root / "src"])
+        with open_output_sink(path, output_compression(path, None, 0), None, 0) as sink:
+            XMLRepoRenderer(self.root, telemetry, max_bytes).render(tree, included, redacted, [self.root / "src"], sink)
+        self.telemetry = telemetry
+        return path.read_bytes()
+
+    def test_gzip_and_xz_round_trip(self) -> None:
+        """Verifies compressed outputs decompress to the plain rendering."""
+        for i in range(20):
+            self.write(f"src/mod{i}.py", f"VALUE = {i}\n" * 50)
+        plain = self.strip_date(self.render_to("plain.xml").decode("utf-8"))
+        for name, decompress in (("out.xml.gz", gzip.decompress), ("out.xml.xz", lzma.decompress)):
+            with self.subTest(name=name):
+                data = self.render_to(name)
+                self.assertLess(len(data), self.telemetry.bytes_written)
+                self.assertEqual(self.strip_date(decompress(data).decode("utf-8")), plain)
+
+    def test_max_size_applies_before_compression(self) -> None:
+        """Verifies the global limit counts uncompressed bytes."""
+        self.write("src/big.py", "x = 1\n" * 1000)
+        self.write("src/small.py", "y = 2\n")
+        raw = gzip.decompress(self.render_to("out.xml.gz", max_bytes=2048))
+        self.assertTrue(self.telemetry.limit_reached)
+        self.assertEqual(len(raw), self.telemetry.bytes_written + len(self.LIMIT_WARNING))
+
+    def test_options_are_validated(self) -> None:
+        """Verifies levels and threads are checked against the selected format."""
+        self.assertIsNone(output_compression(Path("out.xml"), None, 0))
+        self.assertEqual(output_compression(Path("out.XML.GZ"), 6, 0), ".gz")
+        with self.assertRaises(ValueError):
+            output_compression(Path("out.xml.gz"), 12, 0)
+        with self.assertRaises(ValueError):
+            output_compression(Path("out.xml.xz"), None, 4)
+        with self.assertRaises(ValueError):
+            output_compression(Path("out.xml"), 3, 0)
+
+
+class TestWatchMode(RepoTestCase):
+    """Verifies watch-mode refreshes re-read only what changed."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        for name in ("a.py", "b.py", "c.py"):
+            self.write(f"src/{name}", f"# {name}\n")
+        self.output = self.root / "ctx.xml"
+        limits = ExtractionLimits(None, 1 << 20, 0, TokenWeights(), None)
+        self.session = WatchSession(make_args(), self.root, [self.root], self.output, limits, None)
+        self.session.rescan()
+        self.session.render()
+
+    def test_modification_rereads_only_touched_file(self) -> None:
+        """Verifies a content change re-renders one file and swaps the output in place."""
+        self.write("src/b.py", "# changed\n")
+        read = unittest.mock.Mock(wraps=FileReader.read_text)
+        with unittest.mock.patch.object(FileReader, "read_text", read):
+            self.assertEqual(self.session.refresh({str(self.root / "src" / "b.py")}), 1)
+            self.session.render()
+        read.assert_called_once_with(self.root / "src" / "b.py")
+        xml = self.output.read_text(encoding="utf-8")
+        self.assertIn("# changed", xml)
+        self.assertIn("# a.py", xml)
+        self.assertFalse((self.root / ".ctx.xml.tmp").exists())
+
+    def test_structural_change_rescans_from_memo(self) -> None:
+        """Verifies a new file appears after a rescan without re-reading existing ones."""
+        self.write("src/d.py", "# new\n")
+        read = unittest.mock.Mock(wraps=FileReader.read_text)
+        with unittest.mock.patch.object(FileReader, "read_text", read):
+            self.session.rescan()
+            self.session.render()
+        read.assert_called_once_with(self.root / "src" / "d.py")
+        self.assertIn("src/d.py", self.output.read_text(encoding="utf-8"))
+        self.assertNotIn(str(self.output), self.session.entries)
+
+    def test_files_vanishing_before_render_are_listed_only(self) -> None:
+        """Verifies a file deleted after a rescan stays in the tree without content."""
+        os.unlink(self.root / "src" / "a.py")
+        with unittest.mock.patch("sys.stderr", io.StringIO()):
+            telemetry = self.session.render()
+        xml = self.output.read_text(encoding="utf-8")
+        self.assertNotIn('<file path="src/a.py">', xml)
+        self.assertIn("a.py", xml)
+        self.assertIn("# b.py", xml)
+        self.assertEqual(telemetry.ghosted_paths, 1)
+
+    def test_failed_refresh_keeps_watching(self) -> None:
+        """Verifies an error during one refresh is reported and the next event rescans."""
+        b_path = str(self.root / "src" / "b.py")
+        watcher = unittest.mock.Mock()
+        watcher.wait.side_effect = [({b_path}, False), ({b_path}, False), KeyboardInterrupt]
+        real_render = self.session.render
+        failures = iter([None, FileNotFoundError(2, "gone"), None])
+
+        def flaky_render() -> Telemetry:
+            failure = next(failures)
+            if failure is not None:
+                raise failure
+            return real_render()
+
+        render = unittest.mock.Mock(side_effect=flaky_render)
+        with unittest.mock.patch("scripts.repo2txt.InotifyWatcher", return_value=watcher), \
+                unittest.mock.patch.object(self.session, "render", render), \
+                unittest.mock.patch.object(self.session, "rescan", wraps=self.session.rescan) as rescan, \
+                unittest.mock.patch("sys.stderr", io.StringIO()) as err:
+            self.session.run()
+        self.assertEqual(render.call_count, 3)
+        self.assertEqual(rescan.call_count, 2)
+        self.assertIn("retrying on the next change", err.getvalue())
+        watcher.close.assert_called_once()
+
+    def test_watchers_report_changes(self) -> None:
+        """Verifies both watcher backends classify modifications and creations."""
+        watchers = [PollingWatcher({str(self.output)}, interval=0.01)]
+        if sys.platform.startswith("linux"):
+            watchers.append(InotifyWatcher({str(self.output)}))
+        src = str(self.root / "src")
+        for watcher in watchers:
+            with self.subTest(watcher=type(watcher).__name__):
+                watcher.watch([src], [src + "/a.py"])
+                self.write("src/a.py", f"# edit {type(watcher).__name__}\n")
+                os.utime(self.root / "src" / "a.py", ns=(1, 1))
+                self.assertEqual(watcher.wait(), ({src + "/a.py"}, False))
+                self.write("src/e.py")
+                self.assertTrue(watcher.wait()[1])
+                os.remove(self.root / "src" / "e.py")
+                watcher.close()
+
+
+class TestServeMode(RepoTestCase):
+    """Verifies the server reuses warm state without serving stale results."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        for name in ("a.py", "b.md"):
+            path = self.write(f"src/{name}", f"contents of {name}\n")
+            os.utime(path, (1_600_000_000, 1_600_000_000))
+        os.utime(self.root / "src", (1_600_000_000, 1_600_000_000))
+        self.service = ExtractionService(self.root, 1 << 20)
+
+    def test_repeat_requests_are_served_warm(self) -> None:
+        """Verifies a repeated request reads no files and returns identical output."""
+        cold, _ = self.service.extract(["src"])
+        with unittest.mock.patch.object(FileReader, "read_text", side_effect=AssertionError), \
+                unittest.mock.patch("os.scandir", side_effect=AssertionError):
+            warm, telemetry = self.service.extract(["src"])
+        self.assertEqual(self.strip_date(cold.decode("utf-8")), self.strip_date(warm.decode("utf-8")))
+        self.assertEqual(telemetry.cache_hits, 2)
+
+        filtered, _ = self.service.extract(["src", "-t", "md"])
+        self.assertNotIn(b"src/a.py\"", filtered)
+        self.assertIn(b"contents of b.md", filtered)
+
+    def test_rule_and_listing_changes_are_noticed(self) -> None:
+        """Verifies edited ignore files and new entries invalidate the warm state."""
+        self.service.extract(["src"])
+        self.write(".llmignore", "*.md\n")
+        self.write("src/c.py", "new\n")
+        body, _ = self.service.extract(["src"])
+        self.assertNotIn(b"contents of b.md", body)
+        self.assertIn(b"src/c.py", body)
+
+    def test_unsupported_options_are_rejected(self) -> None:
+        """Verifies standalone-only options and parse errors raise instead of exiting."""
+        for argv in (["src", "-o", "out.xml"], ["src", "--watch"], ["--help"], []):
+            with self.subTest(argv=argv), self.assertRaises(ValueError):
+                self.service.extract(argv)
+
+    def test_requests_cannot_leave_root_or_expose_secrets(self) -> None:
+        """Verifies outside paths and --allow-secrets are refused and includes cannot lift secret redaction."""
+        outside = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, outside)
+        (outside / "secret.txt").write_text("outside\n")
+        self.write(".env", "TOKEN=1\n")
+        for argv in ([str(outside / "secret.txt")], ["../"], ["src", "-e", str(outside / "secret.txt")], ["src", "--since-manifest", "../m.json"], ["src", "--allow-secrets"]):
+            with self.subTest(argv=argv), self.assertRaises(ValueError):
+                self.service.extract(argv)
+
+        body, _ = self.service.extract([".", "-i", "*"])
+        self.assertNotIn(b"TOKEN=1", body)
+        self.assertIn(b"SECURITY_RISK", body)
+        permissive = ExtractionService(self.root, 1 << 20, allow_secrets=True)
+        self.assertIn(b"TOKEN=1", permissive.extract([".", "--allow-secrets"])[0])
+
+    def test_refs_cannot_pass_for_git_options(self) -> None:
+        """Verifies --since and --rev values starting with "-" never reach git as options."""
+        subprocess.run(["git", "init", "-q"], cwd=self.root, check=True)
+        outside = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, outside)
+        victim = outside / "victim"
+        victim.write_text("keep\n")
+        for option in ("--since", "--rev"):
+            with self.subTest(option=option), self.assertRaises(GitCommandError):
+                self.service.extract([".", f"{option}=--output={victim}"])
+        self.assertEqual(victim.read_text(), "keep\n")
+
+    def test_http_rejects_foreign_host(self) -> None:
+        """Verifies requests naming another host, as after DNS rebinding, are refused."""
+        server = ExtractionHTTPServer(("127.0.0.1", 0), self.service)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/"
+            request = urllib.request.Request(url, data=json.dumps(["src"]).encode("utf-8"), headers={"Host": "evil.example"})
+            with unittest.mock.patch("sys.stderr", io.StringIO()), self.assertRaises(urllib.error.HTTPError) as raised:
+                urllib.request.urlopen(request)
+            raised.exception.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(raised.exception.code, 403)
+
+    def test_http_round_trip(self) -> None:
+        """Verifies the HTTP front end returns the payload and telemetry headers."""
+        server = ExtractionHTTPServer(("127.0.0.1", 0), self.service)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/"
+            with unittest.mock.patch("sys.stderr", io.StringIO()):
+                with urllib.request.urlopen(url, data=json.dumps(["src"]).encode("utf-8")) as resp:
+                    body = resp.read()
+                    telemetry = json.loads(resp.headers["X-Repo2txt-Telemetry"])
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertIn(b"contents of a.py", body)
+        self.assertEqual(telemetry["included_files"], 2)
+        self.assertEqual(telemetry["bytes_written"], len(body))
+
+    def test_listing_cache_revalidates_on_mtime(self) -> None:
+        """Verifies cached listings are dropped when the directory changes."""
+        listings = DirectoryListingCache()
+        self.assertEqual([e.name for e in listings.list(str(self.root / "src"))], ["a.py", "b.md"])
+        self.write("src/0.txt")
+        self.assertEqual([e.name for e in listings.list(str(self.root / "src"))], ["0.txt", "a.py", "b.md"])
+
+
+class TestRunStats(RepoTestCase):
+    """Verifies profiling hooks record phases, rule wins and per-file reads."""
+
+    def test_collects_phases_rules_and_files(self) -> None:
+        """Verifies counters line up with what the scan and render actually did."""
+        self.write("src/a.py", "x = 1\n")
+        self.write("src/b.py", "y = 2\n" * 100)
+        self.write(".env", "SECRET=1\n")
+        stats = RunStats(top_n=1)
+        telemetry = Telemetry()
+        matcher = VisibilityMatcher(build_rules(make_args()))
+        matcher.stats = stats
+        scanner = RepoScanner(self.root, matcher, telemetry, None, 1 << 20, None)
+        with stats.phase("scan"):
+            tree, included, redacted = scanner.scan([self.root])
+        renderer = XMLRepoRenderer(self.root, telemetry, None, jobs=2)
+        renderer.stats = stats
+        with stats.phase("render"):
+            renderer.render(tree, included, redacted, [self.root], io.BytesIO())
+
+        report = stats.to_dict(telemetry, 1.0, 1.0)
+        self.assertEqual(set(report["phases"]), {"scan", "match", "render", "read", "format", "write"})
+        self.assertEqual(report["phases"]["read"]["calls"], 2)
+        self.assertEqual(report["phases"]["match"]["calls"], sum(r["wins"] for r in report["rules"]))
+        wins = {(r["source"], r["pattern"]): r["wins"] for r in report["rules"]}
+        self.assertEqual(wins[("SECURITY_RISK", ".env*")], 1)
+        self.assertEqual(wins[("", "")], 3)
+        self.assertEqual(sum(h["count"] for h in report["file_size_bytes"]), 2)
+        self.assertIn(report["slowest_files"][0]["path"], ("src/a.py", "src/b.py"))
+        self.assertEqual(len(report["slowest_files"]), 1)
+        json.dumps(report)
+
+
+class TestDeltaMode(RepoTestCase):
+    """Verifies delta snapshots against a manifest or a git ref."""
+
+    def run_cli(self, *argv: str) -> str:
+        args = parse_extraction_args(build_parser(), list(argv))
+        out = io.BytesIO()
+        self.telemetry = run_extraction(args, self.root, ExtractionLimits.from_args(args), out_stream=out)
+        return out.getvalue().decode("utf-8")
+
+    def test_manifest_delta_renders_changes_and_deletions(self) -> None:
+        """Verifies only changed files are rendered and stat-identical files are never re-read."""
+        for name in ("a.py", "b.py", "c.py"):
+            self.write(f"src/{name}", f"# {name}\n")
+            os.utime(self.root / "src" / name, ns=(10**9, 10**9))
+        self.run_cli(".", "--manifest-out", "snap.json")
+        self.assertEqual(set(SnapshotManifest.load(self.root / "snap.json").files), {"src/a.py", "src/b.py", "src/c.py"})
+
+        self.write("src/a.py", "# edited\n")
+        os.unlink(self.root / "src" / "b.py")
+        self.write("src/d.py", "# new\n")
+        digest = unittest.mock.Mock(wraps=SnapshotManifest.content_digest)
+        with unittest.mock.patch.object(SnapshotManifest, "content_digest", digest):
+            xml = self.run_cli(".", "--since-manifest", "snap.json", "--manifest-out", "snap.json")
+
+        self.assertEqual(sorted(c.args[0].name for c in digest.call_args_list), ["a.py", "d.py"])
+        self.assertIn("<changes_since>snap.json</changes_since>", xml)
+        self.assertIn('<deleted_files>\n    <file path="src/b.py"/>\n  </deleted_files>', xml)
+        self.assertIn("# edited", xml)
+        self.assertIn("# new", xml)
+        self.assertNotIn("c.py", xml)
+        self.assertNotIn('path="snap.json"', xml)
+        self.assertEqual((self.telemetry.included_files, self.telemetry.unchanged_files, self.telemetry.deleted_files), (2, 1, 1))
+
+        xml = self.run_cli(".", "--since-manifest", "snap.json")
+        self.assertNotIn("<file path=", xml)
+
+    def test_since_git_ref_visits_only_changed_paths(self) -> None:
+        """Verifies --since lists modified, untracked and deleted files without walking the tree."""
+        self.write("src/main.py", "print('main')\n")
+        self.write("src/gone.py", "print('gone')\n")
+        self.write("node_modules/pkg/index.js", "module.exports = 1;\n")
+        self.write("docs/guide.md", "# guide\n")
+        git = ["git", "-c", "user.name=t", "-c", "user.email=t@example.com"]
+        subprocess.run(["git", "init", "-q"], cwd=self.root, check=True)
+        subprocess.run(["git", "add", "."], cwd=self.root, check=True)
+        subprocess.run([*git, "commit", "-q", "-m", "base"], cwd=self.root, check=True)
+
+        self.write("src/main.py", "print('changed')\n")
+        self.write("src/extra.py", "print('extra')\n")
+        os.unlink(self.root / "src" / "gone.py")
+        os.unlink(self.root / "node_modules" / "pkg" / "index.js")
+        with unittest.mock.patch.object(os, "scandir", side_effect=AssertionError):
+            xml = self.run_cli(".", "--since", "HEAD")
+
+        self.assertEqual(ET.fromstring(xml).find("metadata/changes_since").text, "HEAD")
+        self.assertIn('<file path="src/gone.py"/>', xml)
+        self.assertNotIn("index.js", xml)
+        self.assertNotIn("guide.md", xml)
+        self.assertIn("print('changed')", xml)
+        self.assertIn("print('extra')", xml)
+        self.assertEqual(self.telemetry.scanned_paths, 2)
+
+    def test_since_ref_cannot_pass_for_a_git_option(self) -> None:
+        """Verifies a --since value starting with "-" is rejected before git can act on it."""
+        self.write("src/main.py", "print('main')\n")
+        subprocess.run(["git", "init", "-q"], cwd=self.root, check=True)
+        victim = self.root / "victim"
+        with self.assertRaises(GitCommandError):
+            self.run_cli(".", f"--since=--output={victim}")
+        self.assertFalse(victim.exists())
+
+
+class TestShardedOutput(RepoTestCase):
+    """Verifies --shard-size splits the snapshot into bounded, self-contained parts."""
+
+    def run_cli(self, *argv: str) -> Telemetry:
+        args = parse_extraction_args(build_parser(), list(argv))
+        return run_extraction(args, self.root, ExtractionLimits.from_args(args))
+
+    def test_part_names(self) -> None:
+        """Verifies the part index goes before the document and compression suffixes."""
+        self.assertEqual(shard_path(Path("out/snap.xml"), 3, None), Path("out/snap.003.xml"))
+        self.assertEqual(shard_path(Path("snap.xml.gz"), 12, ".gz"), Path("snap.012.xml.gz"))
+        self.assertEqual(shard_path(Path("snap"), 1, None), Path("snap.001"))
+
+    def test_parts_are_bounded_and_cover_every_file(self) -> None:
+        """Verifies each part fits, parses on its own and lists only its files in its tree."""
+        for i in range(12):
+            self.write(f"pkg{i % 3}/mod{i}.py", f"value_{i} = {'x' * 300!r}\n")
+        self.write("pkg0/big.py", "y" * 5000)
+        self.write("assets/logo.png", "png")
+        out = self.root.parent / f"{self.root.name}-out"
+        out.mkdir()
+        self.addCleanup(shutil.rmtree, out)
+        for i in range(1, 21):
+            shard_path(out / "snap.xml", i, None).write_text("stale")
+
+        telemetry = self.run_cli(".", "-o", str(out / "snap.xml"), "--shard-size", "2KB", "-j", "3")
+
+        parts = sorted(out.glob("snap.*.xml"))
+        self.assertEqual(len(parts), telemetry.output_parts)
+        self.assertGreater(len(parts), 2)
+        rendered: List[str] = []
+        for i, part in enumerate(parts, 1):
+            data = part.read_bytes()
+            self.assertLessEqual(len(data), 2048)
+            doc = ET.fromstring(data)
+            self.assertEqual(doc.find("metadata/part").text, str(i))
+            paths = [f.get("path") for f in doc.iter("file")]
+            tree = doc.find("directory_tree").text
+            for path in paths:
+                self.assertIn(path.rpartition("/")[2], tree)
+            rendered.extend(paths)
+        self.assertEqual(sorted(rendered), sorted([f"pkg{i % 3}/mod{i}.py" for i in range(12)] + ["pkg0/big.py"]))
+        self.assertIn("EXCEEDS_SHARD_SIZE", "".join(p.read_text() for p in parts))
+        self.assertEqual(sum(p.stat().st_size for p in parts), telemetry.bytes_written)
+
+    def test_dedup_never_points_at_a_redacted_copy(self) -> None:
+        """Verifies a copy too large for a part does not become the original of later copies."""
+        self.write("a.py", "z" * 5000)
+        self.write("b.py", "z" * 5000)
+        out = self.root / "out"
+        out.mkdir()
+        self.run_cli("a.py", "b.py", "-o", str(out / "snap.xml"), "--shard-size", "4KB", "--dedup")
+
+        files = [f for part in sorted(out.glob("snap.*.xml")) for f in ET.parse(part).getroot().iter("file")]
+        self.assertEqual([f.get("duplicate_of") for f in files], [None, None])
+        self.assertEqual([f.find("metadata/status").text for f in files], ["REDACTED: EXCEEDS_SHARD_SIZE"] * 2)
+
+    def test_manifest_marks_files_too_large_for_a_part(self) -> None:
+        """Verifies a file redacted for the part size is emitted by the next delta, like a budget drop."""
+        self.write("small.py", "s = 1\n")
+        self.write("big.py", "z" * 5000)
+        out = self.root / "out"
+        out.mkdir()
+        with unittest.mock.patch("sys.stderr", io.StringIO()):
+            self.run_cli(".", "-o", str(out / "snap.xml"), "--shard-size", "4KB", "--manifest-out", "snap.json")
+        manifest = SnapshotManifest.load(self.root / "snap.json")
+        self.assertEqual(manifest.files["big.py"].digest, "REDACTED:EXCEEDS_SHARD_SIZE")
+        self.assertFalse(manifest.files["small.py"].digest.startswith("REDACTED:"))
+
+        self.run_cli(".", "-o", str(out / "snap.xml"), "--shard-size", "16KB", "--since-manifest", "snap.json")
+        files = {f.get("path"): f for part in sorted(out.glob("snap.*.xml")) for f in ET.parse(part).getroot().iter("file")}
+        self.assertEqual(sorted(files), ["big.py"])
+        self.assertIn("z" * 100, files["big.py"].find("content").text)
+
+
+class TestOutputEstimator(RepoTestCase):
+    """Verifies the stat-only estimate used by --dry-run."""
+
+    def test_estimate_matches_render_without_opening_files(self) -> None:
+        """Verifies totals track the rendered size and subtrees are ranked without repeating chains."""
+        self.write("src/app/main.py", "print('hello')\n" * 400)
+        self.write("src/app/util.py", "x = 1\n" * 50)
+        self.write("docs/guide.md", "# Guide\n" * 20)
+        self.write(".env", "SECRET=1\n")
+        telemetry = Telemetry()
+        scanner = RepoScanner(self.root, VisibilityMatcher(build_rules(make_args())), telemetry, None, 1 << 20, None)
+        tree, included, redacted = scanner.scan([self.root])
+        renderer = XMLRepoRenderer(self.root, telemetry, None)
+
+        with unittest.mock.patch("builtins.open", side_effect=AssertionError):
+            subtrees = OutputEstimator(renderer).estimate(tree, included, redacted, [self.root])
+
+        self.assertEqual([(e.path, e.files) for e in subtrees], [("src/app", 2), ("docs", 1)])
+        rendered = self.extract()
+        self.assertAlmostEqual(telemetry.estimated_bytes, len(rendered.encode("utf-8")), delta=16)
+        self.assertGreater(telemetry.estimated_tokens, 0)
+
+
+class TestRuleDiagnostics(RepoTestCase):
+    """Verifies --explain-rules counters and --explain decision chains."""
+
+    def test_tracer_flags_dead_and_shadowed_rules(self) -> None:
+        """Verifies per-rule matches, wins and examples, including nested scopes."""
+        self.write("svc/.gitignore", "*.log\n")
+        self.write("svc/app.log", "noise\n")
+        self.write("src/main.py", "print()\n")
+        positions: Dict[str, int] = {}
+        matcher = VisibilityMatcher(build_rules(make_args(ghost=["src"], include=["/src/main.py"], prune=["never_there"]), positions), positions)
+        matcher.tracer = RuleTracer(matcher.rules)
+        RepoScanner(self.root, matcher, Telemetry(), None, 1 << 20, None).scan([self.root])
+
+        traces = {(t.rule.reason, t.rule.raw): t for t in matcher.tracer.traces.values()}
+        ghost = traces[("EXPLICIT_GHOST", "src")]
+        self.assertEqual((ghost.matches, ghost.wins), (2, 1))
+        self.assertEqual(traces[("EXPLICIT_INCLUDE", "/src/main.py")].example, "src/main.py")
+        self.assertEqual(traces[("EXPLICIT_PRUNE", "never_there")].matches, 0)
+        nested = traces[("svc/.gitignore", "*.log")]
+        self.assertEqual((nested.matches, nested.wins, nested.example), (1, 1, "svc/app.log"))
+
+    def test_explain_lists_chain_and_outcome(self) -> None:
+        """Verifies every matching rule is listed in precedence order with the decider marked."""
+        self.write("svc/.gitignore", "*.log\n")
+        positions: Dict[str, int] = {}
+        matcher = VisibilityMatcher(build_rules(make_args(redact=["*.log"], include=["svc/keep.log"]), positions), positions)
+
+        lines = explain_path(matcher, self.root, "svc/app.log")
+        self.assertEqual(lines[-1], "  => REDACTED (EXPLICIT_REDACT)")
+        chain = [line.split()[3] for line in lines if line.startswith("      #")]
+        self.assertEqual(chain, ["svc/.gitignore", "EXPLICIT_REDACT"])
+        self.assertTrue(lines[-2].endswith("<- decides"))
+
+        self.assertEqual(explain_path(matcher, self.root, "svc/keep.log")[-1], "  => INCLUDED (EXPLICIT_INCLUDE)")
+        self.assertIn("not reached", explain_path(matcher, self.root, "node_modules/pkg/index.js")[-1])
+
+
+class TestArchiveTargets(RepoTestCase):
+    """Verifies tar and zip targets are scanned and rendered without extraction."""
+
+    def build_tree(self, base: Path) -> None:
+        for rel_path, content in {"src/main.py": "print('packed')\n", ".env": "SECRET=1\n", "node_modules/x/index.js": "x\n", "blob.dat": "a\0b"}.items():
+            path = base / rel_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content, encoding="utf-8")
+
+    def test_tar_and_zip_members_are_rendered_in_place(self) -> None:
+        """Verifies members are matched from the archive root and listed beneath the archive name."""
+        staging = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, staging)
+        self.build_tree(staging)
+        with tarfile.open(self.root / "release.tar.gz", "w:gz") as tar:
+            tar.add(staging, arcname=".")
+        with zipfile.ZipFile(self.root / "release.zip", "w") as zf:
+            for path in sorted(staging.rglob("*")):
+                if path.is_file():
+                    zf.write(path, path.relative_to(staging).as_posix())
+
+        output = self.extract(targets=[self.root / "release.tar.gz", self.root / "release.zip"])
+        doc = ET.fromstring(output)
+        files = {f.get("path"): f for f in doc.iter("file")}
+        self.assertEqual(
+            sorted(files), ["release.tar.gz/.env", "release.tar.gz/src/main.py", "release.zip/.env", "release.zip/src/main.py"]
+        )
+        for name in ("release.tar.gz", "release.zip"):
+            self.assertIn("print('packed')", files[f"{name}/src/main.py"].find("content").text)
+            self.assertEqual(files[f"{name}/.env"].find("metadata/status").text, "REDACTED: SECURITY_RISK")
+        tree = doc.find("directory_tree").text
+        self.assertIn("release.zip/", tree)
+        self.assertIn("node_modules/", tree)
+        self.assertNotIn("index.js", tree)
+        self.assertFalse((self.root / "src").exists())
+
+    def test_unreadable_archive_is_skipped_with_warning(self) -> None:
+        """Verifies a corrupt archive does not abort the extraction."""
+        (self.root / "broken.zip").write_bytes(b"not a zip")
+        self.write("main.py", "print()\n")
+        stderr = io.StringIO()
+        with unittest.mock.patch("sys.stderr", stderr):
+            output = self.extract(targets=[self.root / "broken.zip", self.root / "main.py"])
+        self.assertIn('path="main.py"', output)
+        self.assertIn("Cannot read archive", stderr.getvalue())
+
+
+class TestExcerpts(RepoTestCase):
+    """Verifies --excerpt and --excerpt-lines render heads and tails of oversized files."""
+
+    def run_cli(self, *argv: str) -> ET.Element:
+        args = parse_extraction_args(build_parser(), list(argv))
+        out = io.BytesIO()
+        self.telemetry = run_extraction(args, self.root, ExtractionLimits.from_args(args), out_stream=out)
+        return ET.fromstring(out.getvalue())
+
+    def test_head_and_tail_lines_skip_the_middle(self) -> None:
+        """Verifies whole lines are kept, the omitted bytes are counted and the middle is never read."""
+        head = "".join(f"head {i}\n" for i in range(10))
+        tail = "".join(f"tail {i}\n" for i in range(10))
+        middle = "\0" * 8192
+        self.write("schema.sql", head + middle + tail)
+        self.write("small.py", "print()\n")
+
+        doc = self.run_cli(".", "--max-file-size", "1KB", "--excerpt-lines", "3")
+        files = {f.get("path"): f for f in doc.iter("file")}
+        content = files["schema.sql"].find("content")
+        marker = content.find("truncated")
+        self.assertEqual(content.text.strip(), "head 0\nhead 1\nhead 2")
+        self.assertEqual(marker.tail.strip(), "tail 7\ntail 8\ntail 9")
+        self.assertEqual(int(marker.get("bytes_omitted")), len(head + middle + tail) - len("head 0\nhead 1\nhead 2\n" + "tail 7\ntail 8\ntail 9\n"))
+        self.assertEqual(files["schema.sql"].find("metadata/size_lines").text, "6")
+        self.assertEqual(files["small.py"].find("content").text.strip(), "print()")
+        self.assertEqual((self.telemetry.excerpted_files, self.telemetry.redacted_files), (1, 0))
+
+    def test_byte_excerpt_escapes_cdata_and_validates_size(self) -> None:
+        """Verifies byte excerpts drop partial lines, stay well-formed and must fit the per-file limit."""
+        self.write("log.txt", "".join(f"line {i:04d} ]]>\n" for i in range(200)))
+
+        content = self.run_cli(".", "--max-file-size", "1KB", "--excerpt", "40B").find("files/file/content")
+        self.assertEqual(content.text.strip(), "line 0000 ]]>\nline 0001 ]]>")
+        self.assertEqual(content.find("truncated").tail.strip(), "line 0198 ]]>\nline 0199 ]]>")
+        with self.assertRaises(ValueError):
+            self.run_cli(".", "--max-file-size", "1KB", "--excerpt", "1KB")
+
+    def test_cut_points_respect_lines_and_characters(self) -> None:
+        """Verifies a tail starting on a line keeps it, single-line files are cut between characters, and unreadable files are skipped."""
+        lines = self.write("lines.txt", "".join(f"line{i:04d}\n" for i in range(100)))
+        excerpt = FileReader.read_excerpt(lines, ExcerptPolicy(100, 90))
+        self.assertEqual((excerpt.head.count("\n"), excerpt.tail.count("\n")), (10, 10))
+        self.assertTrue(excerpt.tail.startswith("line0090\n"))
+
+        minified = self.write("min.js", "é" * 3000)
+        excerpt = FileReader.read_excerpt(minified, ExcerptPolicy(100, 101))
+        self.assertEqual((excerpt.head, excerpt.tail), ("é" * 50, "é" * 50))
+
+        with unittest.mock.patch("builtins.open", side_effect=PermissionError), unittest.mock.patch("sys.stderr", io.StringIO()):
+            self.assertIsNone(FileReader.read_excerpt(lines, ExcerptPolicy(100, 90)))
+
+    def test_files_vanishing_before_render_are_listed_only(self) -> None:
+        """Verifies files deleted between scan and render are ghosted instead of aborting the run."""
+        self.write("big.txt", "x\n" * 2000)
+        self.write("small.txt", "small\n")
+        self.write("kept.txt", "kept\n")
+        collect = RepoScanner.collect
+
+        def collect_then_delete(scanner: RepoScanner, entries: Any) -> Any:
+            found = collect(entries)
+            os.unlink(self.root / "big.txt")
+            os.unlink(self.root / "small.txt")
+            return found
+
+        with unittest.mock.patch.object(RepoScanner, "collect", collect_then_delete), unittest.mock.patch("sys.stderr", io.StringIO()) as err:
+            doc = self.run_cli(".", "--max-file-size", "1KB", "--excerpt", "256B")
+        self.assertEqual([f.get("path") for f in doc.iter("file")], ["kept.txt"])
+        self.assertIn("big.txt", doc.find("directory_tree").text)
+        self.assertEqual(self.telemetry.ghosted_paths, 2)
+        self.assertIn("Cannot read", err.getvalue())
+
+
+class TestRenderCache(RepoTestCase):
+    """Verifies the persistent render cache skips unchanged files."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        for name in ("a.py", "b.md", "c.txt"):
+            path = self.write(f"src/{name}", f"contents of {name}\n")
+            os.utime(path, (1_600_000_000, 1_600_000_000))
+        self.db_path = self.root / ".cache" / "render.sqlite3"
+
+    def test_unchanged_files_are_not_read(self) -> None:
+        """Verifies a warm cache serves every file without touching FileReader."""
+        for jobs in (1, 4):
+            with self.subTest(jobs=jobs):
+                cache = RenderCache(self.db_path, 1024 * 1024)
+                cold = self.strip_date(self.extract(jobs=jobs, cache=cache, targets=[self.root / "src"]))
+                cache.close()
+
+                cache = RenderCache(self.db_path, 1024 * 1024)
+                with unittest.mock.patch.object(FileReader, "read_text", side_effect=AssertionError):
+                    warm = self.strip_date(self.extract(jobs=jobs, cache=cache, targets=[self.root / "src"]))
+                cache.close()
+                self.assertEqual(cold, warm)
+                self.assertEqual(self.telemetry.cache_hits, 3)
+
+    def test_modified_file_is_reread_and_lru_bounded(self) -> None:
+        """Verifies stale entries are replaced and the store stays under its bound."""
+        cache = RenderCache(self.db_path, 1024 * 1024)
+        self.extract(cache=cache, targets=[self.root / "src"])
+        cache.close()
+
+        path = self.write("src/a.py", "changed\n")
+        os.utime(path, (1_600_000_100, 1_600_000_100))
+        cache = RenderCache(self.db_path, 300)
+        out = self.extract(cache=cache, targets=[self.root / "src"])
+        cache.close()
+        self.assertIn("changed", out)
+        self.assertEqual(self.telemetry.cache_hits, 2)
+
+        cache = RenderCache(self.db_path, 300)
+        total = cache._db.execute("SELECT SUM(nbytes) FROM entries").fetchone()[0]
+        cache.close()
+        self.assertLessEqual(total, 300)
+
+
+@unittest.skipUnless(shutil.which("git"), "git is not installed")
+class TestParallelScan(RepoTestCase):
+    """Verifies process-sharded scanning matches the serial walk."""
+
+    def test_matches_serial_scan(self) -> None:
+        """Verifies trees, entry lists and telemetry are identical to a serial scan."""
+        self.write("README.md", "# top\n")
+        self.write(".env", "SECRET=1\n")
+        for top in ("src", "tests", "docs"):
+            for i in range(3):
+                self.write(f"{top}/pkg{i}/mod.py", f"{top} {i}\n")
+        self.write("src/.gitignore", "gen/\n")
+        self.write("src/gen/out.py", "generated\n")
+        self.write("node_modules/dep/index.js", "x\n")
+
+        results = []
+        for workers in (1, 3):
+            positions: Dict[str, int] = {}
+            telemetry = Telemetry()
+            matcher = VisibilityMatcher(build_rules(make_args(), positions), positions)
+            scanner = RepoScanner(self.root, matcher, telemetry, None, 1 << 20, None)
+            tree = DirectoryNode("/")
+            included, redacted = scanner.collect(scanner.parallel_scan([self.root, self.root / "src"], tree, workers))
+            results.append((tree, included, redacted, telemetry))
+
+        self.assertEqual(results[0], results[1])
+        self.assertIn(self.root / "src" / "pkg0" / "mod.py", results[1][1])
+        self.assertEqual(results[1][2], [(self.root / ".env", "SECURITY_RISK")])
+        self.assertIn("gen", results[1][0].directories["src"].directories)
+
+
+class TestGitIndexScan(RepoTestCase):
+    """Verifies enumeration from the git index."""
+
+    def test_only_tracked_files_are_visited(self) -> None:
+        """Verifies untracked, ignored and deleted paths never reach the matcher."""
+        self.write("src/main.py", "print('main')\n")
+        self.write("src/gone.py", "print('gone')\n")
+        self.write("node_modules/pkg/index.js", "module.exports = 1;\n")
+        self.write("target/debug/out.txt", "artifact\n")
+        subprocess.run(["git", "init", "-q"], cwd=self.root, check=True)
+        subprocess.run(["git", "add", "src", "node_modules"], cwd=self.root, check=True)
+        os.unlink(self.root / "src" / "gone.py")
+
+        telemetry = Telemetry()
+        matcher = VisibilityMatcher(build_rules(make_args(from_git_index=True)))
+        scanner = RepoScanner(self.root, matcher, telemetry, None, 1024, None)
+        with unittest.mock.patch.object(os, "scandir", side_effect=AssertionError):
+            tree, included, _ = scanner.scan_git_index([self.root])
+
+        self.assertEqual(included, [self.root / "src" / "main.py"])
+        self.assertEqual(set(tree.directories), {"src", "node_modules"})
+        self.assertEqual(tree.directories["node_modules"].directories, {})
+        self.assertEqual(telemetry.scanned_paths, 1)
+
+
+class TestRevisionSnapshot(RepoTestCase):
+    """Verifies --rev renders a git revision without touching the working tree."""
+
+    def run_cli(self, *argv: str) -> str:
+        args = parse_extraction_args(build_parser(), list(argv))
+        out = io.BytesIO()
+        self.telemetry = run_extraction(args, self.root, ExtractionLimits.from_args(args), out_stream=out)
+        return out.getvalue().decode("utf-8")
+
+    def test_old_revision_is_rendered_through_one_process(self) -> None:
+        """Verifies contents, sizes and ignore rules come from the revision and blobs share one cat-file process."""
+        self.write("src/main.py", "print('v1')\n")
+        self.write("src/big.py", "x" * 4096)
+        self.write(".env", "SECRET=1\n")
+        self.write("docs/guide.md", "# Guide\n")
+        git = ["git", "-c", "user.name=t", "-c", "user.email=t@example.com"]
+        subprocess.run(["git", "init", "-q"], cwd=self.root, check=True)
+        subprocess.run(["git", "add", "-A"], cwd=self.root, check=True)
+        subprocess.run([*git, "commit", "-q", "-m", "v1"], cwd=self.root, check=True)
+        self.write("src/main.py", "print('v2')\n")
+        os.unlink(self.root / "docs" / "guide.md")
+
+        popen = subprocess.Popen
+        with unittest.mock.patch("subprocess.Popen", side_effect=popen) as spawned:
+            doc = ET.fromstring(self.run_cli("src", "docs", "--rev", "HEAD", "--max-file-size", "1KB", "-j", "4"))
+
+        commands = [call.args[0][3] for call in spawned.call_args_list]
+        self.assertEqual(sorted(commands), ["cat-file", "log", "ls-tree", "rev-parse", "show"])
+        for call in spawned.call_args_list:
+            if call.args[0][3] != "rev-parse":
+                self.assertFalse(any("HEAD" in arg for arg in call.args[0]), call.args[0])
+        self.assertEqual(doc.find("metadata/revision").text, "HEAD")
+        files = {f.get("path"): f for f in doc.iter("file")}
+        self.assertEqual(sorted(files), ["docs/guide.md", "src/big.py", "src/main.py"])
+        self.assertIn("print('v1')", files["src/main.py"].find("content").text)
+        self.assertIn("EXCEEDS_FILE_SIZE_LIMIT", files["src/big.py"].find("metadata/status").text)
+        self.assertEqual(files["docs/guide.md"].find("content").text.strip(), "# Guide")
+
+    def test_ignore_files_come_from_the_revision(self) -> None:
+        """Verifies root and nested ignore files are read from the revision, not the checkout."""
+        self.write("keep.log", "tracked log\n")
+        self.write("code.py", "print()\n")
+        self.write("sub/.llmignore", "notes.txt\n")
+        self.write("sub/notes.txt", "private\n")
+        git = ["git", "-c", "user.name=t", "-c", "user.email=t@example.com"]
+        subprocess.run(["git", "init", "-q"], cwd=self.root, check=True)
+        subprocess.run(["git", "add", "-A"], cwd=self.root, check=True)
+        subprocess.run([*git, "commit", "-q", "-m", "v1"], cwd=self.root, check=True)
+        self.write(".gitignore", "*.log\n")
+        self.write(".llmignore", "code.py\n")
+        os.unlink(self.root / "sub" / ".llmignore")
+
+        doc = ET.fromstring(self.run_cli(".", "--rev", "HEAD"))
+        paths = {f.get("path") for f in doc.iter("file")}
+        self.assertEqual(paths, {"keep.log", "code.py", "sub/.llmignore"})
+
+    def test_unknown_revision_raises(self) -> None:
+        """Verifies a bad revision fails before any output is produced."""
+        subprocess.run(["git", "init", "-q"], cwd=self.root, check=True)
+        with self.assertRaises(GitCommandError):
+            self.run_cli(".", "--rev", "does-not-exist")
+
+    def test_revision_cannot_pass_for_a_git_option(self) -> None:
+        """Verifies a --rev value starting with "-" is rejected before git can act on it."""
+        subprocess.run(["git", "init", "-q"], cwd=self.root, check=True)
+        victim = self.root / "victim"
+        with self.assertRaises(GitCommandError):
+            self.run_cli(".", f"--rev=--output={victim}")
+        self.assertFalse(victim.exists())
+
+    def test_nested_ignore_files_apply_to_listed_files(self) -> None:
+        """Verifies a nested .llmignore prunes tracked files just as a walk does."""
+        self.write("sub/.llmignore", "notes.txt\n")
+        self.write("sub/notes.txt", "private\n")
+        self.write("sub/code.py", "print()\n")
+        subprocess.run(["git", "init", "-q"], cwd=self.root, check=True)
+        subprocess.run(["git", "add", "sub"], cwd=self.root, check=True)
+
+        positions: Dict[str, int] = {}
+        matcher = VisibilityMatcher(build_rules(make_args(from_git_index=True), positions), positions)
+        _, included, _ = RepoScanner(self.root, matcher, Telemetry(), None, 1024, None).scan_git_index([self.root])
+        self.assertNotIn(self.root / "sub" / "notes.txt", included)
+        self.assertIn(self.root / "sub" / "code.py", included)
+
+
+class TestStreamingRender(RepoTestCase):
+    """Verifies the streaming pipeline renders while scanning."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.write("b/z.py", "z = 1\n")
+        self.write("a/y.py", "y = 1\n")
+        self.write("a/.env", "TOKEN=secret\n")
+        self.write("x.md", "# x\n")
+
+    def test_stream_emits_before_scan_completes(self) -> None:
+        """Verifies output flows during the scan and the tree trails the files."""
+        telemetry = Telemetry()
+        scanner = RepoScanner(self.root, VisibilityMatcher(build_rules(make_args())), telemetry, None, 1024, None)
+        tree = DirectoryNode("/")
+        out = io.BytesIO()
+        seen: List[str] = []
+
+        def observed() -> Iterator[Any]:
+            for entry in scanner.iter_scan([self.root], tree):
+                seen.append(out.getvalue().decode("utf-8"))
+                yield entry
+
+        XMLRepoRenderer(self.root, telemetry, None).render_stream(tree, observed(), [self.root], out)
+        xml = out.getvalue().decode("utf-8")
+
+        self.assertIn("<metadata>", seen[0])
+        self.assertNotIn("<file ", seen[0])
+        self.assertLess(xml.index("</files>"), xml.index("<directory_tree>"))
+        self.assertLess(xml.index('path="a/.env"'), xml.index('path="a/y.py"'))
+        self.assertLess(xml.index('path="a/y.py"'), xml.index('path="b/z.py"'))
+        self.assertEqual(self.strip_date(xml).count("<file "), self.strip_date(self.extract()).count("<file "))
+
+
+class TestFileReader(RepoTestCase):
+    """Verifies sampled binary detection and mapped reads."""
+
+    def test_binary_rejected_from_sample(self) -> None:
+        """Verifies a leading NUL rejects the file without mapping it."""
+        path = self.root / "image.raw"
+        path.write_bytes(b"\x00" + b"a" * (FileReader.SNIFF_BYTES * 4))
+        with unittest.mock.patch.object(mmap, "mmap", side_effect=AssertionError):
+            self.assertEqual(FileReader.read_text(path), (None, 0, True))
+
+    def test_late_nul_still_detected(self) -> None:
+        """Verifies NUL bytes beyond the sample are found in the mapping."""
+        path = self.root / "late.bin"
+        path.write_bytes(b"a" * (FileReader.SNIFF_BYTES * 2) + b"\x00tail")
+        self.assertEqual(FileReader.read_text(path), (None, 0, True))
+
+    def test_large_text_decoded(self) -> None:
+        """Verifies mapped text decodes with encoding fallbacks and line counts."""
+        body = "caf\u00e9 line\n" * (FileReader.SNIFF_BYTES // 4)
+        self.write("big.txt", body)
+        self.assertEqual(FileReader.read_text(self.root / "big.txt"), (body, FileReader.SNIFF_BYTES // 4, False))
+        (self.root / "legacy.txt").write_bytes(b"\xe9t\xe9\n" * FileReader.SNIFF_BYTES)
+        text, lines, is_binary = FileReader.read_text(self.root / "legacy.txt")
+        self.assertEqual((text[:3], lines, is_binary), ("\u00e9t\u00e9", FileReader.SNIFF_BYTES, False))
+
+
+class TestTokenBudget(RepoTestCase):
+    """Verifies token estimation and knapsack packing under --max-tokens."""
+
+    def test_estimator_is_monotonic_and_nonzero(self) -> None:
+        """Verifies the heuristic counts words and punctuation sensibly."""
+        self.assertEqual(TokenEstimator.estimate(b""), 0)
+        self.assertEqual(TokenEstimator.estimate(b"def f(x): return x"), 7)
+        self.assertGreater(TokenEstimator.estimate(b"word " * 200), TokenEstimator.estimate(b"word " * 100))
+
+    def test_budget_prefers_weighted_files(self) -> None:
+        """Verifies prioritized files survive and the rest become budget redactions."""
+        self.write("README.md", "# Project\n" + "Overview text.\n" * 20)
+        self.write("docs/guide.md", "Guide line.\n" * 20)
+        self.write("src/deep/nested/big.py", "x = [1, 2, 3]\n" * 400)
+        self.write("src/small.py", "print('small')\n")
+
+        telemetry = Telemetry()
+        scanner = RepoScanner(self.root, VisibilityMatcher(build_rules(make_args())), telemetry, None, 1 << 20, None)
+        tree, included, redacted = scanner.scan([self.root])
+        renderer = XMLRepoRenderer(self.root, telemetry, None)
+        planner = TokenBudgetPlanner(renderer, TokenWeights.parse(["md=4", "depth=1"]))
+        kept, dropped = planner.select(tree, included, redacted, [self.root], 1500)
+
+        self.assertEqual(kept, [self.root / "README.md", self.root / "docs" / "guide.md", self.root / "src" / "small.py"])
+        self.assertEqual(dropped, [(self.root / "src" / "deep" / "nested" / "big.py", "EXCEEDS_TOKEN_BUDGET")])
+        self.assertEqual((telemetry.included_files, telemetry.redacted_files), (3, 1))
+        self.assertLessEqual(telemetry.estimated_tokens, 1500)
+
+        out = io.BytesIO()
+        renderer.render(tree, kept, dropped, [self.root], out)
+        self.assertLessEqual(TokenEstimator.estimate(out.getvalue()), 1500)
+
+    def test_invalid_weight_spec(self) -> None:
+        """Verifies malformed weight specs are rejected."""
+        with self.assertRaises(ValueError):
+            TokenWeights.parse(["depth"])
+        with self.assertRaises(ValueError):
+            TokenWeights.parse([".md=high"])
+
+
+class TestByteRendering(RepoTestCase):
+    """Verifies byte accounting of the encoded output path."""
+
+    def test_multibyte_content_is_counted_exactly(self) -> None:
+        """Verifies bytes_written and --max-size count encoded bytes, not characters."""
+        for i in range(5):
+            self.write(f"docs/note_{i}.md", "\u732b\u661f \u2605\n" * 50)
+        full = self.extract()
+        self.assertEqual(self.telemetry.bytes_written, len(full.encode("utf-8")))
+
+        limit = len(full.encode("utf-8")) - 1
+        truncated = self.extract(max_bytes=limit)
+        self.assertTrue(self.telemetry.limit_reached)
+        self.assertLessEqual(self.telemetry.bytes_written, limit)
+        self.assertTrue(truncated.endswith(self.LIMIT_WARNING.decode("utf-8")))
+
+
+class TestParallelRendering(RepoTestCase):
+    """Verifies that the worker pool is indistinguishable from a serial render."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        for i in range(40):
+            self.write(f"pkg{i % 3}/module_{i:02d}.py", f"value = {i}\n" * (i + 1))
+        (self.root / "pkg0" / "blob.dat").write_bytes(b"\x00\x01binary")
+
+    def test_parallel_output_matches_serial(self) -> None:
+        """Verifies ordered output and identical telemetry with --jobs."""
+        serial = self.strip_date(self.extract(jobs=1))
+        serial_telemetry = self.telemetry
+        parallel = self.strip_date(self.extract(jobs=8))
+        self.assertEqual(serial, parallel)
+        self.assertEqual(serial_telemetry, self.telemetry)
+        self.assertNotIn("blob.dat\"", parallel)
+
+    def test_parallel_respects_max_size(self) -> None:
+        """Verifies the global byte limit truncates at the same chunk."""
+        serial = self.strip_date(self.extract(max_bytes=4096, jobs=1))
+        parallel = self.strip_date(self.extract(max_bytes=4096, jobs=4))
+        self.assertEqual(serial, parallel)
+        self.assertTrue(self.telemetry.limit_reached)
+        self.assertLessEqual(self.telemetry.bytes_written, 4096)
+
+
+if __name__ == "__main__":
+    unittest.main()